@@ -0,0 +1,68 @@
+"""
+Measure the effect of :class:`~sn2daemon.sink.BatchingSink`.
+
+Messages with a fixed number of sample batches are submitted at a fixed
+rate for some time. The number of calls to the downstream sink without and
+with batching and the latency added by the batching are reported.
+
+Run as ``python -m benchmarks.batching``.
+"""
+import argparse
+import asyncio
+
+from sn2daemon import sink
+
+
+class CountingSink(sink.Sink):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def submit_batch(self, batch):
+        self.submit_batches([batch])
+
+    def submit_batches(self, batches):
+        self.calls += 1
+
+
+async def run(rate, duration, batches_per_message, window, max_batches):
+    downstream = CountingSink()
+    batcher = sink.BatchingSink([downstream], window, max_batches)
+    messages = int(rate * duration)
+    for i in range(messages):
+        batcher.submit_batches([i] * batches_per_message)
+        await asyncio.sleep(1 / rate)
+    batcher.close()
+    return messages, downstream.calls, batcher.latency
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=100,
+                        help="Messages per second (default: 100)")
+    parser.add_argument("--duration", type=float, default=2,
+                        help="Duration in seconds (default: 2)")
+    parser.add_argument("--batches-per-message", type=int, default=1)
+    parser.add_argument("--max-batches", type=int, default=64)
+    parser.add_argument("windows", type=float, nargs="*",
+                        default=[0.05, 0.25, 1.0])
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    print("{:>8s} {:>10s} {:>10s} {:>10s} {:>12s}".format(
+        "window", "messages", "calls", "reduction", "mean latency",
+    ))
+    for window in args.windows:
+        messages, calls, latency = loop.run_until_complete(run(
+            args.rate, args.duration, args.batches_per_message,
+            window, args.max_batches,
+        ))
+        print("{:>7.3f}s {:>10d} {:>10d} {:>9.1f}x {:>10.1f}ms".format(
+            window, messages, calls, messages / calls,
+            latency.sum / latency.count * 1000,
+        ))
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compare the BME280 compensation variants of :mod:`sn2daemon.bme280`.
+
+For a batch of random readouts of a single chip, the following are timed:
+
+``scalar``
+    the floating point functions, one readout at a time,
+``scalar-int``
+    the fixed point methods, one readout at a time,
+``batch``
+    :func:`~sn2daemon.bme280.compensate_batch` with floating point formulas,
+``batch-int``
+    :func:`~sn2daemon.bme280.compensate_batch` with fixed point formulas.
+
+Run as ``python -m benchmarks.bme280``.
+"""
+import argparse
+import os
+import timeit
+
+from sn2daemon import bme280
+
+
+# calibration from the example in the datasheet
+CALIBRATION = bme280.Calibration((
+    27504, 26435, -1000,
+    36477, -10685, 3024, 2855, 140, -7, 15500, -14600, 6000,
+    75, 362, 0, 313, 50, 30,
+))
+
+
+def scalar(readouts):
+    for temp_raw, pressure_raw, humidity_raw in readouts:
+        temperature = bme280.compensate_temperature(CALIBRATION, temp_raw)
+        bme280.compensate_pressure(CALIBRATION, pressure_raw, temperature)
+        bme280.compensate_humidity(CALIBRATION, humidity_raw, temperature)
+
+
+def scalar_int(readouts):
+    for temp_raw, pressure_raw, humidity_raw in readouts:
+        _, t_fine = CALIBRATION.temperature_int32(temp_raw)
+        CALIBRATION.pressure_int64(pressure_raw, t_fine)
+        CALIBRATION.humidity_int32(humidity_raw, t_fine)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--readouts",
+        type=int,
+        default=100000,
+        help="Readouts per batch (default: 100000)",
+    )
+    args = parser.parse_args()
+
+    buf = os.urandom(8 * args.readouts)
+    readouts = [
+        bme280.get_readout(buf[i:i+8])
+        for i in range(0, len(buf), 8)
+    ]
+    arrays = bme280.get_readouts(buf)
+
+    cases = [
+        ("scalar", lambda: scalar(readouts)),
+        ("scalar-int", lambda: scalar_int(readouts)),
+        ("batch", lambda: bme280.compensate_batch(CALIBRATION, *arrays)),
+        ("batch-int", lambda: bme280.compensate_batch(
+            CALIBRATION, *arrays, fixed_point=True)),
+    ]
+
+    print("{:<12} {:>12} {:>14}".format("variant", "ns/readout",
+                                         "readouts/s"))
+    for name, func in cases:
+        t = min(timeit.repeat(func, number=1, repeat=3)) / args.readouts
+        print("{:<12} {:>12.1f} {:>14.0f}".format(name, t * 1e9, 1 / t))
+
+
+if __name__ == "__main__":
+    main()
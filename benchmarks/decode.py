@@ -0,0 +1,199 @@
+"""
+Microbenchmarks for the SBX message decoders.
+
+The corpus contains a message of each :class:`~sn2daemon.sbx_protocol.MsgType`
+(a status message for each status version) and an ESP status frame, built
+with the helpers in :mod:`tests.sbx_messages`. For each message, three
+stages are measured:
+
+``decode``
+    :func:`~sn2daemon.sbx_protocol.decode_sbx_message` on the full message,
+``from_buf``
+    the ``from_buf`` class method of the message class on the payload,
+``get_samples``
+    ``list(msg.get_samples())`` on an already decoded message.
+
+For every stage, the time and the number of memory blocks allocated (and
+kept alive) per message, as well as the resulting throughput, are reported.
+With ``--output``, the results are written as JSON; ``--compare`` prints the
+change relative to an earlier result file.
+
+Run as ``python -m benchmarks.decode``.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+
+from sn2daemon import sbx_protocol
+from sn2daemon.sbx_protocol import MsgType
+
+from tests import sbx_messages
+
+
+def _sbx_case(name, buf):
+    type_ = MsgType(buf[0])
+    cls = sbx_protocol.msgtype_to_cls[type_]
+    return name, {
+        "decode": lambda: sbx_protocol.decode_sbx_message(buf),
+        "from_buf": lambda: cls.from_buf(type_, buf[1:]),
+    }
+
+
+def _esp_status_case():
+    buf = sbx_messages.pack_esp_status()
+    rtc = time.time()
+
+    def from_buf():
+        return sbx_protocol.ESPStatusMessage.from_buf(rtc, buf)
+
+    # ESP status frames do not go through decode_sbx_message
+    return "ESP_STATUS", {"decode": from_buf, "from_buf": from_buf}
+
+
+def make_corpus():
+    """
+    Return a list of ``(name, stages)`` tuples, where `stages` maps
+    ``"decode"`` and ``"from_buf"`` to functions decoding the message.
+    """
+    corpus = [
+        _sbx_case("STATUS_v{}".format(status_version),
+                  sbx_messages.pack_status(status_version))
+        for status_version in range(1, 7)
+    ]
+    corpus.append(_sbx_case("SENSOR_DS18B20", sbx_messages.pack_ds18b20()))
+    corpus.append(_sbx_case("SENSOR_LIGHT", sbx_messages.pack_light()))
+    corpus.append(_sbx_case("SENSOR_NOISE", sbx_messages.pack_noise()))
+    corpus.append(_sbx_case("SENSOR_BME280", sbx_messages.pack_bme280()))
+    corpus.extend(
+        _sbx_case(type_.name, sbx_messages.pack_sensor_stream(type_))
+        for type_ in MsgType
+        if type_.name.startswith("SENSOR_STREAM_")
+    )
+    corpus.append(_esp_status_case())
+    return corpus
+
+
+def time_per_call(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def blocks_per_call(func, number):
+    func()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        results = [func() for _ in range(number)]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del results
+    blocks = sum(
+        stat.count_diff
+        for stat in after.compare_to(before, "filename")
+    )
+    return blocks / number
+
+
+def measure(func, number):
+    seconds = time_per_call(func, number)
+    return {
+        "ns_per_msg": seconds * 1e9,
+        "msgs_per_s": 1 / seconds,
+        "blocks_per_msg": blocks_per_call(func, min(number, 1000)),
+    }
+
+
+def run(number):
+    results = {}
+    for name, stages in make_corpus():
+        entry = {}
+        for stage, func in stages.items():
+            entry[stage] = measure(func, number)
+
+        msg = stages["decode"]()
+        if hasattr(msg, "get_samples"):
+            entry["get_samples"] = measure(
+                lambda: list(msg.get_samples()),
+                number,
+            )
+            entry["get_samples"]["samples_per_msg"] = \
+                len(list(msg.get_samples()))
+
+        results[name] = entry
+    return results
+
+
+def print_results(results, reference=None):
+    print("{:<24} {:<12} {:>12} {:>12} {:>10} {:>8}".format(
+        "message", "stage", "ns/msg", "msgs/s", "blocks", "change",
+    ))
+    for name, entry in results.items():
+        for stage, values in entry.items():
+            change = ""
+            try:
+                old = reference[name][stage]["ns_per_msg"]
+            except (TypeError, KeyError):
+                pass
+            else:
+                change = "{:+.1f}%".format(
+                    (values["ns_per_msg"] / old - 1) * 100
+                )
+            print("{:<24} {:<12} {:>12.0f} {:>12.0f} {:>10.2f} {:>8}".format(
+                name, stage,
+                values["ns_per_msg"],
+                values["msgs_per_s"],
+                values["blocks_per_msg"],
+                change,
+            ))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--number",
+        type=int,
+        default=10000,
+        help="Calls per measurement (default: 10000)",
+    )
+    parser.add_argument(
+        "-o", "--output",
+        metavar="FILE",
+        help="Write the results as JSON to FILE",
+    )
+    parser.add_argument(
+        "-c", "--compare",
+        metavar="FILE",
+        help="Show the change relative to the results in FILE",
+    )
+    args = parser.parse_args()
+
+    reference = None
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)["results"]
+
+    results = run(args.number)
+    print_results(results, reference)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "python": sys.version,
+                    "platform": platform.platform(),
+                    "numpy": sbx_protocol.numpy is not None,
+                    "number": args.number,
+                    "timestamp": time.time(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Loss simulation comparing plain retransmission with FEC.
+
+Two :class:`~sn2daemon.datagram_stream.DatagramStreamProtocol` instances are
+connected through an in-process link with configurable latency and loss.
+Each frame carries its send time; the receiver records the time until it is
+delivered in order.
+
+Run as ``python -m benchmarks.fec``.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import struct
+import time
+
+from sn2daemon import datagram_stream
+
+
+frame_fmt = struct.Struct(
+    "<"
+    "L"  # frame counter
+    "d"  # send timestamp
+)
+
+
+class LossyLink:
+    def __init__(self, loop, peer, addr, latency, loss, rng):
+        super().__init__()
+        self._loop = loop
+        self._peer = peer
+        self._addr = addr
+        self._latency = latency
+        self._loss = loss
+        self._rng = rng
+
+    def sendto(self, packet, dest):
+        if self._rng.random() < self._loss:
+            return
+        self._loop.call_later(
+            self._latency,
+            self._peer.datagram_received,
+            packet,
+            self._addr,
+        )
+
+    def get_extra_info(self, name):
+        return None
+
+
+async def simulate(args, fec_group_size):
+    loop = asyncio.get_event_loop()
+    rng = random.Random(args.seed)
+
+    sender = datagram_stream.DatagramStreamProtocol(
+        1,
+        tx_max_buffer_size=args.max_buffer_size,
+        fec_group_size=fec_group_size,
+    )
+    receiver = datagram_stream.DatagramStreamProtocol(
+        2,
+        fec_group_size=fec_group_size,
+    )
+    sender._transport = LossyLink(loop, receiver, "sender",
+                                  args.latency, args.loss, rng)
+    receiver._transport = LossyLink(loop, sender, "receiver",
+                                    args.latency, args.loss, rng)
+
+    latencies = {}
+
+    def data_received(payload):
+        ctr, sent = frame_fmt.unpack(payload)
+        latencies.setdefault(ctr, time.monotonic() - sent)
+
+    receiver.on_data_received.connect(data_received)
+
+    for i in range(args.count):
+        await sender.drain()
+        sender.send_frame(frame_fmt.pack(i, time.monotonic()))
+        await asyncio.sleep(1 / args.rate)
+
+    await asyncio.sleep(args.latency * 4)
+
+    return {
+        "delivered": len(latencies),
+        "latencies": sorted(latencies.values()),
+        "tx_fec_sent": sender.tx_fec_sent,
+        "rx_fec_recovered": receiver.rx_fec_recovered,
+        "rx_fec_unrecoverable": receiver.rx_fec_unrecoverable,
+        "tx_retransmit_count": sender.tx_retransmit_count,
+        "tx_dropped": sender.tx_dropped,
+    }
+
+
+def print_result(name, args, result):
+    latencies = result["latencies"]
+    print(name)
+    print(" delivered            = {} ({:.1f}%)".format(
+        result["delivered"],
+        result["delivered"] / args.count * 100,
+    ))
+    if latencies:
+        print(" latency mean         = {:.1f} ms".format(
+            statistics.mean(latencies) * 1000,
+        ))
+        print(" latency p99          = {:.1f} ms".format(
+            latencies[int(len(latencies) * 0.99)] * 1000,
+        ))
+        print(" latency max          = {:.1f} ms".format(
+            latencies[-1] * 1000,
+        ))
+    for key in ["tx_retransmit_count", "tx_dropped", "tx_fec_sent",
+                "rx_fec_recovered", "rx_fec_unrecoverable"]:
+        print(" {:<20s} = {}".format(key.replace("_", " "), result[key]))
+
+
+async def amain(args):
+    print_result("plain retransmission", args, await simulate(args, None))
+    print_result("fec (group size {})".format(args.group_size), args,
+                 await simulate(args, args.group_size))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--loss", type=float, default=0.1)
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="one-way latency in seconds")
+    parser.add_argument("--rate", type=float, default=100,
+                        help="frames per second")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--group-size", type=int, default=4)
+    parser.add_argument("--max-buffer-size", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    asyncio.run(amain(args))
+
+
+if __name__ == "__main__":
+    main()
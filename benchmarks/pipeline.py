@@ -0,0 +1,122 @@
+"""
+Compare the throughput of the sample pipeline with the generator chain.
+
+For each message type with samples, the samples of a decoded message are
+turned into sample batches both with the chain of generators the daemon
+used before (:func:`~sn2daemon.daemon.deenumify_samples`, individual
+rewriter, :func:`~sn2daemon.daemon.rtcify_samples`,
+:func:`~sn2daemon.daemon.batch_samples`, batch rewriter) and with
+:class:`~sn2daemon.daemon.SamplePipeline`, and the samples per second are
+reported. The rewriters pass everything through unchanged, so that only the
+overhead of the pipeline itself is measured.
+
+Run as ``python -m benchmarks.pipeline``.
+"""
+import argparse
+import logging
+import timeit
+
+from datetime import datetime
+
+from hintlib import timeline
+
+from sn2daemon import daemon, sbx_protocol
+
+from tests import sbx_messages
+
+
+class PassThroughRewriter:
+    def rewrite(self, item):
+        return item
+
+
+def make_rtcifier():
+    rtcifier = timeline.RTCifier(
+        timeline.Timeline(2**16, 30000),
+        logging.getLogger("benchmark"),
+    )
+    rtcifier.align(datetime.utcnow(), 0)
+    return rtcifier
+
+
+def make_corpus():
+    messages = [
+        ("SENSOR_DS18B20", sbx_messages.pack_ds18b20()),
+        ("SENSOR_LIGHT", sbx_messages.pack_light()),
+        ("SENSOR_NOISE", sbx_messages.pack_noise()),
+        ("SENSOR_BME280", sbx_messages.pack_bme280()),
+    ]
+    corpus = [
+        (name, sbx_protocol.decode_sbx_message(buf))
+        for name, buf in messages
+    ]
+    corpus.append((
+        "ESP_STATUS",
+        sbx_protocol.ESPStatusMessage.from_buf(
+            datetime.utcnow(),
+            sbx_messages.pack_esp_status(),
+        ),
+    ))
+    return corpus
+
+
+def run_chain(samples, rewriter, rtcifier):
+    return list(map(
+        rewriter.rewrite,
+        daemon.batch_samples(
+            daemon.rtcify_samples(
+                map(rewriter.rewrite, daemon.deenumify_samples(samples)),
+                rtcifier,
+            )
+        )
+    ))
+
+
+def measure(func, nsamples, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    return nsamples / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--number",
+        type=int,
+        default=10000,
+        help="Messages per measurement (default: 10000)",
+    )
+    args = parser.parse_args()
+
+    rewriter = PassThroughRewriter()
+    rtcifier = make_rtcifier()
+    pipeline = daemon.SamplePipeline(rewriter, rewriter, rtcifier)
+
+    print("{:<16} {:>8} {:>14} {:>14} {:>8}".format(
+        "message", "samples", "chain/s", "pipeline/s", "speedup",
+    ))
+    for name, msg in make_corpus():
+        samples = list(msg.get_samples())
+        assert (pipeline.process(samples) ==
+                run_chain(samples, rewriter, rtcifier))
+
+        chain_rate = measure(
+            lambda: run_chain(samples, rewriter, rtcifier),
+            len(samples),
+            args.number,
+        )
+        pipeline_rate = measure(
+            lambda: pipeline.process(samples),
+            len(samples),
+            args.number,
+        )
+        print("{:<16} {:>8} {:>14.0f} {:>14.0f} {:>7.2f}x".format(
+            name,
+            len(samples),
+            chain_rate,
+            pipeline_rate,
+            pipeline_rate / chain_rate,
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Measure the memory allocated for the samples of each message type.
+
+For each message type, the samples of a number of messages are generated
+with ``get_samples()`` and passed through
+:func:`sn2daemon.daemon.deenumify_samples`. All samples are kept alive and
+the blocks and bytes allocated per sample are reported with
+:mod:`tracemalloc`.
+
+Run as ``python -m benchmarks.sample_paths``.
+"""
+import argparse
+import os
+import tracemalloc
+
+from sn2daemon import sbx_protocol
+from sn2daemon.daemon import deenumify_samples
+
+
+def make_bme280(i):
+    return sbx_protocol.BME280Message(i, 21.5, 100132.2, 45.2,
+                                      instance=i % 2)
+
+
+def make_ds18b20(i, ids=[os.urandom(8) for _ in range(4)]):
+    return sbx_protocol.DS18B20Message(i, [(id_, 20.5) for id_ in ids])
+
+
+def make_light(i):
+    return sbx_protocol.LightMessage(
+        [(i * 8 + j, (10, 20, 30, 40)) for j in range(8)]
+    )
+
+
+def make_noise(i):
+    return sbx_protocol.NoiseMessage(
+        [(i * 8 + j, 1000, -100, 100) for j in range(8)]
+    )
+
+
+def make_esp_status(i):
+    return sbx_protocol.ESPStatusMessage(i, *range(8))
+
+
+CASES = [
+    ("SENSOR_BME280", make_bme280),
+    ("SENSOR_DS18B20", make_ds18b20),
+    ("SENSOR_LIGHT", make_light),
+    ("SENSOR_NOISE", make_noise),
+    ("ESP_STATUS", make_esp_status),
+]
+
+
+def measure(make, nmessages):
+    messages = [make(i) for i in range(nmessages)]
+    # warm up caches, so that only the steady state is measured
+    list(deenumify_samples(messages[0].get_samples()))
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = [
+            s
+            for msg in messages
+            for s in deenumify_samples(msg.get_samples())
+        ]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    return len(result), blocks, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--messages",
+        type=int,
+        default=1000,
+        help="Messages per message type (default: 1000)",
+    )
+    args = parser.parse_args()
+
+    print("{:<16} {:>8} {:>14} {:>14}".format(
+        "type", "samples", "blocks/sample", "bytes/sample",
+    ))
+    for name, make in CASES:
+        nsamples, blocks, size = measure(make, args.messages)
+        print("{:<16} {:>8} {:>14.2f} {:>14.1f}".format(
+            name, nsamples, blocks / nsamples, size / nsamples,
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Compare the struct decoders of :mod:`sn2daemon.sbx_protocol` with the cffi
+views of :mod:`sn2daemon.sbx_views`.
+
+For each message type with a view, three access patterns are timed:
+
+``decode``
+    only decoding the message,
+``header``
+    decoding and reading the fields the daemon always needs,
+``full``
+    decoding and reading all data.
+
+Run as ``python -m benchmarks.sbx_views``.
+"""
+import argparse
+import functools
+import timeit
+
+from sn2daemon import sbx_protocol, sbx_views
+
+from tests import sbx_messages
+
+
+def read_status_header(obj):
+    return (obj.uptime, obj.v1_accel_stream_state,
+            obj.v1_compass_stream_state)
+
+
+def read_status_full(obj):
+    return read_status_header(obj) + (
+        obj.v2_i2c_metrics,
+        obj.v4_bme280_metrics,
+        obj.v5_tx_metrics,
+        obj.v6_cpu_metrics,
+    )
+
+
+def read_samples(obj):
+    return list(obj.get_samples())
+
+
+def read_stream_header(obj):
+    return obj.seq, obj.path
+
+
+def read_stream_full(obj):
+    return obj.seq, obj.data
+
+
+CASES = [
+    ("STATUS", functools.partial(sbx_messages.pack_status, 6),
+     read_status_header, read_status_full),
+    ("SENSOR_DS18B20", functools.partial(sbx_messages.pack_ds18b20, 8),
+     lambda obj: obj.timestamp, read_samples),
+    ("SENSOR_LIGHT", sbx_messages.pack_light,
+     lambda obj: obj.type_, read_samples),
+    ("SENSOR_STREAM", sbx_messages.pack_sensor_stream,
+     read_stream_header, read_stream_full),
+]
+
+
+def measure(decode, access, buf, number):
+    def run():
+        access(decode(buf))
+
+    return min(timeit.repeat(run, number=number, repeat=5)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--number",
+        type=int,
+        default=10000,
+        help="Decodes per measurement (default: 10000)",
+    )
+    args = parser.parse_args()
+
+    backends = [
+        ("struct", sbx_protocol.decode_sbx_message),
+        ("cffi", sbx_views.decode_sbx_message),
+    ]
+
+    print("{:<16} {:<8} {:>10} {:>10} {:>10}".format(
+        "type", "backend", "decode", "header", "full",
+    ))
+    for name, make, header, full in CASES:
+        buf = make()
+        for backend, decode in backends:
+            timings = [
+                measure(decode, access, buf, args.number)
+                for access in (lambda obj: None, header, full)
+            ]
+            print("{:<16} {:<8} {}".format(
+                name,
+                backend,
+                " ".join(
+                    "{:>8.2f}us".format(t * 1e6) for t in timings
+                ),
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,11 @@
+import collections
 import struct
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 Dig88 = struct.Struct(
     "<"
@@ -25,7 +31,277 @@ def get_calibration(dig88, dige1):
 
     values += dig_H4, dig_H5, dig_H6
 
-    return values
+    return Calibration(values)
+
+
+class Calibration:
+    """
+    Calibration of a single BME280 chip.
+
+    :param values: The 18 calibration values as returned by
+        :func:`get_calibration`.
+
+    The constant parts of the floating point compensation formulas from the
+    datasheet are computed once on construction. Only multiplications and
+    divisions by powers of two are folded, so the results are bit-identical
+    to evaluating the formulas as written.
+    """
+
+    __slots__ = (
+        "values",
+        "_t1_1024", "_t1_8192", "_t2", "_t3",
+        "_p1", "_p2", "_p3", "_p4", "_p5", "_p6", "_p7", "_p8", "_p9",
+        "_h1", "_h2", "_h3", "_h4", "_h5", "_h6",
+    )
+
+    def __init__(self, values):
+        self.values = tuple(values)
+        (dig_T1, dig_T2, dig_T3,
+         dig_P1, dig_P2, dig_P3, dig_P4, dig_P5, dig_P6, dig_P7, dig_P8,
+         dig_P9,
+         dig_H1, dig_H2, dig_H3, dig_H4, dig_H5, dig_H6) = self.values
+
+        self._t1_1024 = dig_T1 / 1024
+        self._t1_8192 = dig_T1 / 8192
+        self._t2 = dig_T2
+        self._t3 = dig_T3
+
+        self._p1 = dig_P1
+        self._p2 = dig_P2
+        self._p3 = dig_P3 / 524288
+        self._p4 = dig_P4 * 65536
+        self._p5 = dig_P5 * 2
+        self._p6 = dig_P6 / 32768
+        self._p7 = dig_P7
+        self._p8 = dig_P8 / 32768
+        self._p9 = dig_P9 / 2147483648
+
+        self._h1 = dig_H1 / 524288
+        self._h2 = dig_H2 / 65536
+        self._h3 = dig_H3 / 67108864
+        self._h4 = dig_H4 * 64
+        self._h5 = dig_H5 / 16384
+        self._h6 = dig_H6 / 67108864
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __eq__(self, other):
+        if isinstance(other, Calibration):
+            return self.values == other.values
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.values)
+
+    def temperature(self, raw):
+        var1 = (raw / 16384 - self._t1_1024) * self._t2
+        var2 = raw / 131072 - self._t1_8192
+        var2 = (var2 * var2) * self._t3
+        return (var1 + var2) / 5120
+
+    def pressure(self, raw, temp):
+        t_fine = int(temp * 5120)
+        var1 = t_fine / 2 - 64000
+        var2 = var1 * var1 * self._p6
+        var2 = var2 + var1 * self._p5
+        var2 = var2 / 4 + self._p4
+        var1 = (self._p3 * var1 * var1 + self._p2 * var1) / 524288
+        var1 = (1 + var1 / 32768) * self._p1
+        if var1 == 0:
+            return 0
+        p = 1048576 - raw
+        p = ((p - var2 / 4096) * 6250) / var1
+        var1 = self._p9 * p * p
+        var2 = p * self._p8
+        return p + (var1 + var2 + self._p7) / 16
+
+    def humidity(self, raw, temp):
+        t_fine = int(temp * 5120)
+        h = t_fine - 76800
+        h = (
+            (raw - (self._h4 + self._h5 * h)) *
+            (self._h2 * (1 + self._h6 * h * (1 + self._h3 * h)))
+        )
+        return h * (1 - self._h1 * h)
+
+    def temperature_int32(self, raw):
+        """
+        Compensate a temperature readout with the 32 bit fixed point formula
+        of the datasheet.
+
+        :return: The temperature in units of 0.01 °C and the ``t_fine``
+            value required by :meth:`pressure_int64` and
+            :meth:`humidity_int32`.
+        """
+        dig_T1, dig_T2, dig_T3 = self.values[:3]
+        var1 = _s32(((raw >> 3) - (dig_T1 << 1)) * dig_T2) >> 11
+        var2 = (raw >> 4) - dig_T1
+        var2 = _s32((_s32(var2 * var2) >> 12) * dig_T3) >> 14
+        t_fine = _s32(var1 + var2)
+        return _s32(t_fine * 5 + 128) >> 8, t_fine
+
+    def pressure_int64(self, raw, t_fine):
+        """
+        Compensate a pressure readout with the 64 bit fixed point formula of
+        the datasheet.
+
+        :return: The pressure in units of 1/256 Pa.
+        """
+        (dig_P1, dig_P2, dig_P3, dig_P4, dig_P5, dig_P6, dig_P7, dig_P8,
+         dig_P9) = self.values[3:12]
+        var1 = t_fine - 128000
+        var2 = _s64(_s64(var1 * var1) * dig_P6)
+        var2 = _s64(var2 + _s64(_s64(var1 * dig_P5) << 17))
+        var2 = _s64(var2 + (dig_P4 << 35))
+        var1 = _s64(
+            (_s64(_s64(var1 * var1) * dig_P3) >> 8) +
+            _s64(_s64(var1 * dig_P2) << 12)
+        )
+        var1 = _s64(((1 << 47) + var1) * dig_P1) >> 33
+        if var1 == 0:
+            return 0
+        p = 1048576 - raw
+        p = _div64(_s64((_s64(p << 31) - var2) * 3125), var1)
+        var1 = _s64(_s64(dig_P9 * (p >> 13)) * (p >> 13)) >> 25
+        var2 = _s64(dig_P8 * p) >> 19
+        p = _s64((_s64(p + var1 + var2) >> 8) + (dig_P7 << 4))
+        return p & 0xffffffff
+
+    def humidity_int32(self, raw, t_fine):
+        """
+        Compensate a humidity readout with the 32 bit fixed point formula of
+        the datasheet.
+
+        :return: The relative humidity in units of 1/1024 %.
+        """
+        dig_H1, dig_H2, dig_H3, dig_H4, dig_H5, dig_H6 = self.values[12:]
+        v = _s32(t_fine - 76800)
+        x = _s32(
+            _s32(_s32(raw << 14) - _s32(dig_H4 << 20)) - _s32(dig_H5 * v)
+        )
+        x = _s32(x + 16384) >> 15
+        y = _s32(
+            (_s32(v * dig_H6) >> 10) *
+            ((_s32(v * dig_H3) >> 11) + 32768)
+        )
+        y = _s32((y >> 10) + 2097152)
+        y = _s32(y * dig_H2 + 8192) >> 14
+        v = _s32(x * y)
+        v = _s32(
+            v - (_s32((_s32((v >> 15) * (v >> 15)) >> 7) * dig_H1) >> 4)
+        )
+        v = min(max(v, 0), 419430400)
+        return v >> 12
+
+
+def _s32(v):
+    return ((v + 0x80000000) & 0xffffffff) - 0x80000000
+
+
+def _s64(v):
+    return ((v + 0x8000000000000000) & 0xffffffffffffffff) - \
+        0x8000000000000000
+
+
+def _div64(a, b):
+    # C division, truncating towards zero
+    q = abs(a) // abs(b)
+    return _s64(-q if (a < 0) != (b < 0) else q)
+
+
+class CalibrationCache:
+    """
+    Cache of :class:`Calibration` objects by sensor instance and raw
+    calibration bytes.
+
+    :param max_size: Maximum number of calibrations to keep. The least
+        recently used calibration is evicted first.
+
+    The calibration is transmitted with every BME280 reading, but never
+    changes for a given chip. Since several chips may share an instance
+    number, for example instance 0 on every node of a multi-node daemon,
+    entries are keyed by the instance together with the bytes the
+    calibration was parsed from.
+
+    .. attribute:: hits
+
+       Number of lookups answered from the cache.
+
+    .. attribute:: misses
+
+       Number of lookups which required parsing the calibration.
+    """
+
+    def __init__(self, max_size=256):
+        super().__init__()
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, instance, dig88, dige1):
+        """
+        Return the calibration for `instance` from the raw calibration
+        blocks `dig88` and `dige1`.
+        """
+        key = instance, bytes(dig88), bytes(dige1)
+        try:
+            calibration = self._entries[key]
+        except KeyError:
+            pass
+        else:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return calibration
+
+        self.misses += 1
+        calibration = get_calibration(dig88, dige1)
+        if len(self._entries) >= self.max_size:
+            self._entries.popitem(last=False)
+        self._entries[key] = calibration
+        return calibration
+
+    def clear(self):
+        self._entries.clear()
+
+    def register_metrics(self, registry, prefix="sn2d_bme280_calibration_"):
+        """
+        Register the cache counters with a :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        registry.counter_func(
+            prefix + "hits_total",
+            "Calibration lookups answered from the cache",
+            lambda: self.hits,
+        )
+        registry.counter_func(
+            prefix + "misses_total",
+            "Calibration lookups which required parsing",
+            lambda: self.misses,
+        )
+        registry.gauge_func(
+            prefix + "entries",
+            "Calibrations in the cache",
+            lambda: len(self._entries),
+        )
+
+
+#: Calibration cache used by :class:`~.sbx_protocol.BME280Message`.
+calibration_cache = CalibrationCache()
+
+
+def _as_calibration(calibration):
+    if isinstance(calibration, Calibration):
+        return calibration
+    return Calibration(calibration)
 
 
 def get_readout(readout):
@@ -36,51 +312,158 @@ def get_readout(readout):
 
 
 def compensate_temperature(calibration, raw):
-    dig_T1, dig_T2, dig_T3 = calibration[:3]
-
-    UT = raw
-    var1 = (UT / 16384 - dig_T1 / 1024) * dig_T2
-    var2 = ((UT / 131072 - dig_T1 / 8192) * (
-            UT / 131072 - dig_T1 / 8192)) * dig_T3
-    return (var1 + var2) / 5120
+    return _as_calibration(calibration).temperature(raw)
 
 
 def compensate_pressure(calibration, raw, temp):
-    dig_P1, dig_P2, dig_P3, dig_P4, dig_P5, dig_P6, dig_P7, dig_P8, dig_P9 = \
-        calibration[3:12]
-
-    adc = raw
-    t_fine = int(temp * 5120)
-    var1 = t_fine / 2 - 64000
-    var2 = var1 * var1 * dig_P6 / 32768
-    var2 = var2 + var1 * dig_P5 * 2
-    var2 = var2 / 4 + dig_P4 * 65536
-    var1 = (
-        dig_P3 * var1 * var1 / 524288 +
-        dig_P2 * var1
-    ) / 524288
-    var1 = (1 + var1 / 32768) * dig_P1
-    if var1 == 0:
-        return 0
-    p = 1048576 - adc
-    p = ((p - var2 / 4096) * 6250) / var1
-    var1 = dig_P9 * p * p / 2147483648
-    var2 = p * dig_P8 / 32768
-    p = p + (var1 + var2 + dig_P7) / 16
-    return p
+    return _as_calibration(calibration).pressure(raw, temp)
 
 
 def compensate_humidity(calibration, raw, temp):
-    dig_H1, dig_H2, dig_H3, dig_H4, dig_H5, dig_H6 = \
-        calibration[12:]
+    return _as_calibration(calibration).humidity(raw, temp)
+
+
+def _require_numpy():
+    if numpy is None:
+        raise RuntimeError("batch compensation requires NumPy")
+
+
+def get_readouts(readouts):
+    """
+    Split raw readouts into the temperature, pressure and humidity ADC
+    values.
+
+    :param readouts: The 8 byte readouts as used by :func:`get_readout`,
+        either concatenated in a bytes-like object or as an array of shape
+        ``(N, 8)``.
+    :return: Three :class:`numpy.ndarray` of :class:`numpy.int32`.
+    """
+    _require_numpy()
+    readouts = numpy.asarray(
+        numpy.frombuffer(readouts, dtype=numpy.uint8)
+        if isinstance(readouts, (bytes, bytearray, memoryview))
+        else readouts,
+        dtype=numpy.int32,
+    ).reshape(-1, 8)
+    pressure_raw = ((readouts[:, 0] << 16) | (readouts[:, 1] << 8) |
+                    readouts[:, 2]) >> 4
+    temp_raw = ((readouts[:, 3] << 16) | (readouts[:, 4] << 8) |
+                readouts[:, 5]) >> 4
+    humidity_raw = (readouts[:, 6] << 8) | readouts[:, 7]
+    return temp_raw, pressure_raw, humidity_raw
+
+
+def _compensate_batch_float(c, temp_raw, pressure_raw, humidity_raw):
+    temp_raw = numpy.asarray(temp_raw, dtype=numpy.float64)
+    pressure_raw = numpy.asarray(pressure_raw, dtype=numpy.float64)
+    humidity_raw = numpy.asarray(humidity_raw, dtype=numpy.float64)
+
+    var1 = (temp_raw / 16384 - c._t1_1024) * c._t2
+    var2 = temp_raw / 131072 - c._t1_8192
+    var2 = (var2 * var2) * c._t3
+    temperature = (var1 + var2) / 5120
+
+    t_fine = numpy.trunc(temperature * 5120)
+
+    var1 = t_fine / 2 - 64000
+    var2 = var1 * var1 * c._p6
+    var2 = var2 + var1 * c._p5
+    var2 = var2 / 4 + c._p4
+    var1 = (c._p3 * var1 * var1 + c._p2 * var1) / 524288
+    var1 = (1 + var1 / 32768) * c._p1
+    zero = var1 == 0
+    p = 1048576 - pressure_raw
+    p = ((p - var2 / 4096) * 6250) / numpy.where(zero, 1, var1)
+    var1 = c._p9 * p * p
+    var2 = p * c._p8
+    pressure = numpy.where(zero, 0, p + (var1 + var2 + c._p7) / 16)
 
-    adc = raw
-    t_fine = int(temp * 5120)
     h = t_fine - 76800
     h = (
-        (adc - (dig_H4 * 64 + dig_H5 / 16384 * h)) *
-        (dig_H2 / 65536 * (1 + dig_H6 / 67108864 * h *
-                           (1 + dig_H3 / 67108864 * h)))
+        (humidity_raw - (c._h4 + c._h5 * h)) *
+        (c._h2 * (1 + c._h6 * h * (1 + c._h3 * h)))
+    )
+    humidity = h * (1 - c._h1 * h)
+
+    return temperature, pressure, humidity
+
+
+def _trunc_div(a, b):
+    q = numpy.abs(a) // numpy.abs(b)
+    return numpy.where((a < 0) != (b < 0), -q, q)
+
+
+def _compensate_batch_int(c, temp_raw, pressure_raw, humidity_raw):
+    # NumPy integer arrays wrap around on overflow like the firmware does
+    (dig_T1, dig_T2, dig_T3,
+     dig_P1, dig_P2, dig_P3, dig_P4, dig_P5, dig_P6, dig_P7, dig_P8, dig_P9,
+     dig_H1, dig_H2, dig_H3, dig_H4, dig_H5, dig_H6) = c.values
+    i32, i64 = numpy.int32, numpy.int64
+    temp_raw = numpy.asarray(temp_raw, dtype=i32)
+    pressure_raw = numpy.asarray(pressure_raw, dtype=i64)
+    humidity_raw = numpy.asarray(humidity_raw, dtype=i32)
+
+    var1 = (((temp_raw >> 3) - i32(dig_T1 << 1)) * i32(dig_T2)) >> 11
+    var2 = (temp_raw >> 4) - i32(dig_T1)
+    var2 = (((var2 * var2) >> 12) * i32(dig_T3)) >> 14
+    t_fine = var1 + var2
+    temperature = (t_fine * 5 + 128) >> 8
+
+    var1 = t_fine.astype(i64) - 128000
+    var2 = var1 * var1 * i64(dig_P6)
+    var2 = var2 + ((var1 * i64(dig_P5)) << 17)
+    var2 = var2 + i64(dig_P4 << 35)
+    var1 = ((var1 * var1 * i64(dig_P3)) >> 8) + ((var1 * i64(dig_P2)) << 12)
+    var1 = ((i64(1 << 47) + var1) * i64(dig_P1)) >> 33
+    zero = var1 == 0
+    p = 1048576 - pressure_raw
+    p = _trunc_div(((p << 31) - var2) * 3125, numpy.where(zero, 1, var1))
+    var1 = (i64(dig_P9) * (p >> 13) * (p >> 13)) >> 25
+    var2 = (i64(dig_P8) * p) >> 19
+    p = ((p + var1 + var2) >> 8) + i64(dig_P7 << 4)
+    pressure = numpy.where(zero, 0, p & 0xffffffff)
+
+    v = t_fine - i32(76800)
+    x = (((humidity_raw << 14) - (i32(dig_H4) << 20) - i32(dig_H5) * v) +
+         i32(16384)) >> 15
+    y = ((v * i32(dig_H6)) >> 10) * (((v * i32(dig_H3)) >> 11) + i32(32768))
+    y = (((y >> 10) + i32(2097152)) * i32(dig_H2) + i32(8192)) >> 14
+    v = x * y
+    v = v - (((((v >> 15) * (v >> 15)) >> 7) * i32(dig_H1)) >> 4)
+    humidity = numpy.clip(v, 0, 419430400) >> 12
+
+    return temperature, pressure, humidity
+
+
+def compensate_batch(calibration, temp_raw, pressure_raw, humidity_raw, *,
+                     fixed_point=False):
+    """
+    Compensate arrays of readouts of a single chip.
+
+    :param calibration: The calibration of the chip.
+    :param temp_raw: Raw temperature values.
+    :param pressure_raw: Raw pressure values.
+    :param humidity_raw: Raw humidity values.
+    :param fixed_point: If true, use the fixed point formulas of the
+        datasheet instead of the floating point ones.
+    :return: Arrays of the temperature in °C, the pressure in Pa and the
+        relative humidity in %.
+
+    The raw values can be obtained with :func:`get_readouts`. The floating
+    point results are identical to those of the scalar functions; the fixed
+    point results are identical to the ``*_int32`` and ``*_int64`` methods
+    of :class:`Calibration`, scaled to the same units as the floating point
+    results. Within the operating range of the sensor, the two variants
+    differ by at most 0.01 °C, 1 Pa and 0.02 %.
+    """
+    _require_numpy()
+    calibration = _as_calibration(calibration)
+    if not fixed_point:
+        return _compensate_batch_float(
+            calibration, temp_raw, pressure_raw, humidity_raw,
+        )
+
+    temperature, pressure, humidity = _compensate_batch_int(
+        calibration, temp_raw, pressure_raw, humidity_raw,
     )
-    h = h * (1 - dig_H1 * h / 524288)
-    return h
+    return temperature / 100, pressure / 256, humidity / 1024
@@ -10,6 +10,8 @@ from enum import Enum
 
 from _sn2d_comm import lib
 
+from . import metrics
+
 
 rng = random.SystemRandom()
 
@@ -35,6 +37,10 @@ def un_C_str(b):
 
 
 class ControlProtocol(asyncio.DatagramProtocol):
+    LATENCY_BUCKETS = (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+    )
+
     def __init__(self, logger=None):
         self.logger = logger or logging.getLogger(
             ".".join([
@@ -45,6 +51,12 @@ class ControlProtocol(asyncio.DatagramProtocol):
         self.__disconnect_exc = ConnectionError("not connected")
         self.__waiters = {}
 
+        self.tx_requests = 0
+        self.rx_responses = 0
+        self.rx_unexpected = 0
+        self.timeouts = 0
+        self.latency = metrics.Histogram(self.LATENCY_BUCKETS)
+
     def _require_connection(self):
         if self.__transport is None:
             raise self.__disconnect_exc
@@ -55,6 +67,7 @@ class ControlProtocol(asyncio.DatagramProtocol):
         except KeyError:
             return
 
+        self.timeouts += 1
         fut.set_exception(TimeoutError)
 
     def _fut_done(self, key, fut):
@@ -70,6 +83,7 @@ class ControlProtocol(asyncio.DatagramProtocol):
         loop = asyncio.get_event_loop()
         fut = asyncio.Future(loop=loop)
         self.__waiters[key] = fut, time.monotonic()
+        self.tx_requests += 1
         fut.add_done_callback(functools.partial(self._fut_done, key))
         loop.call_later(timeout, self._timeout, key)
         return fut
@@ -86,11 +100,37 @@ class ControlProtocol(asyncio.DatagramProtocol):
             fut, sent_timestamp = self.__waiters.pop(header)
         except KeyError:
             self.logger.debug("received unexpected frame: %r", buf)
+            self.rx_unexpected += 1
             return
 
+        self.rx_responses += 1
+        self.latency.observe(now - sent_timestamp)
+
         if not fut.done():
             fut.set_result((addr, buf, now - sent_timestamp))
 
+    def register_metrics(self, registry, prefix="sn2d_control_"):
+        """
+        Register the request counters with a :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        registry.counter_func(prefix + "requests_total",
+                              "Control requests sent",
+                              lambda: self.tx_requests)
+        registry.counter_func(prefix + "responses_total",
+                              "Responses received for control requests",
+                              lambda: self.rx_responses)
+        registry.counter_func(prefix + "unexpected_total",
+                              "Frames received without matching request",
+                              lambda: self.rx_unexpected)
+        registry.counter_func(prefix + "timeouts_total",
+                              "Control requests timed out",
+                              lambda: self.timeouts)
+        registry.register(prefix + "latency_seconds",
+                          "Time until a control request was answered",
+                          self.latency)
+
     def error_received(self, exc):
         pass
 
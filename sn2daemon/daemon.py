@@ -17,7 +17,11 @@ import hintlib.core
 import hintlib.services
 import hintlib.xso
 
-from . import sbx_protocol, datagram_stream, sensor_stream, sink
+from . import (
+    sbx_protocol, sbx_views, datagram_stream, sensor_stream, sink, metrics,
+    bme280, decode_pool, overload, rewrite_cache, holdback, health,
+    shm_ring, uplink, rollup,
+)
 from hintlib import utils, rewrite, sample, timeline
 
 
@@ -49,14 +53,104 @@ def rtcify_samples(
             )
 
 
+class MemoizingRTCifier:
+    """
+    Cache the RTC timestamp of the most recently mapped uptime.
+
+    :param rtcifier: The RTCifier to wrap.
+    :type rtcifier: :class:`hintlib.timeline.RTCifier`
+
+    The uptimes are 16 bit counters and the RTCifier tracks their
+    wraparound, so the same uptime maps to different RTC timestamps as time
+    goes on, and every distinct uptime has to reach the RTCifier to keep its
+    timeline current. Only runs of the same uptime, as produced by the
+    samples of a single message, are served from the cache. :meth:`align`
+    starts a new epoch and discards the cached timestamp.
+
+    .. attribute:: epoch
+
+       Number of alignments so far.
+
+    .. attribute:: hits
+
+       Number of uptimes served from the cache.
+
+    .. attribute:: misses
+
+       Number of uptimes which had to be mapped by the RTCifier.
+    """
+
+    def __init__(self, rtcifier):
+        super().__init__()
+        self._rtcifier = rtcifier
+        self._last = None
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def align(self, rtc, uptime):
+        self._rtcifier.align(rtc, uptime)
+        self.epoch += 1
+        self._last = None
+
+    def map_to_rtc(self, uptime):
+        last = self._last
+        if last is not None and last[0] == uptime:
+            self.hits += 1
+            return last[1]
+
+        self.misses += 1
+        result = self._rtcifier.map_to_rtc(uptime)
+        self._last = uptime, result
+        return result
+
+    def map_many(self, uptimes):
+        """
+        Map several uptimes at once.
+
+        :return: A list with the RTC timestamp for each uptime.
+        """
+        return [self.map_to_rtc(uptime) for uptime in uptimes]
+
+    def register_metrics(self, registry, prefix="sn2d_rtc_cache_"):
+        """
+        Register the cache metrics with a :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        registry.counter_func(
+            prefix + "hits_total",
+            "Uptimes mapped from the cache",
+            lambda: self.hits,
+        )
+        registry.counter_func(
+            prefix + "misses_total",
+            "Uptimes mapped by the RTCifier",
+            lambda: self.misses,
+        )
+        registry.counter_func(
+            prefix + "alignments_total",
+            "Alignments of the RTCifier",
+            lambda: self.epoch,
+        )
+
+
+@functools.lru_cache(maxsize=1024)
+def _deenumify_path(path):
+    return path.replace(
+        part=path.part.value,
+        subpart=path.subpart.value if path.subpart else None,
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def _bare_path(path):
+    return path.replace(subpart=None)
+
+
 def deenumify_samples(samples):
     for s in samples:
-        yield s.replace(
-            sensor=s.sensor.replace(
-                part=s.sensor.part.value,
-                subpart=s.sensor.subpart.value if s.sensor.subpart else None,
-            )
-        )
+        yield s.replace(sensor=_deenumify_path(s.sensor))
 
 
 def batch_samples(
@@ -66,7 +160,7 @@ def batch_samples(
     curr_batch_bare_path = None
     curr_batch_samples = {}
     for s in samples:
-        bare_path = s.sensor.replace(subpart=None)
+        bare_path = _bare_path(s.sensor)
         if (curr_batch_ts != s.timestamp or
                 curr_batch_bare_path != bare_path):
             if curr_batch_samples:
@@ -93,6 +187,123 @@ def batch_samples(
         )
 
 
+class SamplePipeline:
+    """
+    Turn the samples of a message into rewritten sample batches.
+
+    :param individual_rewriter: Rewriter applied to each sample.
+    :type individual_rewriter:
+        :class:`hintlib.rewrite.IndividualSampleRewriter`
+    :param batch_rewriter: Rewriter applied to each batch.
+    :type batch_rewriter: :class:`hintlib.rewrite.SampleBatchRewriter`
+    :param rtcifier: Maps uptime timestamps to RTC timestamps.
+    :type rtcifier: :class:`hintlib.timeline.RTCifier`
+    :param max_paths: Maximum number of compiled sensor paths.
+
+    The result of :meth:`process` equals that of the chain of
+    :func:`deenumify_samples`, the individual rewriter,
+    :func:`rtcify_samples`, :func:`batch_samples` and the batch rewriter.
+    Instead of passing each sample through all these stages, the first
+    sample of each sensor path compiles a function which does the
+    per-sample work with everything that only depends on the path (the
+    de-enumified path, the bare path, the subpart) already resolved.
+    """
+
+    def __init__(self, individual_rewriter, batch_rewriter, rtcifier,
+                 max_paths=1024):
+        super().__init__()
+        self._rewrite_sample = individual_rewriter.rewrite
+        self._rewrite_batch = batch_rewriter.rewrite
+        self._rtcifier = rtcifier
+        self.max_paths = max_paths
+        self._compiled = {}
+
+    def _compile(self, path):
+        sensor = _deenumify_path(path)
+        bare_path = _bare_path(sensor)
+        subpart = sensor.subpart
+        rewrite = self._rewrite_sample
+
+        def stage(s):
+            s = rewrite(s.replace(sensor=sensor))
+            if s.sensor is sensor:
+                return s.timestamp, bare_path, subpart, s.value
+            return (s.timestamp, _bare_path(s.sensor), s.sensor.subpart,
+                    s.value)
+
+        return stage
+
+    def _get_stage(self, path):
+        try:
+            return self._compiled[path]
+        except KeyError:
+            pass
+        if len(self._compiled) >= self.max_paths:
+            self._compiled.clear()
+        stage = self._compile(path)
+        self._compiled[path] = stage
+        return stage
+
+    def clear(self):
+        """
+        Forget all compiled sensor paths.
+        """
+        self._compiled.clear()
+
+    def process(self, samples):
+        """
+        Process the samples of one message.
+
+        :param samples: The samples from ``get_samples()``.
+        :return: The list of rewritten sample batches.
+        """
+        compiled = self._compiled
+        get_stage = self._get_stage
+        map_to_rtc = self._rtcifier.map_to_rtc
+        rewrite_batch = self._rewrite_batch
+
+        batches = []
+        curr_ts = None
+        curr_bare_path = None
+        curr_samples = {}
+        last_raw_ts = last_ts = None
+        for s in samples:
+            stage = compiled.get(s.sensor) or get_stage(s.sensor)
+            ts, bare_path, subpart, value = stage(s)
+
+            if not isinstance(ts, datetime):
+                # samples of one message mostly share their timestamp
+                if ts != last_raw_ts:
+                    last_raw_ts = ts
+                    last_ts = map_to_rtc(ts)
+                ts = last_ts
+
+            if curr_ts != ts or curr_bare_path != bare_path:
+                if curr_samples:
+                    batches.append(rewrite_batch(sample.SampleBatch(
+                        timestamp=curr_ts,
+                        bare_path=curr_bare_path,
+                        samples=curr_samples,
+                    )))
+                    curr_samples = {}
+                curr_ts = ts
+                curr_bare_path = bare_path
+
+            if subpart in curr_samples:
+                raise RuntimeError
+
+            curr_samples[subpart] = value
+
+        if curr_samples:
+            batches.append(rewrite_batch(sample.SampleBatch(
+                timestamp=curr_ts,
+                bare_path=curr_bare_path,
+                samples=curr_samples,
+            )))
+
+        return batches
+
+
 def configure_client(xmpp_cfg, logger) -> hintlib.core.BotCore:
     core = hintlib.core.BotCore(
         xmpp_cfg,
@@ -132,89 +343,152 @@ def configure_sink(sink_cfg, core: hintlib.core.BotCore) -> sink.Sink:
         raise ValueError("unknown sink protocol: {!r}".format(protocol))
 
 
-class SensorNode2Daemon:
-    def __init__(self, args, config, loop):
-        super().__init__()
-        self.logger = logging.getLogger("sn2d")
-        self.__loop = loop
-        self.__args = args
-        self.__config = config
-
-        self._indivdual_rewriter = rewrite.IndividualSampleRewriter(
-            config["samples"]["rewrite"],
-            self.logger.getChild("rewrite").getChild("individual")
-        )
-
-        self._batch_rewriter = rewrite.SampleBatchRewriter(
-            config["samples"]["batch"]["rewrite"],
-            self.logger.getChild("rewrite").getChild("batch")
+def configure_uplink(config, logger):
+    """
+    Configure the XMPP clients, the sample sinks and the stream submitter
+    service.
+
+    :return: The XMPP clients by name, the list of sample sinks and the
+             stream submitter service.
+    """
+    xmpp_clients = {}
+    stream_client = None
+    for name, cfg in config["xmpp"].items():
+        client = configure_client(
+            cfg,
+            logger.getChild("xmpp").getChild(name)
         )
+        xmpp_clients[name] = client
 
-        self._stream_ranges = {
-            (sample.Part(part),
-             sample.PART_SUBPARTS[sample.Part(part)](subpart)): range_
-            for part, subpart, range_ in (
-                (item["part"], item["subpart"], item["range"])
-                for item in config["streams"]["ranges"]
+        if "metric-collector" in cfg:
+            sender = client.client.summon(
+                hintlib.services.SenderService
             )
-        }
+            sender.peer_jid = aioxmpp.JID.fromstr(cfg["metric-collector"])
+            if stream_client is None:
+                stream_client = client
+            client.sn2d_has_metric_collector = True
+        else:
+            client.sn2d_has_metric_collector = False
 
-        self._cputime_prev_data = None
+    sample_sinks = []
+    for sink_cfg in config["sinks"]:
+        client_name = sink_cfg["via"]
+        client = xmpp_clients[client_name]
+        sample_sinks.append(configure_sink(sink_cfg, client))
 
-        self.__xmpp_clients = {}
-        stream_client = None
-        for name, cfg in config["xmpp"].items():
-            client = configure_client(
-                cfg,
-                self.logger.getChild("xmpp").getChild(name)
-            )
-            self.__xmpp_clients[name] = client
+    if stream_client is None:
+        raise ValueError("no metric-collector client defined")
+
+    stream_service = \
+        stream_client.client.summon(hintlib.services.StreamSubmitterService)
+    stream_service.queue_size = \
+        config.get("streams", {}).get("queue_length", 16)
+    stream_service.module_name = config["sensors"]["module_name"]
+
+    return xmpp_clients, sample_sinks, stream_service
+
+
+def tag_path(path, node):
+    """
+    Tag a sensor path with the name of the sensor node it belongs to.
+
+    The node name is prepended to the instance, separated by a dot.
+    """
+    return path.replace(instance="{}.{}".format(node, path.instance))
 
-            if "metric-collector" in cfg:
-                sender = client.client.summon(
-                    hintlib.services.SenderService
-                )
-                sender.peer_jid = aioxmpp.JID.fromstr(cfg["metric-collector"])
-                if stream_client is None:
-                    stream_client = client
-                client.sn2d_has_metric_collector = True
-            else:
-                client.sn2d_has_metric_collector = False
 
-        self._sample_sinks = []
-        for sink_cfg in config["sinks"]:
-            client_name = sink_cfg["via"]
-            client = self.__xmpp_clients[client_name]
-            self._sample_sinks.append(configure_sink(sink_cfg, client))
+class _NodeSink(sink.Sink):
+    """
+    Tag sample batches with the name of a node and pass them on.
+    """
 
-        if stream_client is None:
-            raise ValueError("no metric-collector client defined")
+    def __init__(self, name, submit_batches):
+        super().__init__()
+        self._name = name
+        self._submit_batches = submit_batches
+
+    def submit_batch(self, batch):
+        self.submit_batches([batch])
+
+    def submit_batches(self, batches):
+        if self._name is not None:
+            batches = [
+                sample.SampleBatch(
+                    timestamp=batch.timestamp,
+                    bare_path=tag_path(batch.bare_path, self._name),
+                    samples=batch.samples,
+                )
+                for batch in batches
+            ]
+        self._submit_batches(batches)
+
+
+class SensorNode:
+    """
+    The state the daemon keeps for a single sensor node.
+
+    :param name: Name of the node, or :data:`None` for the node of a
+        single-node daemon.
+    :param config: The daemon configuration.
+    :param datadir: Directory for the stream buffers of the node.
+    :type datadir: :class:`pathlib.Path`
+    :param individual_rewriter: Rewriter for individual samples.
+    :param batch_rewriter: Rewriter for sample batches.
+    :param submit_batches: Called with the sample batches of the node.
+    :param on_stream_emit: Called like the `on_emit` callback of a
+        :class:`~.sensor_stream.Buffer`, with the stream path first.
+
+    Each node has its own timeline, stream buffers and status tracking. If
+    the node has a name, the paths of its sample batches and streams are
+    tagged with it (see :func:`tag_path`) before they are passed on.
+
+    Data frames are fed in via the :class:`~.sbx_protocol.SBXClient` set
+    with :meth:`attach`.
+    """
+
+    def __init__(self, name, config, datadir, individual_rewriter,
+                 batch_rewriter, submit_batches, on_stream_emit, *,
+                 logger=None):
+        super().__init__()
+        self.name = name
+        self.logger = logger or logging.getLogger("sn2d")
+        self.__config = config
+        self._on_stream_emit_cb = on_stream_emit
+        self._sink = _NodeSink(name, submit_batches)
 
-        self._stream_service = \
-            stream_client.client.summon(hintlib.services.StreamSubmitterService)
-        self._stream_service.queue_size = \
-            config.get("streams", {}).get("queue_length", 16)
-        self._stream_service.module_name = config["sensors"]["module_name"]
+        self._cputime_prev_data = None
+
+        self.health = health.HealthExporter(
+            dig(config, "health", "interval", default=60),
+            sinks=([self._sink]
+                   if dig(config, "health", "sinks", default=False)
+                   else ()),
+            logger=self.logger.getChild("health"),
+        )
 
         self._timeline = timeline.Timeline(
             2**16,  # wraparound
             30000,  # 30s slack
         )
-        self._rtcifier = timeline.RTCifier(
+        self._rtcifier = MemoizingRTCifier(timeline.RTCifier(
             self._timeline,
             self.logger.getChild("rtcifier")
-        )
+        ))
         self._had_status = False
 
-        imu_datadir = pathlib.Path(
-            config["streams"]["datadir"]
+        self._sample_pipeline = SamplePipeline(
+            individual_rewriter,
+            batch_rewriter,
+            self._rtcifier,
         )
-        imu_datadir.mkdir(exist_ok=True)
+
+        datadir.mkdir(exist_ok=True)
 
         # configure all the stream buffers
         self._stream_buffers = {
             path: sensor_stream.Buffer(
-                imu_datadir / utils.escape_path(str(path)),
+                datadir / utils.escape_path(str(path)),
                 functools.partial(
                     self._on_stream_emit,
                     path
@@ -237,7 +511,15 @@ class SensorNode2Daemon:
             )
         }
 
-        self.__pre_status_buffer = []
+        self._pre_status_buffer = holdback.HoldbackQueue(
+            dig(config, "pre_status", "max_held", default=1024),
+            dig(config, "pre_status", "spool_size", default=16*1024*1024),
+            dig(config, "pre_status", "spool_dir"),
+            logger=self.logger.getChild("pre_status"),
+        )
+        self._sbx_client = None
+        self._message_token = None
+        self._metrics = None
 
         for buf in self._stream_buffers.values():
             buf.batch_size = config.get(
@@ -246,18 +528,92 @@ class SensorNode2Daemon:
                 "batch_size", 1024
             )
 
-    def _on_stream_emit(self, path, t0, seq0, period, data, handle):
-        range_ = self._stream_ranges.get(
-            (path.part, path.subpart), 1
+    @property
+    def sbx_client(self):
+        return self._sbx_client
+
+    def metrics_registry(self, registry):
+        """
+        Return the registry for the metrics of the node and its components.
+
+        For a named node, this is a view of `registry` which adds a ``node``
+        label, so that the metrics of all nodes share their names. For the
+        node of a single-node daemon, it is `registry` itself, so that the
+        metrics do not change.
+        """
+        if self.name is None:
+            return registry
+        if self._metrics is None:
+            self._metrics = registry.labelled(node=self.name)
+        return self._metrics
+
+    def child_logger(self, name):
+        """
+        Return the logger for a per-node component.
+
+        For the node of a single-node daemon, this is :data:`None`, so that
+        the component keeps its default logger.
+        """
+        if self.name is None:
+            return None
+        return self.logger.getChild(name)
+
+    def attach(self, client):
+        """
+        Process the messages received by `client`.
+
+        :type client: :class:`~.sbx_protocol.SBXClient`
+        """
+        self._message_token = client.on_message_frame.connect(
+            lambda frame, rtc_timestamp, obj: self.on_message(
+                rtc_timestamp, obj, frame,
+            )
         )
-        item = path, t0, seq0, period, data, range_, handle
-        self._stream_service.submit_block(item)
+        self._sbx_client = client
 
-    def _enqueue_sample_batches(self, batches):
-        for sink in self._sample_sinks:
-            sink.submit_batches(batches)
+    def detach(self):
+        """
+        Stop processing the messages of the attached client and close it.
+        """
+        if self._sbx_client is None:
+            return
+        self._sbx_client.on_message_frame.disconnect(self._message_token)
+        self._sbx_client.close()
+        self._sbx_client = None
+
+    def register_metrics(self, registry, prefix="sn2d_"):
+        """
+        Register the metrics of the node with a :class:`~.metrics.Registry`.
+
+        :param registry: The registry, usually from :meth:`metrics_registry`.
+        :param prefix: Prefix for the metric names, followed by the default
+            prefix of each component without its ``sn2d_``.
+        """
+        self._rtcifier.register_metrics(registry, prefix + "rtc_cache_")
+        self._pre_status_buffer.register_metrics(registry,
+                                                 prefix + "holdback_")
+
+    def close(self):
+        """
+        Detach the client and release the resources of the node.
+
+        For a named node, this also removes the metrics registered through
+        :meth:`metrics_registry`.
+        """
+        self.detach()
+        self._pre_status_buffer.close()
+        if self._metrics is not None:
+            self._metrics.unregister_all()
+
+    def _on_stream_emit(self, path, t0, seq0, period, data, handle):
+        if self.name is not None:
+            path = tag_path(path, self.name)
+        self._on_stream_emit_cb(path, t0, seq0, period, data, handle)
 
     def _print_status(self, rtc_timestamp, obj, now):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+
         self.logger.debug(
             "status: "
             "rtc = %s, uptime = %d",
@@ -385,19 +741,8 @@ class SensorNode2Daemon:
 
     def _process_non_status_message(self, obj):
         if hasattr(obj, "get_samples"):
-            batches = list(map(
-                self._batch_rewriter.rewrite,
-                batch_samples(
-                    rtcify_samples(
-                        map(
-                            self._indivdual_rewriter.rewrite,
-                            deenumify_samples(obj.get_samples())
-                        ),
-                        self._rtcifier
-                    )
-                )
-            ))
-            self._enqueue_sample_batches(batches)
+            batches = self._sample_pipeline.process(obj.get_samples())
+            self._sink.submit_batches(batches)
             # for ts, bare_path, samples in :
             #     print(
             #         "{} sensor={}".format(
@@ -424,7 +769,11 @@ class SensorNode2Daemon:
                 obj.data
             )
 
-    def _on_message(self, rtc_timestamp, obj):
+    def _decode_spilled_frame(self, frame):
+        _, obj = self._sbx_client.decode_frame(frame)
+        return obj
+
+    def on_message(self, rtc_timestamp, obj, frame=None):
         # print(obj)
 
         if obj.type_ == sbx_protocol.MsgType.STATUS:
@@ -444,15 +793,18 @@ class SensorNode2Daemon:
                 obj.uptime
             )
 
-            for subpart, state in zip(["accel", "compass"],
-                                      [obj.v1_accel_stream_state,
-                                       obj.v1_compass_stream_state]):
+            states = [obj.v1_accel_stream_state,
+                      obj.v1_compass_stream_state]
+            rtcs = self._rtcifier.map_many(
+                state.timestamp for state in states
+            )
+            for subpart, state, rtc in zip(["accel", "compass"],
+                                           states, rtcs):
                 seq = state.sequence_number
-                rtc = self._rtcifier.map_to_rtc(state.timestamp)
                 period = state.period
                 for axis in "xyz":
                     stream_buffer = self._stream_buffers[
-                        sample.SensorPath(
+                        sbx_protocol.sensor_path(
                             sample.Part.LSM303D,
                             0,
                             sample.LSM303DSubpart("{}-{}".format(subpart, axis))
@@ -464,16 +816,229 @@ class SensorNode2Daemon:
                         period,
                     )
 
+            self.health.submit(rtc_timestamp, obj)
             self._print_status(rtc_timestamp, obj, now)
 
         if self._had_status:
-            if self.__pre_status_buffer:
-                for msg in self.__pre_status_buffer:
+            if self._pre_status_buffer:
+                for msg in self._pre_status_buffer.drain(
+                        self._decode_spilled_frame):
                     self._process_non_status_message(msg)
-                self.__pre_status_buffer.clear()
             self._process_non_status_message(obj)
         else:
-            self.__pre_status_buffer.append(obj)
+            self._pre_status_buffer.hold(obj, frame)
+
+
+class SensorNode2Daemon:
+    def __init__(self, args, config, loop):
+        super().__init__()
+        self.logger = logging.getLogger("sn2d")
+        self.__loop = loop
+        self.__args = args
+        self.__config = config
+
+        rewrite_cache_size = dig(config, "samples", "rewrite_cache_size",
+                                 default=0)
+        individual_rewriter, batch_rewriter = \
+            self._configure_rewriters(config)
+        self._indivdual_rewriter = rewrite_cache.SampleRewriteCache(
+            individual_rewriter,
+            rewrite_cache_size,
+        )
+        self._batch_rewriter = rewrite_cache.BatchRewriteCache(
+            batch_rewriter,
+            rewrite_cache_size,
+        )
+
+        self._stream_ranges = {
+            (sample.Part(part),
+             sample.PART_SUBPARTS[sample.Part(part)](subpart)): range_
+            for part, subpart, range_ in (
+                (item["part"], item["subpart"], item["range"])
+                for item in config["streams"]["ranges"]
+            )
+        }
+
+        self.metrics = metrics.Registry()
+
+        if dig(config, "uplink", "process", default=False):
+            # the XMPP clients and sinks live in the uplink process, see run()
+            self._uplink_ring = shm_ring.RingBuffer.create(
+                dig(config, "uplink", "ring_size", default=4*1024*1024)
+            )
+            self._uplink_sender = uplink.RingSender(
+                self._uplink_ring,
+                max_pending=dig(config, "uplink", "max_pending",
+                                default=1024),
+                logger=self.logger.getChild("uplink"),
+            )
+            self.__xmpp_clients = {}
+            self._sample_sinks = [self._uplink_sender]
+            self._stream_service = self._uplink_sender
+        else:
+            self._uplink_ring = None
+            self._uplink_sender = None
+            (self.__xmpp_clients,
+             self._sample_sinks,
+             self._stream_service) = configure_uplink(config, self.logger)
+
+        batching_window = dig(config, "samples", "batching", "window",
+                              default=0)
+        if batching_window > 0:
+            self._sample_batcher = sink.BatchingSink(
+                self._sample_sinks,
+                batching_window,
+                dig(config, "samples", "batching", "max_batches",
+                    default=64),
+                loop=loop,
+            )
+        else:
+            self._sample_batcher = None
+
+        rollup_resolutions = dig(config, "streams", "rollup", "resolutions")
+        if rollup_resolutions:
+            self._rollup = rollup.Rollup(
+                rollup_resolutions,
+                logger=self.logger.getChild("rollup"),
+            )
+        else:
+            self._rollup = None
+        # subparts of the streams whose raw blocks are uploaded; None for all
+        raw_subparts = dig(config, "streams", "rollup", "raw")
+        if raw_subparts is not None and self._rollup is None:
+            # without aggregates, dropping raw blocks would lose the data
+            self.logger.warning(
+                "streams.rollup.raw is ignored without "
+                "streams.rollup.resolutions, uploading all raw blocks"
+            )
+            raw_subparts = None
+        self._raw_stream_subparts = (
+            None if raw_subparts is None
+            else {sample.LSM303DSubpart(subpart) for subpart in raw_subparts}
+        )
+
+        self._datadir = pathlib.Path(
+            config["streams"]["datadir"]
+        )
+        self._datadir.mkdir(exist_ok=True)
+
+        self._metrics_enabled = (
+            dig(config, "metrics", "unix_socket") is not None or
+            dig(config, "metrics", "tcp_port") is not None
+        )
+
+        self._multinode = dig(config, "multinode", "enabled", default=False)
+        # node names by host address
+        self._node_names = dict(dig(config, "multinode", "names",
+                                    default={}))
+        self._nodes = {}
+        if self._multinode:
+            # create the configured nodes right away, so that the stream
+            # blocks left over from a previous run are emitted
+            for name in self._node_names.values():
+                self._get_node(name)
+        else:
+            self._get_node(None)
+
+    def _configure_rewriters(self, config):
+        return (
+            rewrite.IndividualSampleRewriter(
+                config["samples"]["rewrite"],
+                self.logger.getChild("rewrite").getChild("individual")
+            ),
+            rewrite.SampleBatchRewriter(
+                config["samples"]["batch"]["rewrite"],
+                self.logger.getChild("rewrite").getChild("batch")
+            ),
+        )
+
+    def reload_rewrite_rules(self, config):
+        """
+        Replace the sample rewrite rules with those from `config`.
+
+        This discards all cached rewrite decisions.
+        """
+        individual_rewriter, batch_rewriter = \
+            self._configure_rewriters(config)
+        self._indivdual_rewriter.reset(individual_rewriter)
+        self._batch_rewriter.reset(batch_rewriter)
+        self.logger.info("reloaded sample rewrite rules")
+
+    def _node_name(self, host):
+        try:
+            return self._node_names[host]
+        except KeyError:
+            pass
+        if not dig(self.__config, "multinode", "allow_unknown",
+                   default=False):
+            return None
+        return host.replace(".", "-").replace(":", "-")
+
+    def _get_node(self, name):
+        try:
+            return self._nodes[name]
+        except KeyError:
+            pass
+
+        if name is None:
+            datadir = self._datadir
+            logger = self.logger
+        else:
+            datadir = self._datadir / utils.escape_path(name)
+            logger = self.logger.getChild("nodes").getChild(name)
+            logger.info("new sensor node")
+
+        node = SensorNode(
+            name,
+            self.__config,
+            datadir,
+            self._indivdual_rewriter,
+            self._batch_rewriter,
+            self._enqueue_sample_batches,
+            self._on_stream_emit,
+            logger=logger,
+        )
+        self._nodes[name] = node
+        node_metrics = node.metrics_registry(self.metrics)
+        node.register_metrics(node_metrics)
+        if self._metrics_enabled:
+            node.health.register_metrics(node_metrics)
+        return node
+
+    def _remove_node(self, name):
+        node = self._nodes.pop(name)
+        node.logger.info("removing sensor node")
+        node.close()
+
+    def _close_nodes(self):
+        for node in self._nodes.values():
+            node.close()
+
+    def _on_stream_emit(self, path, t0, seq0, period, data, handle):
+        if self._rollup is not None:
+            batches = self._rollup.submit(path, t0, period, data)
+            if batches:
+                self._enqueue_sample_batches(batches)
+
+        if (self._rollup is not None and
+                self._raw_stream_subparts is not None and
+                path.subpart not in self._raw_stream_subparts):
+            handle.close()
+            return
+
+        range_ = self._stream_ranges.get(
+            (path.part, path.subpart), 1
+        )
+        item = path, t0, seq0, period, data, range_, handle
+        self._stream_service.submit_block(item)
+
+    def _enqueue_sample_batches(self, batches):
+        if self._sample_batcher is not None:
+            self._sample_batcher.submit_batches(batches)
+            return
+
+        for sink_ in self._sample_sinks:
+            sink_.submit_batches(batches)
 
     def _task_failed(self, task):
         try:
@@ -494,20 +1059,241 @@ class SensorNode2Daemon:
             self.__config, 'net', 'detect', 'timeout',
             default=5)
 
-        protocol = datagram_stream.DatagramStreamProtocol(
-            sbx_protocol.SENDER_PORT,
+        pool_kind = dig(self.__config, 'decoding', 'pool', 'kind')
+        decoder = None
+        if dig(self.__config, 'decoding', 'views', default=False):
+            if pool_kind == "process":
+                self.logger.warning(
+                    "views cannot be used with a process decode pool"
+                )
+            else:
+                decoder = sbx_views.decode_sbx_message
+
+        pool = None
+        if pool_kind is not None:
+            pool = decode_pool.DecodePool.create(
+                sbx_protocol.decode_data_frame,
+                pool_kind,
+                dig(self.__config, 'decoding', 'pool', 'workers'),
+                batch_size=dig(self.__config, 'decoding', 'pool',
+                               'batch_size', default=32),
+                max_in_flight=dig(self.__config, 'decoding', 'pool',
+                                  'max_in_flight', default=4),
+                max_held=dig(self.__config, 'decoding', 'pool',
+                             'max_held', default=4096),
+                logger=self.logger.getChild("decode_pool"),
+            )
+            pool.register_metrics(self.metrics)
+
+        lag_monitor = overload.LoopLagMonitor(
+            dig(self.__config, 'overload', 'lag_interval', default=0.1),
+            loop=self.__loop,
+            slow_threshold=dig(self.__config, 'loop',
+                               'slow_callback_threshold', default=0.5),
+            logger=self.logger.getChild("loop"),
+        )
+        lag_threshold = dig(self.__config, 'overload', 'lag_threshold')
+        queue_threshold = dig(self.__config, 'overload', 'queue_threshold')
+        # load shedding is opt-in
+        shedding = lag_threshold is not None or queue_threshold is not None
+        spool_path = dig(self.__config, 'overload', 'spool', 'path')
+        # by node name
+        spools = {}
+        policy = dict(overload.DEFAULT_POLICY)
+        policy.update(
+            (type_name, overload.Action(action))
+            for type_name, action in dig(self.__config, 'overload', 'policy',
+                                         default={}).items()
         )
+        lag_monitor.register_metrics(self.metrics)
+
+        def new_overload_controller(node):
+            spool = None
+            if spool_path is not None:
+                path = pathlib.Path(spool_path)
+                if node.name is not None:
+                    path = path.with_name("{}.{}".format(
+                        path.name,
+                        utils.escape_path(node.name),
+                    ))
+                spool = overload.FrameSpool(
+                    path,
+                    dig(self.__config, 'overload', 'spool', 'max_size',
+                        default=16*1024*1024),
+                )
+                spools[node.name] = spool
+            overload_controller = overload.OverloadController(
+                monitor=lag_monitor,
+                lag_threshold=lag_threshold,
+                queue_threshold=queue_threshold,
+                policy=policy,
+                decimation=dig(self.__config, 'overload', 'decimation',
+                               default=4),
+                decimation_run=dig(self.__config, 'overload',
+                                   'decimation_run', default=64),
+                spool=spool,
+                logger=node.logger.getChild("overload"),
+            )
+            if pool is not None:
+                overload_controller.add_queue("decode_pool",
+                                              lambda: pool.held)
+            for i, sink_ in enumerate(self._sample_sinks):
+                overload_controller.add_queue(
+                    "sink{}".format(i),
+                    lambda sink_=sink_: sink_.queue_depth,
+                )
+            return overload_controller
+
+        def attach(node, protocol):
+            overload_controller = None
+            if shedding:
+                overload_controller = new_overload_controller(node)
+
+            client = sbx_protocol.SBXClient(
+                protocol,
+                decoder=decoder,
+                decode_pool=pool,
+                overload=overload_controller,
+                logger=node.child_logger("sbx"),
+            )
+            node.attach(client)
+
+            node_metrics = node.metrics_registry(self.metrics)
+            if overload_controller is not None:
+                overload_controller.register_metrics(node_metrics)
+            protocol.register_metrics(node_metrics)
+            client.register_metrics(node_metrics)
+
+        if self._multinode:
+            # node names by host address, for the peers attached to a node
+            peer_nodes = {}
+
+            def connected(host, name, protocol):
+                # the node is only created once the stream handshake with the
+                # peer succeeded, so that stray datagrams do not create nodes
+                node = self._get_node(name)
+                if node.sbx_client is not None:
+                    self.logger.debug(
+                        "ignoring %s, node %s is connected via another "
+                        "address",
+                        host, name,
+                    )
+                    return False
+                attach(node, protocol)
+                peer_nodes[host] = name
+                # disconnect from on_resync
+                return True
+
+            def create_peer_protocol(host):
+                name = self._node_name(host)
+                if name is None:
+                    return None
+                node = self._nodes.get(name)
+                if node is not None and node.sbx_client is not None:
+                    self.logger.debug(
+                        "ignoring %s, node %s is connected via another "
+                        "address",
+                        host, name,
+                    )
+                    return None
+                protocol = datagram_stream.DatagramStreamProtocol(
+                    sbx_protocol.SENDER_PORT,
+                    logger=self.logger.getChild("nodes").getChild(
+                        name
+                    ).getChild("stream"),
+                )
+                protocol.on_resync.connect(
+                    functools.partial(connected, host, name, protocol)
+                )
+                return protocol
+
+            def peer_removed(host, peer_protocol):
+                name = peer_nodes.pop(host, None)
+                if name is None:
+                    return
+                self._remove_node(name)
+                spool = spools.pop(name, None)
+                if spool is not None:
+                    spool.close()
+
+            protocol = datagram_stream.DatagramDemultiplexer(
+                create_peer_protocol,
+                max_peers=dig(self.__config, 'multinode', 'max_nodes'),
+                idle_timeout=dig(self.__config, 'multinode', 'idle_timeout',
+                                 default=600),
+                logger=self.logger.getChild("peers"),
+            )
+            protocol.on_peer_removed.connect(peer_removed)
+            protocol.register_metrics(self.metrics)
+        else:
+            protocol = datagram_stream.DatagramStreamProtocol(
+                sbx_protocol.SENDER_PORT,
+            )
+            attach(self._nodes[None], protocol)
 
-        client = sbx_protocol.SBXClient(protocol)
-        client.on_message.connect(self._on_message)
+        bme280.calibration_cache.register_metrics(self.metrics)
+        self._indivdual_rewriter.register_metrics(self.metrics)
+        self._batch_rewriter.register_metrics(self.metrics)
+        if self._sample_batcher is not None:
+            self._sample_batcher.register_metrics(self.metrics)
+        if self._rollup is not None:
+            self._rollup.register_metrics(self.metrics)
 
         def get_protocol():
             return protocol
 
+        uplink_process = None
+        if self._uplink_sender is not None:
+            self._uplink_sender.register_metrics(self.metrics)
+            uplink_process = uplink.UplinkProcess(
+                self.__config,
+                self._uplink_ring,
+                logger=self.logger.getChild("uplink"),
+            )
+
         async with contextlib.AsyncExitStack() as stack:
             for client in self.__xmpp_clients.values():
                 await stack.enter_async_context(client)
 
+            if uplink_process is not None:
+                stack.callback(self._uplink_ring.close)
+                uplink_process.start()
+                stack.push_async_callback(
+                    uplink.shutdown,
+                    self._uplink_sender,
+                    uplink_process,
+                    dig(self.__config, 'uplink', 'shutdown_timeout',
+                        default=5),
+                )
+
+            metrics_path = dig(self.__config, 'metrics', 'unix_socket')
+            metrics_port = dig(self.__config, 'metrics', 'tcp_port')
+            if metrics_path is not None or metrics_port is not None:
+                metrics_server = await metrics.start_server(
+                    self.metrics,
+                    path=metrics_path,
+                    host=dig(self.__config, 'metrics', 'tcp_host'),
+                    port=metrics_port,
+                )
+                stack.callback(metrics_server.close)
+
+            if pool is not None:
+                stack.callback(pool.close)
+
+            stack.callback(self._close_nodes)
+            if self._sample_batcher is not None:
+                # pass held back batches on before the sinks go away
+                stack.callback(self._sample_batcher.close)
+
+            lag_monitor.start()
+            stack.callback(lag_monitor.stop)
+
+            def close_spools():
+                for spool in spools.values():
+                    spool.close()
+
+            stack.callback(close_spools)
+
             await self.__loop.create_datagram_endpoint(
                 get_protocol,
                 local_addr=(
@@ -520,3 +1306,7 @@ class SensorNode2Daemon:
 
             while True:
                 await asyncio.sleep(interval)
+                if self._multinode:
+                    protocol.expire_idle()
+                if uplink_process is not None:
+                    uplink_process.check()
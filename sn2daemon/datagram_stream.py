@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import asyncio
-import functools
+import collections
+import heapq
 import ipaddress
 import logging
 import numbers
@@ -19,6 +20,8 @@ from hintlib.utils import (
     unpack_and_splice,
 )
 
+from . import metrics
+
 
 _rng = random.SystemRandom()
 
@@ -30,6 +33,13 @@ class PacketType(Enum):
     APP_RESP = 0x04
     DACK = 0x05
     DATA = 0x06
+    FEC_REQ = 0x07
+    FEC = 0x08
+
+
+class FECScheme(Enum):
+    NONE = 0x00
+    XOR = 0x01
 
 
 common_header_fmt = struct.Struct(
@@ -77,6 +87,30 @@ data_entry_header_fmt = struct.Struct(
     "B"  # length
 )
 
+fec_req_fmt = struct.Struct(
+    "<"
+    "B"  # scheme
+    "B"  # group size
+)
+
+fec_header_fmt = struct.Struct(
+    "<"
+    "H"  # serial number of the first frame in the group
+    "B"  # number of frames in the group
+    "B"  # XOR of the payload lengths
+)
+
+
+def xor_frames(frames):
+    """
+    Return the XOR of `frames`, each padded with zeroes to the longest one.
+    """
+    length = max(map(len, frames), default=0)
+    acc = 0
+    for frame in frames:
+        acc ^= int.from_bytes(frame, "little")
+    return acc.to_bytes(length, "little")
+
 
 class SerialNumber:
     __slots__ = (
@@ -288,6 +322,20 @@ class SerialNumberRangeSet:
                 continue
             self._ranges[0] = sn + 1, end
 
+    def count_before(self, sn):
+        """
+        Return the number of serial numbers in the set which are less than
+        `sn`.
+        """
+        count = 0
+        for start, end in self._ranges:
+            if start >= sn:
+                continue
+            if end >= sn:
+                end = sn - 1
+            count += end - start + 1
+        return count
+
     @property
     def nranges(self):
         return len(self._ranges)
@@ -324,18 +372,397 @@ class SerialNumberRangeSet:
         return self._ranges[0][1]
 
 
+PacketSizeStats = collections.namedtuple(
+    "PacketSizeStats",
+    ["sent", "lost", "loss_rate"],
+)
+
+
+class PacketSizeController:
+    """
+    Adapt the size limit for DATA packets to the observed packet loss.
+
+    :param min_size: Smallest packet size limit to use.
+    :type min_size: :class:`int`
+    :param max_size: Largest packet size limit to use; this is also the
+                     initial limit.
+    :type max_size: :class:`int`
+    :param bucket_width: Granularity of the statistics and of the adjustments,
+                         in bytes.
+    :type bucket_width: :class:`int`
+    :param loss_threshold: Loss rate above which the limit is lowered.
+    :type loss_threshold: :class:`float`
+    :param min_samples: Number of packets close to the limit which need to be
+                        observed before the limit is changed again.
+    :type min_samples: :class:`int`
+    :param smoothing: Weight of a new observation in the moving averages.
+    :type smoothing: :class:`float`
+    :param max_pending: Maximum number of packets awaiting feedback.
+    :type max_pending: :class:`int`
+
+    The peer includes the serial number of the first (i.e. main) frame of the
+    last DATA packet it received in the header of every packet it sends. A
+    packet is thus counted as received when its main serial number is
+    reported back and as lost when a packet sent after it is reported first.
+
+    If the moving average of the loss rate of packets close to the current
+    limit exceeds `loss_threshold`, the limit is lowered by `bucket_width`.
+    If it is below half the threshold, the limit is raised by `bucket_width`
+    again, so that the controller keeps probing for larger packets.
+    """
+
+    def __init__(self, min_size, max_size, *,
+                 bucket_width=100,
+                 loss_threshold=0.1,
+                 min_samples=16,
+                 smoothing=1/16,
+                 max_pending=256):
+        if not (0 < min_size <= max_size):
+            raise ValueError("invalid packet size bounds: {!r}..{!r}".format(
+                min_size, max_size,
+            ))
+        super().__init__()
+        self.min_size = min_size
+        self.max_size = max_size
+        self.bucket_width = bucket_width
+        self.loss_threshold = loss_threshold
+        self.min_samples = min_samples
+        self.smoothing = smoothing
+        self.max_pending = max_pending
+
+        self._size = max_size
+        self._pending = collections.OrderedDict()
+        self._buckets = {}
+        self._limit_samples = 0
+        self._limit_loss_rate = None
+
+    @property
+    def packet_size(self):
+        """
+        The currently chosen packet size limit.
+        """
+        return self._size
+
+    @property
+    def stats(self):
+        """
+        Loss statistics per size bucket.
+
+        A mapping from the lower bound of each size bucket to a
+        :class:`PacketSizeStats` tuple.
+        """
+        return {
+            bucket: PacketSizeStats(sent, lost, loss_rate)
+            for bucket, (sent, lost, loss_rate)
+            in sorted(self._buckets.items())
+        }
+
+    def _update_average(self, average, lost):
+        if average is None:
+            return float(lost)
+        return average + self.smoothing * (float(lost) - average)
+
+    def _observe(self, size, lost):
+        bucket = (size // self.bucket_width) * self.bucket_width
+        stats = self._buckets.setdefault(bucket, [0, 0, None])
+        stats[0] += 1
+        if lost:
+            stats[1] += 1
+        stats[2] = self._update_average(stats[2], lost)
+
+        if size <= self._size - self.bucket_width:
+            # the packet was not constrained by the current limit and thus
+            # tells nothing about it
+            return
+
+        self._limit_samples += 1
+        self._limit_loss_rate = self._update_average(
+            self._limit_loss_rate,
+            lost,
+        )
+
+        if self._limit_samples < self.min_samples:
+            return
+
+        if self._limit_loss_rate > self.loss_threshold:
+            new_size = max(self._size - self.bucket_width, self.min_size)
+        elif self._limit_loss_rate < self.loss_threshold / 2:
+            new_size = min(self._size + self.bucket_width, self.max_size)
+        else:
+            return
+
+        if new_size != self._size:
+            self._size = new_size
+            self._limit_samples = 0
+            self._limit_loss_rate = None
+
+    def record_sent(self, sn, size):
+        """
+        Record that a packet with main frame `sn` and `size` bytes was sent.
+        """
+        if len(self._pending) >= self.max_pending:
+            # without feedback, we cannot tell anything about those
+            self._pending.popitem(last=False)
+        self._pending[sn] = size
+
+    def record_feedback(self, last_recvd_sn):
+        """
+        Process the last received serial number reported by the peer.
+        """
+        while self._pending:
+            sn, size = next(iter(self._pending.items()))
+            if sn > last_recvd_sn:
+                break
+            del self._pending[sn]
+            self._observe(size, sn != last_recvd_sn)
+
+    def clear_pending(self):
+        """
+        Forget about all packets for which no feedback has been received.
+        """
+        self._pending.clear()
+
+
+class AppRequestScheduler:
+    """
+    Keep track of outstanding application requests and retransmit them.
+
+    :param transmit: Callable which sends a packet to a destination.
+    :param retransmit_interval: Time to wait for a response before a request
+                                is retransmitted or given up on.
+    :type retransmit_interval: :class:`datetime.timedelta`
+
+    All outstanding requests are kept in a heap ordered by the time of their
+    next transmission and a single timer on the event loop serves the
+    earliest of them, instead of having a task and a timer per request.
+    """
+
+    LATENCY_BUCKETS = (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    )
+
+    class _Request:
+        __slots__ = (
+            "request_id",
+            "packet",
+            "dest",
+            "attempts_left",
+            "deadline",
+            "started",
+            "fut",
+        )
+
+    def __init__(self, transmit, retransmit_interval, *, logger=None):
+        super().__init__()
+        self.logger = logger or logging.getLogger(__name__)
+        self.retransmit_interval = retransmit_interval
+        self._transmit = transmit
+        self._requests = {}
+        self._deadlines = []
+        self._timer = None
+        self._timer_deadline = None
+
+        self.latency = metrics.Histogram(self.LATENCY_BUCKETS)
+        self.timeouts = 0
+
+    @property
+    def in_flight(self):
+        """
+        Number of requests which are still waiting for a response.
+        """
+        return sum(
+            1 for request in self._requests.values()
+            if not request.fut.done()
+        )
+
+    def _transmit_attempt(self, loop, request):
+        request.attempts_left -= 1
+        self.logger.debug("app request 0x%08x: transmit attempt (%d left)",
+                          request.request_id,
+                          request.attempts_left)
+        try:
+            self._transmit(request.packet, request.dest)
+        except Exception as exc:
+            del self._requests[request.request_id]
+            request.fut.set_exception(exc)
+            return
+
+        request.deadline = (
+            loop.time() + self.retransmit_interval.total_seconds()
+        )
+        heapq.heappush(self._deadlines,
+                       (request.deadline, request.request_id))
+
+    def _arm(self, loop):
+        while self._deadlines:
+            deadline, request_id = self._deadlines[0]
+            request = self._requests.get(request_id)
+            if request is not None and request.deadline == deadline:
+                break
+            # stale entry
+            heapq.heappop(self._deadlines)
+        else:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            return
+
+        if self._timer is not None:
+            if self._timer_deadline <= deadline:
+                return
+            self._timer.cancel()
+
+        self._timer_deadline = deadline
+        self._timer = loop.call_at(deadline, self._on_timer, loop)
+
+    def _on_timer(self, loop):
+        self._timer = None
+        now = loop.time()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, request_id = heapq.heappop(self._deadlines)
+            request = self._requests.get(request_id)
+            if request is None or request.deadline != deadline:
+                continue
+
+            if request.fut.done():
+                # cancelled by the caller
+                del self._requests[request_id]
+                continue
+
+            if request.attempts_left <= 0:
+                self.logger.debug(
+                    "app request 0x%08x: out of attempts, raising error",
+                    request_id,
+                )
+                del self._requests[request_id]
+                self.timeouts += 1
+                request.fut.set_exception(
+                    TimeoutError("no response received in time")
+                )
+                continue
+
+            self._transmit_attempt(loop, request)
+
+        self._arm(loop)
+
+    def submit(self, request_id, packet, dest, max_retries):
+        """
+        Transmit a request and return a future for its response.
+
+        :param request_id: The ID of the request.
+        :param packet: The full packet to transmit.
+        :param dest: The destination address.
+        :param max_retries: Number of transmissions before the request fails
+                            with :class:`TimeoutError`.
+        :rtype: :class:`asyncio.Future`
+        """
+        loop = asyncio.get_event_loop()
+        fut = loop.create_future()
+
+        if max_retries < 1:
+            fut.set_exception(TimeoutError("no response received in time"))
+            return fut
+
+        request = self._Request()
+        request.request_id = request_id
+        request.packet = packet
+        request.dest = dest
+        request.attempts_left = max_retries
+        request.deadline = None
+        request.started = loop.time()
+        request.fut = fut
+
+        self.logger.debug(
+            "app request 0x%08x: scheduled to %r (max_retries=%d)",
+            request_id,
+            dest,
+            max_retries,
+        )
+
+        self._requests[request_id] = request
+        self._transmit_attempt(loop, request)
+        self._arm(loop)
+        return fut
+
+    def response_received(self, request_id, payload):
+        """
+        Resolve the request with the given ID with `payload`.
+
+        :return: false if no such request is outstanding.
+        """
+        request = self._requests.pop(request_id, None)
+        if request is None:
+            return False
+
+        if not request.fut.done():
+            request.fut.set_result(payload)
+            self.latency.observe(
+                request.fut.get_loop().time() - request.started
+            )
+        return True
+
+    def cancel(self, request_id):
+        """
+        Cancel the request with the given ID.
+
+        :return: false if no such request is outstanding.
+        """
+        request = self._requests.pop(request_id, None)
+        if request is None:
+            return False
+        request.fut.cancel()
+        return True
+
+    def cancel_all(self):
+        """
+        Cancel all outstanding requests.
+        """
+        requests = list(self._requests.values())
+        self._requests.clear()
+        for request in requests:
+            request.fut.cancel()
+        self._arm(asyncio.get_event_loop())
+
+
 class DatagramStreamProtocol(asyncio.DatagramProtocol):
+    """
+    Reliable-ish stream of frames over UDP.
+
+    :param packet_size_controller: Adapt the size of DATA packets to the
+        observed packet loss (see :class:`PacketSizeController`).
+    :param fec_group_size: Enable forward error correction with XOR parity
+        over groups of up to this many frames.
+    :type fec_group_size: :class:`int`
+
+    Forward error correction is negotiated: a receiver with
+    `fec_group_size` set sends FEC_REQ packets along with its acks until the
+    first FEC packet arrives. A sender with `fec_group_size` set then sends
+    one FEC packet with the XOR over every group of frames, which allows the
+    receiver to rebuild a single lost frame of the group without waiting for
+    its retransmission. If no FEC packet arrives after `fec_group_size` plus
+    :attr:`FEC_REQ_RETRIES` requests, the peer is assumed to not support
+    FEC and no more requests are sent until the next handshake.
+    """
+
     SERIAL_BITS = 16
     MAX_PACKET_SIZE = 1200
+    FEC_CACHE_SIZE = 512
+    FEC_REQ_RETRIES = 8
 
     on_data_received = aioxmpp.callbacks.Signal()
     on_resync = aioxmpp.callbacks.Signal()
+    on_pause_writing = aioxmpp.callbacks.Signal()
+    on_resume_writing = aioxmpp.callbacks.Signal()
 
     def __init__(self, dest_port, *,
                  retransmit_threshold=timedelta(seconds=0.05),
                  tx_max_buffer_size=16,
+                 tx_initial_window=4,
+                 tx_min_window=1,
                  rx_loss_emulation=False,
                  autohandshake=True,
+                 packet_size_controller=None,
+                 fec_group_size=None,
                  logger=None):
         super().__init__()
         self.retransmit_threshold = retransmit_threshold
@@ -346,7 +773,16 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
         self._connection_id = 0
 
         self._tx_buffer = []
+        self._tx_pending = collections.deque()
         self._tx_max_buffer_size = tx_max_buffer_size
+        self._tx_min_window = tx_min_window
+        self._tx_window = float(
+            max(min(tx_initial_window, tx_max_buffer_size), tx_min_window)
+        )
+        self._tx_recovery_sn = None
+        self._tx_probe_timer = None
+        self._tx_writable = asyncio.Event()
+        self._tx_writable.set()
         self._rx_loss_emulation = rx_loss_emulation
         self._transport = None
         self._tx_sn = SerialNumberProvider(self.SERIAL_BITS)
@@ -354,13 +790,30 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
         self._tx_broadcast_addr = self._tx_dest_addr
         self._tx_last_acked_sn = None
         self._tx_broadcast_threshold = self._tx_max_buffer_size // 2
+        self._packet_size_controller = packet_size_controller
 
         self.tx_retransmit_count = 0
         self.tx_sent = 0
         self.tx_dropped = 0
         self.rx_given_up_count = 0
-
-        self.tx_app_request_retransmit_interval = timedelta(seconds=1)
+        self.tx_fec_sent = 0
+        self.rx_fec_recovered = 0
+        self.rx_fec_unrecoverable = 0
+        self.tx_ack_count = 0
+        self.rx_ack_count = 0
+
+        self._fec_group_size = fec_group_size
+        self._tx_fec_group_size = 0
+        self._tx_fec_group = []
+        self._rx_fec_active = False
+        self._rx_fec_requests = 0
+        self._rx_fec_cache = collections.OrderedDict()
+
+        self._app_requests = AppRequestScheduler(
+            self._tx,
+            timedelta(seconds=1),
+            logger=self.logger,
+        )
 
         self._rx_max_consecutive_sn = SerialNumber(
             self.SERIAL_BITS,
@@ -368,7 +821,6 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
         )
         self._rx_out_of_order = SerialNumberRangeSet()
         self._rx_last_sn = self._rx_max_consecutive_sn
-        self._rx_app_requests = {}
         self._autohandshake = autohandshake
 
         self._rx_buffer = []
@@ -380,6 +832,76 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
     def tx_buffer_size(self):
         return len(self._tx_buffer)
 
+    @property
+    def tx_window(self):
+        """
+        The current congestion window, i.e. the number of unacknowledged
+        frames which may be in flight.
+        """
+        return int(self._tx_window)
+
+    @property
+    def tx_pending_size(self):
+        """
+        Number of frames waiting for the congestion window to open.
+        """
+        return len(self._tx_pending)
+
+    @property
+    def writable(self):
+        """
+        Whether a frame passed to :meth:`send_frame` would be transmitted
+        immediately.
+        """
+        return self._tx_writable.is_set()
+
+    @property
+    def tx_app_request_retransmit_interval(self):
+        return self._app_requests.retransmit_interval
+
+    @tx_app_request_retransmit_interval.setter
+    def tx_app_request_retransmit_interval(self, value):
+        self._app_requests.retransmit_interval = value
+
+    @property
+    def app_requests_in_flight(self):
+        """
+        Number of application requests waiting for a response.
+        """
+        return self._app_requests.in_flight
+
+    @property
+    def app_request_latency(self):
+        """
+        :class:`~.metrics.Histogram` of the time between the first
+        transmission of an application request and its response, in seconds.
+        """
+        return self._app_requests.latency
+
+    @property
+    def packet_size(self):
+        """
+        The size limit up to which frames are piggybacked onto DATA packets.
+
+        This is :attr:`MAX_PACKET_SIZE` unless a
+        :class:`PacketSizeController` is in use.
+        """
+        if self._packet_size_controller is None:
+            return self.MAX_PACKET_SIZE
+        return self._packet_size_controller.packet_size
+
+    @property
+    def packet_size_stats(self):
+        """
+        Loss statistics per packet size bucket, see
+        :attr:`PacketSizeController.stats`.
+
+        Empty unless a :class:`PacketSizeController` is in use.
+        """
+        if self._packet_size_controller is None:
+            return {}
+        return self._packet_size_controller.stats
+
     def connection_made(self, transport):
         self.logger.debug("using transport %r", transport)
         self._transport = transport
@@ -389,6 +911,11 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
     def connection_lost(self, exc):
         self._transport = None
         self.logger.debug("lost transport: %r", exc)
+        if self._tx_probe_timer is not None:
+            self._tx_probe_timer.cancel()
+            self._tx_probe_timer = None
+        # wake up drain() so that it raises
+        self._tx_writable.set()
 
     def _mark_received_locally(self, sn):
         if sn <= self._rx_max_consecutive_sn:
@@ -441,9 +968,9 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
 
         self.logger.debug(
             "dropping %r from buffer as they were received by peer",
-            [sn for _, sn, _ in self._tx_buffer[:i+1]]
+            [sn for _, sn, _ in self._tx_buffer[:last_less_than+1]]
         )
-        del self._tx_buffer[:i+1]
+        del self._tx_buffer[:last_less_than+1]
 
     def _require_connection(self):
         if not self._transport:
@@ -501,10 +1028,14 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
 
         valid_connection = (connection_id and
                             connection_id == self._connection_id)
+        tx_unacked = len(self._tx_buffer)
+        tx_prev_acked_sn = self._tx_last_acked_sn
         if valid_connection:
             self._mark_received_remotely_up_to(max_recvd_sn)
             self._mark_received_remotely_single(last_recvd_sn)
             self._tx_last_acked_sn = last_recvd_sn
+            if self._packet_size_controller is not None:
+                self._packet_size_controller.record_feedback(last_recvd_sn)
             self.logger.debug("tx buffer is now: %r", self._tx_buffer)
         else:
             self.logger.debug(
@@ -531,6 +1062,13 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
             self._rx_out_of_order.clear()
             self._rx_max_consecutive_sn = min_avail_sn - 1
             self._tx_last_acked_sn = self._tx_sn.current
+            self._tx_fec_group_size = 0
+            self._tx_fec_group.clear()
+            self._rx_fec_active = False
+            self._rx_fec_requests = 0
+            self._rx_fec_cache.clear()
+            if self._packet_size_controller is not None:
+                self._packet_size_controller.clear_pending()
             self._tx_dest_addr = addr
             self.synchronized.set()
             self.on_resync()
@@ -556,11 +1094,24 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
                 )
 
         if valid_connection:
-            # discard state for everything up to min_avail_sn
-            self._rx_out_of_order.discard_up_to(min_avail_sn)
             if self._rx_max_consecutive_sn < min_avail_sn:
                 self.logger.debug("giving up on receiving frames")
+                # only the frames between the last consecutive one and
+                # min_avail_sn which were not received out of order are lost
+                self.rx_given_up_count += (
+                    (min_avail_sn - self._rx_max_consecutive_sn - 1) -
+                    self._rx_out_of_order.count_before(min_avail_sn)
+                )
                 self._rx_max_consecutive_sn = min_avail_sn
+            # discard state for everything up to min_avail_sn
+            self._rx_out_of_order.discard_up_to(min_avail_sn)
+
+            self._tx_on_feedback(
+                tx_unacked - len(self._tx_buffer),
+                tx_prev_acked_sn,
+                max_recvd_sn,
+                last_recvd_sn,
+            )
 
     def _handle_data_entry(self, sn, payload):
         self.logger.debug(
@@ -571,6 +1122,11 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
             self.logger.debug("duplicate frame, discarding")
             return
 
+        if self._fec_group_size:
+            if len(self._rx_fec_cache) >= self.FEC_CACHE_SIZE:
+                self._rx_fec_cache.popitem(last=False)
+            self._rx_fec_cache[sn] = payload
+
         for i, (recvd_sn, _) in enumerate(self._rx_buffer):
             if recvd_sn == sn:
                 # already in buffer
@@ -601,6 +1157,12 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
             remainder = remainder[length:]
             self._handle_data_entry(sn, payload)
 
+        self._deliver_rx_buffer()
+
+        self._rx_last_sn = first_sn
+        self._emit_ack()
+
+    def _deliver_rx_buffer(self):
         delete_up_to = 0
         for i, (recvd_sn, payload) in enumerate(self._rx_buffer):
             delete_up_to = i
@@ -616,7 +1178,87 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
                           self._rx_buffer)
         del self._rx_buffer[:delete_up_to]
 
-        self._rx_last_sn = first_sn
+    def _is_received_locally(self, sn):
+        return sn <= self._rx_max_consecutive_sn or sn in self._rx_out_of_order
+
+    def _handle_fec_req(self, remainder, valid_connection, **kwargs):
+        if not valid_connection:
+            self.logger.debug("ignoring FEC_REQ from unknown connection")
+            return
+
+        if not self._fec_group_size:
+            self.logger.debug("ignoring FEC_REQ, FEC is not enabled")
+            return
+
+        _, (scheme, group_size) = unpack_and_splice(remainder, fec_req_fmt)
+        try:
+            scheme = FECScheme(scheme)
+        except ValueError:
+            self.logger.debug("ignoring FEC_REQ for unknown scheme (%d)",
+                              scheme)
+            return
+
+        if scheme == FECScheme.NONE:
+            group_size = 0
+        else:
+            group_size = min(group_size, self._fec_group_size)
+
+        if group_size != self._tx_fec_group_size:
+            self.logger.debug("sending parity for groups of %d frame(s)",
+                              group_size)
+            self._tx_fec_group_size = group_size
+            self._tx_fec_group.clear()
+
+    def _handle_fec(self, remainder, valid_connection, **kwargs):
+        if not valid_connection or not self._fec_group_size:
+            self.logger.debug("ignoring FEC packet")
+            return
+
+        self._rx_fec_active = True
+
+        parity, (first_sn, count, length_xor) = unpack_and_splice(
+            remainder,
+            fec_header_fmt,
+        )
+        first_sn = SerialNumber(self.SERIAL_BITS, first_sn)
+
+        missing_sn = None
+        frames = [parity]
+        for i in range(count):
+            sn = first_sn + i
+            try:
+                frames.append(self._rx_fec_cache[sn])
+                continue
+            except KeyError:
+                pass
+
+            if self._is_received_locally(sn):
+                # not missing, but its payload is not known anymore either
+                return
+
+            if missing_sn is not None:
+                self.logger.debug(
+                    "more than one frame missing in FEC group starting "
+                    "at %s",
+                    first_sn,
+                )
+                self.rx_fec_unrecoverable += 1
+                return
+
+            missing_sn = sn
+
+        if missing_sn is None:
+            return
+
+        length = length_xor
+        for frame in frames[1:]:
+            length ^= len(frame)
+
+        self.logger.debug("recovered frame %s from FEC group starting at %s",
+                          missing_sn, first_sn)
+        self.rx_fec_recovered += 1
+        self._handle_data_entry(missing_sn, xor_frames(frames)[:length])
+        self._deliver_rx_buffer()
         self._emit_ack()
 
     def _handle_dack(self, remainder, valid_connection, **kwargs):
@@ -624,6 +1266,7 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
             self.logger.debug("ignoring DACK from unknown connection")
             return
 
+        self.rx_ack_count += 1
         while remainder:
             remainder, (first, last) = unpack_and_splice(
                 remainder,
@@ -678,14 +1321,10 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
         self.logger.debug("app request 0x%08x: response received",
                           request_id)
 
-        try:
-            fut = self._rx_app_requests[request_id]
-        except KeyError:
+        if not self._app_requests.response_received(request_id, remainder):
             self.logger.debug("app request 0x%08x: no response future. "
                               "late response?",
                               request_id)
-        else:
-            fut.set_result(remainder)
 
     def _compose_common_header(self, packet_type):
         if self._tx_buffer:
@@ -717,6 +1356,49 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
 
         self.logger.debug("sending ack for %d ranges", len(parts)-1)
         self._tx(b"".join(parts), self._tx_dest_addr)
+        self.tx_ack_count += 1
+
+        if self._fec_group_size and not self._rx_fec_active:
+            # repeat the request until the first parity arrives, which takes
+            # at least a full group of frames
+            max_requests = self._fec_group_size + self.FEC_REQ_RETRIES
+            if self._rx_fec_requests >= max_requests:
+                return
+            self._rx_fec_requests += 1
+            if self._rx_fec_requests == max_requests:
+                self.logger.info(
+                    "no FEC packet received after %d requests, assuming "
+                    "that the peer does not support FEC",
+                    max_requests,
+                )
+            self._tx(
+                b"".join([
+                    self._compose_common_header(PacketType.FEC_REQ),
+                    fec_req_fmt.pack(FECScheme.XOR.value,
+                                     self._fec_group_size),
+                ]),
+                self._tx_dest_addr,
+            )
+
+    def _tx_fec_flush(self):
+        first_sn = self._tx_fec_group[0][0]
+        frames = [frame for _, frame in self._tx_fec_group]
+        length_xor = 0
+        for frame in frames:
+            length_xor ^= len(frame)
+        self._tx_fec_group.clear()
+
+        self._tx(
+            b"".join([
+                self._compose_common_header(PacketType.FEC),
+                fec_header_fmt.pack(first_sn.to_int(),
+                                    len(frames),
+                                    length_xor),
+                xor_frames(frames),
+            ]),
+            self._tx_dest_addr,
+        )
+        self.tx_fec_sent += 1
 
     def _trigger_tx(self, use_broadcast):
         if not self._tx_buffer:
@@ -729,7 +1411,8 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
 
         i = 0
         now = time.monotonic()
-        while total_length < self.MAX_PACKET_SIZE:
+        packet_size = self.packet_size
+        while total_length < packet_size:
             pb_ts, pb_sn, pb_frame = self._tx_buffer[i]
             if pb_sn == main_sn:
                 break
@@ -744,12 +1427,92 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
             len(parts) - 2,
         )
 
+        if self._packet_size_controller is not None:
+            self._packet_size_controller.record_sent(main_sn, total_length)
+
         dest = self._tx_broadcast_addr if use_broadcast else self._tx_dest_addr
         self._tx(b"".join(parts), dest)
 
-    def send_frame(self, buf):
-        self._require_connection()
+    def _tx_window_open(self):
+        return len(self._tx_buffer) < int(self._tx_window)
+
+    def _tx_update_writable(self):
+        writable = not self._tx_pending and self._tx_window_open()
+        if writable == self._tx_writable.is_set():
+            return
+
+        if writable:
+            self._tx_writable.set()
+            self.on_resume_writing()
+        else:
+            self._tx_writable.clear()
+            self.on_pause_writing()
+
+    def _tx_congestion(self):
+        if (self._tx_recovery_sn is not None and
+                self._tx_buffer and
+                self._tx_buffer[0][1] < self._tx_recovery_sn):
+            # already reacted to a loss in this window
+            return
+
+        self._tx_window = max(self._tx_window / 2, self._tx_min_window)
+        self._tx_recovery_sn = self._tx_sn.current
+        self.logger.debug("congestion: window is now %d", self.tx_window)
+
+    def _tx_on_feedback(self, nacked, prev_acked_sn, max_recvd_sn,
+                        last_recvd_sn):
+        progress = nacked > 0 or (
+            prev_acked_sn is not None and last_recvd_sn > prev_acked_sn
+        )
+
+        if progress:
+            self._tx_window = min(
+                self._tx_window + max(nacked, 1) / self._tx_window,
+                self._tx_max_buffer_size,
+            )
+
+        if ((prev_acked_sn is not None and
+                last_recvd_sn > prev_acked_sn + 1) or
+                last_recvd_sn > max_recvd_sn + 1):
+            # the peer skipped at least one of our packets or has a hole in
+            # what it received
+            self._tx_congestion()
+
+        if progress and self._tx_probe_timer is not None:
+            self._tx_probe_timer.cancel()
+            self._tx_probe_timer = None
+
+        self._tx_flush_pending()
+
+    def _tx_arm_probe(self):
+        if self._tx_probe_timer is not None or not self._tx_buffer:
+            return
+
+        self._tx_probe_timer = asyncio.get_event_loop().call_later(
+            self.retransmit_threshold.total_seconds(),
+            self._tx_probe,
+        )
 
+    def _tx_probe(self):
+        self._tx_probe_timer = None
+        if not self._tx_buffer or self._transport is None:
+            return
+
+        # no feedback for the unacknowledged frames: treat as loss and
+        # retransmit what we have
+        self.logger.debug("no feedback, retransmitting")
+        self._tx_congestion()
+        self.tx_retransmit_count += 1
+        self._trigger_tx(self._connection_id == 0)
+        self._tx_arm_probe()
+
+    def _tx_flush_pending(self):
+        while self._tx_pending and self._tx_window_open():
+            self._tx_transmit(self._tx_pending.popleft())
+        self._tx_update_writable()
+        self._tx_arm_probe()
+
+    def _tx_transmit(self, buf):
         with self._tx_sn as sn:
             data_entry_hdr = data_entry_header_fmt.pack(
                 sn.to_int(),
@@ -758,63 +1521,127 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
 
             frame = b"".join([data_entry_hdr, buf])
             ts = time.monotonic()
-            if len(self._tx_buffer) == self._tx_max_buffer_size:
-                self.logger.debug(
-                    "dropping frame from tx buffer due to space limitations"
-                )
-                self.tx_dropped += 1
-                del self._tx_buffer[0]
             self._tx_buffer.append((ts, sn, frame))
 
-            use_broadcast = (
-                self._connection_id == 0 or
-                self._tx_last_acked_sn is None or
-                sn - self._tx_last_acked_sn > self._tx_broadcast_threshold
-            )
-
-            self._trigger_tx(use_broadcast)
-            self.tx_sent += 1
+        use_broadcast = (
+            self._connection_id == 0 or
+            self._tx_last_acked_sn is None or
+            sn - self._tx_last_acked_sn > self._tx_broadcast_threshold
+        )
 
-    def error_received(self, exc):
-        pass
+        self.tx_sent += 1
+        if self._tx_fec_group_size:
+            self._tx_fec_group.append((sn, buf))
+        self._trigger_tx(use_broadcast)
+        if (self._tx_fec_group_size and
+                len(self._tx_fec_group) >= self._tx_fec_group_size):
+            self._tx_fec_flush()
 
-    async def _app_request_tx_task(self, max_retries, packet, dest, fut,
-                                   request_id):
-        self.logger.debug(
-            "app request 0x%08x: started tx task to %r (max_retries=%d)",
-            request_id,
-            dest,
-            max_retries,
-        )
+    def send_frame(self, buf):
+        """
+        Queue a frame for transmission.
 
-        for i in range(max_retries):
-            self.logger.debug("app request 0x%08x: transmit attempt %d",
-                              request_id, i+1)
-            self._tx(packet, dest)
+        The frame is transmitted immediately if the congestion window allows
+        it and queued otherwise. If more than `tx_max_buffer_size` frames are
+        unacknowledged or queued, the oldest queued frame is dropped.
+        Producers should use :meth:`drain` or the :meth:`on_pause_writing`
+        and :meth:`on_resume_writing` signals to avoid that.
+        """
+        self._require_connection()
 
-            done, pending = await asyncio.wait(
-                [fut],
-                timeout=self.tx_app_request_retransmit_interval.total_seconds(),
+        self._tx_pending.append(buf)
+        while (len(self._tx_pending) + len(self._tx_buffer) >
+               self._tx_max_buffer_size):
+            self.logger.debug(
+                "dropping frame from tx buffer due to space limitations"
             )
+            self.tx_dropped += 1
+            if self._tx_pending:
+                self._tx_pending.popleft()
+            else:
+                del self._tx_buffer[0]
 
-            if fut in done:
-                self.logger.debug("app request 0x%08x: response future done",
-                                  request_id)
-                return fut.result()
+        self._tx_flush_pending()
 
-        self.logger.debug("app request 0x%08x: out of attempts, raising error",
-                          request_id)
+    async def drain(self):
+        """
+        Wait until the congestion window allows to transmit another frame.
 
-        raise TimeoutError("no response received in time")
+        :raises ConnectionError: if the transport is lost.
+        """
+        while True:
+            self._require_connection()
+            if self._tx_writable.is_set():
+                return
+            await self._tx_writable.wait()
 
-    def _app_request_fut_done(self, request_id, fut):
-        del self._rx_app_requests[request_id]
+    def register_metrics(self, registry, prefix="sn2d_stream_"):
+        """
+        Register the counters and gauges of this protocol with a
+        :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        counters = [
+            ("tx_frames_total", "Data frames transmitted",
+             lambda: self.tx_sent),
+            ("tx_retransmits_total", "Data frames retransmitted",
+             lambda: self.tx_retransmit_count),
+            ("tx_dropped_total", "Frames dropped due to a full send buffer",
+             lambda: self.tx_dropped),
+            ("tx_fec_total", "FEC parity packets transmitted",
+             lambda: self.tx_fec_sent),
+            ("tx_acks_total", "DACK packets transmitted",
+             lambda: self.tx_ack_count),
+            ("rx_acks_total", "DACK packets received",
+             lambda: self.rx_ack_count),
+            ("rx_given_up_total", "Frames given up on by the receiver",
+             lambda: self.rx_given_up_count),
+            ("rx_fec_recovered_total", "Frames recovered using FEC",
+             lambda: self.rx_fec_recovered),
+            ("rx_fec_unrecoverable_total",
+             "FEC groups which could not be used for recovery",
+             lambda: self.rx_fec_unrecoverable),
+            ("app_request_timeouts_total", "Application requests timed out",
+             lambda: self._app_requests.timeouts),
+        ]
+        gauges = [
+            ("tx_window", "Congestion window in frames",
+             lambda: self.tx_window),
+            ("tx_unacked", "Frames in flight waiting for acknowledgement",
+             lambda: self.tx_buffer_size),
+            ("tx_pending", "Frames waiting for the congestion window",
+             lambda: self.tx_pending_size),
+            ("rx_reorder_depth", "Frames held back for in-order delivery",
+             lambda: len(self._rx_buffer)),
+            ("packet_size", "Current packet size limit in bytes",
+             lambda: self.packet_size),
+            ("app_requests_in_flight", "Application requests in flight",
+             lambda: self.app_requests_in_flight),
+        ]
+
+        for name, help_, func in counters:
+            registry.counter_func(prefix + name, help_, func)
+        for name, help_, func in gauges:
+            registry.gauge_func(prefix + name, help_, func)
+        registry.register(
+            prefix + "app_request_latency_seconds",
+            "Time until an application request was answered",
+            self.app_request_latency,
+        )
+
+    def error_received(self, exc):
+        pass
 
     def app_request(self, type_, payload, dest=None, *,
                     max_retries=3):
         """
         Send an application request to the currently locked-to peer, or the
         given destination address.
+
+        Return a future which receives the response payload. If no response
+        is received after `max_retries` transmissions, the future fails with
+        :class:`TimeoutError`. Cancelling the future cancels the request.
         """
 
         request_id = _rng.getrandbits(32)
@@ -824,23 +1651,169 @@ class DatagramStreamProtocol(asyncio.DatagramProtocol):
             payload,
         ])
 
-        fut = asyncio.Future()
-        fut.add_done_callback(functools.partial(
-            self._app_request_fut_done,
-            request_id,
-        ))
-
-        self._rx_app_requests[request_id] = fut
-
         dest = dest or self._tx_dest_addr
 
-        return asyncio.ensure_future(self._app_request_tx_task(
-            max_retries,
+        return self._app_requests.submit(
+            request_id,
             packet,
             dest,
-            fut,
-            request_id,
-        ))
+            max_retries,
+        )
+
+    def cancel_app_requests(self):
+        """
+        Cancel all outstanding application requests.
+        """
+        self._app_requests.cancel_all()
+
+
+class DatagramDemultiplexer(asyncio.DatagramProtocol):
+    """
+    Dispatch the datagrams received on one socket to one protocol per peer.
+
+    :param protocol_factory: Called with the host address of a peer when
+        the first datagram from it arrives. Returns the
+        :class:`DatagramStreamProtocol` for the peer, or :data:`None` to
+        ignore the datagram.
+    :param max_peers: Maximum number of peers, or :data:`None` for no limit.
+    :param idle_timeout: Seconds without a datagram after which
+        :meth:`expire_idle` removes a peer, or :data:`None` to keep peers
+        forever.
+
+    Peers are identified by their host address only, so that a peer which
+    comes back with a different source port keeps its protocol; the protocol
+    replies to the address of the most recent handshake. All protocols share
+    the transport of the demultiplexer.
+
+    .. signal:: on_peer_added(host, protocol)
+
+       A protocol was created for a new peer.
+
+    .. signal:: on_peer_removed(host, protocol)
+
+       An idle peer was removed. The protocol has been told that the
+       connection is lost.
+
+    .. attribute:: rejected
+
+       Number of datagrams which were ignored because no protocol was
+       created for their peer.
+    """
+
+    on_peer_added = aioxmpp.callbacks.Signal()
+    on_peer_removed = aioxmpp.callbacks.Signal()
+
+    def __init__(self, protocol_factory, *, max_peers=None,
+                 idle_timeout=None, logger=None):
+        super().__init__()
+        self.logger = logger or logging.getLogger(__name__)
+        self._protocol_factory = protocol_factory
+        self.max_peers = max_peers
+        self.idle_timeout = idle_timeout
+        self._transport = None
+        self._peers = {}
+        self._last_seen = {}
+        self.rejected = 0
+        self.expired = 0
+
+    @property
+    def peers(self):
+        """
+        The protocols of the known peers, by host address.
+        """
+        return dict(self._peers)
+
+    def connection_made(self, transport):
+        self._transport = transport
+        for protocol in self._peers.values():
+            protocol.connection_made(transport)
+
+    def connection_lost(self, exc):
+        self._transport = None
+        for protocol in self._peers.values():
+            protocol.connection_lost(exc)
+
+    def error_received(self, exc):
+        pass
+
+    def _add_peer(self, host):
+        if self.max_peers is not None and len(self._peers) >= self.max_peers:
+            self.logger.debug("ignoring %s, limit of %d peers reached",
+                              host, self.max_peers)
+            return None
+
+        protocol = self._protocol_factory(host)
+        if protocol is None:
+            return None
+
+        self.logger.info("new peer %s", host)
+        self._peers[host] = protocol
+        self._last_seen[host] = time.monotonic()
+        if self._transport is not None:
+            protocol.connection_made(self._transport)
+        self.on_peer_added(host, protocol)
+        return protocol
+
+    def datagram_received(self, data, addr):
+        host = addr[0]
+        try:
+            protocol = self._peers[host]
+        except KeyError:
+            protocol = self._add_peer(host)
+            if protocol is None:
+                self.rejected += 1
+                return
+        else:
+            self._last_seen[host] = time.monotonic()
+        protocol.datagram_received(data, addr)
+
+    def expire_idle(self, now=None):
+        """
+        Remove the peers which did not send a datagram for `idle_timeout`
+        seconds.
+
+        :param now: The current :func:`time.monotonic` time.
+        :return: The host addresses of the removed peers.
+        """
+        if self.idle_timeout is None:
+            return []
+        if now is None:
+            now = time.monotonic()
+
+        expired = [
+            host for host, last_seen in self._last_seen.items()
+            if now - last_seen >= self.idle_timeout
+        ]
+        for host in expired:
+            protocol = self._peers.pop(host)
+            del self._last_seen[host]
+            self.expired += 1
+            self.logger.info("removing idle peer %s", host)
+            protocol.connection_lost(None)
+            self.on_peer_removed(host, protocol)
+        return expired
+
+    def register_metrics(self, registry, prefix="sn2d_peers_"):
+        """
+        Register the peer metrics with a :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        registry.gauge_func(
+            prefix + "known",
+            "Peers with a protocol",
+            lambda: len(self._peers),
+        )
+        registry.counter_func(
+            prefix + "rejected_datagrams_total",
+            "Datagrams ignored because their peer was not accepted",
+            lambda: self.rejected,
+        )
+        registry.counter_func(
+            prefix + "expired_total",
+            "Peers removed because they were idle",
+            lambda: self.expired,
+        )
 
 
 PORT1 = 7285
@@ -903,6 +1876,7 @@ async def _sender_impl(loop, args, sender, receiver):
         sender.send_frame(ctr.to_bytes(4, 'little'))
         ctr += 1
         await asyncio.sleep(1/args.rate)
+        await sender.drain()
 
 
 async def _tx_stats_impl(loop, args, sender, **kwargs):
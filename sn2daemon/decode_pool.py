@@ -0,0 +1,299 @@
+"""
+Decoding of received messages outside of the event loop.
+
+:class:`DecodePool` runs a decode function in a
+:class:`concurrent.futures.Executor` on batches of inputs and delivers the
+results on the event loop, in the order in which the inputs were submitted.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import time
+
+import aioxmpp.callbacks
+
+from . import metrics
+
+
+BATCH_TIME_BUCKETS = [
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 1,
+]
+
+
+def _run_batch(func, batch):
+    # runs in the executor; exceptions are returned per input so that one
+    # broken message does not fail the whole batch
+    started = time.monotonic()
+    results = []
+    for args in batch:
+        try:
+            results.append((func(*args), None))
+        except Exception as exc:  # NOQA
+            results.append((None, exc))
+    return started, time.monotonic() - started, results
+
+
+class _Batch:
+    def __init__(self):
+        self.args = []
+        self.contexts = []
+        self.enqueued = time.monotonic()
+        self.future = None
+
+
+class DecodePool:
+    """
+    Run a decode function in an executor on batches of inputs.
+
+    :param func: The function to call for each input. For a process pool,
+        it must be picklable, and so must be its arguments and results.
+    :param executor: The executor to run the batches in.
+    :type executor: :class:`concurrent.futures.Executor`
+    :param batch_size: Maximum number of inputs per batch.
+    :param max_in_flight: Maximum number of batches submitted to the
+        executor at the same time.
+    :param max_held: Maximum number of inputs held back on the loop side,
+        or :data:`None` for no limit.
+
+    Inputs are collected into a batch until either `batch_size` inputs have
+    been submitted or the event loop has finished its current iteration.
+    While `max_in_flight` batches are in the executor, further batches are
+    held back on the loop side. Once `max_held` inputs are held back,
+    further inputs are dropped until the executor catches up.
+
+    .. signal:: on_result(context, result, exc)
+
+       Emitted for each input, in submission order, with the `context`
+       passed to :meth:`submit`. Either `result` is the return value of
+       `func` and `exc` is :data:`None`, or `exc` is the exception raised
+       by `func`.
+
+    The following attributes describe the state of the pool:
+
+    .. attribute:: in_flight
+
+       Number of batches currently submitted to the executor.
+
+    .. attribute:: dropped
+
+       Number of inputs dropped because `max_held` inputs were held back.
+
+    .. attribute:: queue_time
+
+       :class:`~.metrics.Histogram` of the time from the first input of a
+       batch until a worker started processing it.
+
+    .. attribute:: processing_time
+
+       :class:`~.metrics.Histogram` of the time a worker spent on a batch.
+    """
+
+    on_result = aioxmpp.callbacks.Signal()
+
+    def __init__(self, func, executor, *,
+                 batch_size=32,
+                 max_in_flight=4,
+                 max_held=4096,
+                 logger=None):
+        super().__init__()
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be positive")
+        if max_held is not None and max_held < 1:
+            raise ValueError("max_held must be positive")
+
+        self.logger = logger or logging.getLogger(__name__)
+        self._func = func
+        self._executor = executor
+        self._loop = asyncio.get_event_loop()
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_held = max_held
+
+        self._current = None
+        self._held = collections.deque()
+        self._submitted = collections.deque()
+        self._closed = False
+        self._n_held = 0
+
+        self.in_flight = 0
+        self.dropped = 0
+        self.batches = 0
+        self.inputs = 0
+        self.queue_time = metrics.Histogram(BATCH_TIME_BUCKETS)
+        self.processing_time = metrics.Histogram(BATCH_TIME_BUCKETS)
+
+    @classmethod
+    def create(cls, func, kind="thread", workers=None, **kwargs):
+        """
+        Create a pool with a new executor.
+
+        :param kind: ``"thread"`` or ``"process"``.
+        :param workers: Number of workers, see
+            :class:`concurrent.futures.ThreadPoolExecutor` and
+            :class:`concurrent.futures.ProcessPoolExecutor`.
+
+        Further keyword arguments are passed to the constructor.
+        """
+        if kind == "thread":
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix="sn2d-decode",
+            )
+        elif kind == "process":
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+            )
+        else:
+            raise ValueError("unknown executor kind: {!r}".format(kind))
+        return cls(func, executor, **kwargs)
+
+    @property
+    def held(self):
+        """
+        Number of inputs waiting for a free slot in the executor.
+        """
+        return self._n_held
+
+    def submit(self, context, *args):
+        """
+        Submit an input.
+
+        :param context: Passed to :meth:`on_result` with the result. It is
+            not passed to the executor.
+        :param args: The arguments for the decode function.
+        :return: :data:`False` if the input was dropped because `max_held`
+                 inputs are held back already.
+        """
+        if self._closed:
+            raise RuntimeError("pool is closed")
+
+        if self.max_held is not None and self._n_held >= self.max_held:
+            self.dropped += 1
+            return False
+
+        if self._current is None:
+            self._current = _Batch()
+            self._loop.call_soon(self._close_batch, self._current)
+
+        self._current.args.append(args)
+        self._current.contexts.append(context)
+        self._n_held += 1
+        if len(self._current.args) >= self.batch_size:
+            self._close_batch(self._current)
+        return True
+
+    def _close_batch(self, batch):
+        if batch is not self._current:
+            # already closed because it was full
+            return
+        self._current = None
+        self._held.append(batch)
+        self._submit_held()
+
+    def _submit_held(self):
+        while self._held and self.in_flight < self.max_in_flight:
+            batch = self._held.popleft()
+            self._n_held -= len(batch.args)
+            batch.future = self._loop.run_in_executor(
+                self._executor,
+                _run_batch,
+                self._func,
+                batch.args,
+            )
+            batch.future.add_done_callback(self._on_batch_done)
+            self._submitted.append(batch)
+            self.in_flight += 1
+
+    def _on_batch_done(self, future):
+        self.in_flight -= 1
+        # deliver in submission order: a batch which completes early waits
+        # for all batches submitted before it
+        while self._submitted and self._submitted[0].future.done():
+            self._deliver(self._submitted.popleft())
+        self._submit_held()
+
+    def _deliver(self, batch):
+        future = batch.future
+        if future.cancelled():
+            return
+
+        exc = future.exception()
+        if exc is not None:
+            self.logger.error("decode batch failed", exc_info=exc)
+            results = [(None, exc)] * len(batch.args)
+        else:
+            started, duration, results = future.result()
+            self.queue_time.observe(max(started - batch.enqueued, 0))
+            self.processing_time.observe(duration)
+            self.logger.debug(
+                "decoded batch of %d in %.3f ms (queued for %.3f ms)",
+                len(results),
+                duration * 1000,
+                (started - batch.enqueued) * 1000,
+            )
+
+        self.batches += 1
+        self.inputs += len(results)
+        for context, (result, result_exc) in zip(batch.contexts, results):
+            self.on_result(context, result, result_exc)
+
+    def close(self):
+        """
+        Stop accepting inputs and shut down the executor.
+
+        Inputs which have not been delivered yet are discarded.
+        """
+        self._closed = True
+        self._current = None
+        self._held.clear()
+        self._n_held = 0
+        for batch in self._submitted:
+            batch.future.cancel()
+        self._submitted.clear()
+        self._executor.shutdown(wait=False)
+
+    def register_metrics(self, registry, prefix="sn2d_decode_pool_"):
+        """
+        Register the pool metrics with a :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        registry.counter_func(
+            prefix + "batches_total",
+            "Batches decoded",
+            lambda: self.batches,
+        )
+        registry.counter_func(
+            prefix + "inputs_total",
+            "Inputs decoded",
+            lambda: self.inputs,
+        )
+        registry.counter_func(
+            prefix + "inputs_dropped_total",
+            "Inputs dropped because too many were held back",
+            lambda: self.dropped,
+        )
+        registry.gauge_func(
+            prefix + "batches_in_flight",
+            "Batches submitted to the executor",
+            lambda: self.in_flight,
+        )
+        registry.gauge_func(
+            prefix + "inputs_held",
+            "Inputs waiting for a free executor slot",
+            lambda: self.held,
+        )
+        registry.register(
+            prefix + "queue_seconds",
+            "Time from the first input of a batch until it was processed",
+            self.queue_time,
+        )
+        registry.register(
+            prefix + "processing_seconds",
+            "Time spent decoding a batch",
+            self.processing_time,
+        )
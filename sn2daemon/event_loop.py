@@ -0,0 +1,51 @@
+"""
+Selection of the event loop implementation.
+
+The ``loop.implementation`` configuration option selects the event loop
+used by the daemon and the uplink process:
+
+``"asyncio"`` (the default)
+    The event loop of the standard library.
+
+``"uvloop"``
+    The libuv based loop of :mod:`uvloop`. If uvloop is not installed, a
+    warning is logged and the standard loop is used instead.
+
+``"auto"``
+    uvloop if it is installed, the standard loop otherwise.
+"""
+import asyncio
+import logging
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+IMPLEMENTATIONS = ("asyncio", "uvloop", "auto")
+
+
+def new_event_loop(implementation="asyncio", *, logger=None):
+    """
+    Create a new event loop.
+
+    :param implementation: One of :data:`IMPLEMENTATIONS`.
+    :raises ValueError: if `implementation` is not known.
+    :return: The new event loop.
+    """
+    logger = logger or logging.getLogger(__name__)
+    if implementation not in IMPLEMENTATIONS:
+        raise ValueError(
+            "unknown event loop implementation: {!r}".format(implementation)
+        )
+
+    if implementation != "asyncio":
+        if uvloop is not None:
+            logger.debug("using uvloop %s", uvloop.__version__)
+            return uvloop.new_event_loop()
+        if implementation == "uvloop":
+            logger.warning("uvloop is not installed, "
+                           "falling back to the asyncio event loop")
+
+    return asyncio.new_event_loop()
@@ -0,0 +1,219 @@
+"""
+Health metrics of the sensor node.
+
+Status messages of version 2 and later carry health information about the
+sensor node: I2C bus overruns, BME280 timeouts, TX buffer usage and CPU
+usage. :func:`status_values` converts these sections into values;
+:class:`HealthExporter` does that at a configurable rate and makes the
+values available in the metrics registry and, as sample batches, to the
+sample sinks.
+"""
+import logging
+
+from datetime import timedelta
+
+from hintlib import sample
+
+
+#: Part of the sensor paths of the health sample batches.
+HEALTH_PART = "sn2-health"
+
+#: Names, descriptions and label names of the exported value families.
+FAMILIES = (
+    ("i2c_transaction_overruns",
+     "I2C transaction overruns, by bus",
+     ("bus",)),
+    ("bme280_timeouts",
+     "BME280 timeouts, by instance",
+     ("instance",)),
+    ("bme280_configure_status",
+     "BME280 configuration status, by instance",
+     ("instance",)),
+    ("tx_buffers",
+     "TX buffers of the sensor node, by state",
+     ("state",)),
+    ("cpu_percent",
+     "CPU usage of the sensor node in percent",
+     ("kind", "name")),
+)
+
+
+def _v5_cpu_percent(status, previous):
+    tasks = status.v5_task_metrics
+    if previous is None or previous.v5_task_metrics is None:
+        return {}
+    old_tasks = previous.v5_task_metrics
+    dt = (status.uptime - previous.uptime) % (2**16)
+    if not dt:
+        return {}
+
+    result = {
+        ("idle", ""):
+            ((tasks.idle_ticks - old_tasks.idle_ticks) % (2**16)) / dt * 100,
+    }
+    for i, (task, old_task) in enumerate(zip(tasks.tasks, old_tasks.tasks)):
+        result["task", str(i)] = \
+            ((task.cpu_ticks - old_task.cpu_ticks) % (2**16)) / dt * 100
+    return result
+
+
+def _v6_cpu_percent(cpu):
+    total = (cpu.idle + cpu.sched + sum(cpu.interrupts.values()) +
+             sum(cpu.tasks))
+    if not total:
+        return {}
+
+    result = {
+        ("idle", ""): cpu.idle / total * 100,
+        ("sched", ""): cpu.sched / total * 100,
+    }
+    for name, hits in cpu.interrupts.items():
+        result["interrupt", name] = hits / total * 100
+    for i, hits in enumerate(cpu.tasks):
+        result["task", str(i)] = hits / total * 100
+    return result
+
+
+def status_values(status, previous=None):
+    """
+    Convert the health sections of a status message into values.
+
+    :param status: The status message.
+    :type status: :class:`~.sbx_protocol.StatusMessage`
+    :param previous: The status message received before `status`, used to
+        calculate the CPU usage from the tick counters of version 5.
+    :return: Mapping of the names in :data:`FAMILIES` to mappings of label
+             value tuples to values.
+
+    For version 5, the CPU usage is the share of the uptime between the two
+    status messages. For version 6, it is the share of the samples the
+    sensor node took of what the CPU was doing.
+    """
+    values = {name: {} for name, *_ in FAMILIES}
+
+    for i, bus_metrics in enumerate((status.v2_i2c_metrics or []), 1):
+        values["i2c_transaction_overruns"][str(i),] = \
+            bus_metrics.transaction_overruns
+
+    for i, bme_metrics in enumerate((status.v4_bme280_metrics or [])):
+        values["bme280_timeouts"][str(i),] = bme_metrics.timeouts
+        values["bme280_configure_status"][str(i),] = \
+            bme_metrics.configure_status
+
+    if status.v5_tx_metrics is not None:
+        values["tx_buffers"].update({
+            ("allocated",): status.v5_tx_metrics.buffers_allocated,
+            ("most_allocated",): status.v5_tx_metrics.most_buffers_allocated,
+            ("ready",): status.v5_tx_metrics.buffers_ready,
+            ("total",): status.v5_tx_metrics.buffers_total,
+        })
+
+    if status.v5_task_metrics is not None:
+        values["cpu_percent"].update(_v5_cpu_percent(status, previous))
+
+    if status.v6_cpu_metrics is not None:
+        values["cpu_percent"].update(_v6_cpu_percent(status.v6_cpu_metrics))
+
+    return values
+
+
+def health_batches(timestamp, values):
+    """
+    Convert values from :func:`status_values` into sample batches.
+
+    There is one batch per non-empty family, with the family name as
+    instance of the :data:`HEALTH_PART` path and the label values, joined
+    with ``-``, as subparts.
+    """
+    return [
+        sample.SampleBatch(
+            timestamp=timestamp,
+            bare_path=sample.SensorPath(HEALTH_PART, name, None),
+            samples={
+                "-".join(filter(None, labels)): value
+                for labels, value in family.items()
+            },
+        )
+        for name, family in values.items()
+        if family
+    ]
+
+
+class HealthExporter:
+    """
+    Export the health of the sensor node from its status messages.
+
+    :param interval: Minimum interval between two exports in seconds, by RTC
+        timestamp of the status messages.
+    :param sinks: Sample sinks to submit the health samples to.
+    :type sinks: iterable of :class:`~.sink.Sink`
+
+    Status messages are only converted if there is a consumer, that is, a
+    sink or a metrics registry (see :meth:`register_metrics`). Otherwise,
+    :meth:`submit` does not even decode the health sections.
+
+    .. attribute:: values
+
+       The values of the most recent export, see :func:`status_values`.
+
+    .. attribute:: exports
+
+       Number of exports so far.
+    """
+
+    def __init__(self, interval=60, *, sinks=(), logger=None):
+        super().__init__()
+        self.logger = logger or logging.getLogger(__name__)
+        self.interval = timedelta(seconds=interval)
+        self.sinks = list(sinks)
+        self.values = {}
+        self.exports = 0
+        self._registered = False
+        self._last_export = None
+        self._previous = None
+
+    @property
+    def has_consumers(self):
+        return self._registered or bool(self.sinks)
+
+    def submit(self, rtc_timestamp, status):
+        """
+        Export the health sections of a status message, if the interval has
+        passed since the previous export.
+        """
+        if not self.has_consumers:
+            return
+
+        previous, self._previous = self._previous, status
+        if (self._last_export is not None and
+                rtc_timestamp - self._last_export < self.interval):
+            return
+
+        self._last_export = rtc_timestamp
+        self.values = status_values(status, previous)
+        self.exports += 1
+
+        if self.sinks:
+            batches = health_batches(rtc_timestamp, self.values)
+            for sink in self.sinks:
+                sink.submit_batches(batches)
+
+    def register_metrics(self, registry, prefix="sn2d_node_"):
+        """
+        Register the health values with a :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        for name, help_, label_names in FAMILIES:
+            registry.gauge_func(
+                prefix + name,
+                help_,
+                lambda name=name: self.values.get(name, {}),
+                label_names=label_names,
+            )
+        registry.counter_func(
+            prefix + "health_exports_total",
+            "Status messages exported as health values",
+            lambda: self.exports,
+        )
+        self._registered = True
@@ -0,0 +1,154 @@
+"""
+Holding back messages until they can be processed.
+
+Until the first status message has aligned the RTC mapping, the messages
+received from the sensor node cannot be processed. :class:`HoldbackQueue`
+keeps them in memory up to a limit and spills the data frames of further
+messages into an unlinked temporary file, from which they are decoded again
+when the queue is drained.
+"""
+import collections
+import logging
+import os
+import tempfile
+
+from . import overload
+
+
+class HoldbackQueue:
+    """
+    Bounded queue of messages waiting to be processed.
+
+    :param max_held: Maximum number of decoded messages kept in memory.
+    :param spool_size: Maximum size in bytes of the spilled data frames. With
+        zero, nothing is spilled.
+    :param spool_dir: Directory for the spill file, defaults to the
+        directory from :func:`tempfile.gettempdir`.
+
+    Messages are drained in the order they were held. Once a message has
+    been spilled, all later messages are spilled too, until the queue is
+    drained. When the spill file is full, or a message comes without a data
+    frame while spilling, the message is dropped.
+
+    .. attribute:: spilled
+
+       Number of messages written to the spill file.
+
+    .. attribute:: dropped
+
+       Number of messages dropped.
+    """
+
+    def __init__(self, max_held=1024, spool_size=16*1024*1024,
+                 spool_dir=None, *, logger=None):
+        super().__init__()
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_held = max_held
+        self.spool_size = spool_size
+        self.spool_dir = spool_dir
+        self._held = collections.deque()
+        self._spool = None
+        self._nspilled = 0
+        self.spilled = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._held) + self._nspilled
+
+    @property
+    def held(self):
+        """
+        Number of decoded messages kept in memory.
+        """
+        return len(self._held)
+
+    def _open_spool(self):
+        fd, path = tempfile.mkstemp(prefix="sn2d-holdback-",
+                                    dir=self.spool_dir)
+        os.close(fd)
+        try:
+            self._spool = overload.FrameSpool(path, self.spool_size)
+        finally:
+            # the spool keeps the file open; nothing needs to be cleaned up
+            # when the daemon dies
+            os.unlink(path)
+
+    def _spill(self, frame):
+        if frame is None or self.spool_size <= 0:
+            return False
+        if self._spool is None:
+            self._open_spool()
+            self.logger.warning(
+                "more than %d messages held back, spilling to disk",
+                self.max_held,
+            )
+        if not self._spool.append(bytes(frame)):
+            return False
+        self._nspilled += 1
+        self.spilled += 1
+        return True
+
+    def hold(self, obj, frame=None):
+        """
+        Hold back a message.
+
+        :param obj: The decoded message.
+        :param frame: The data frame the message was decoded from, required
+            to spill it.
+        """
+        if not self._nspilled and len(self._held) < self.max_held:
+            self._held.append(obj)
+        elif not self._spill(frame):
+            self.dropped += 1
+
+    def drain(self, decode):
+        """
+        Remove and yield all held back messages, oldest first.
+
+        :param decode: Function returning the message for a spilled data
+            frame. Frames for which it raises are logged and skipped.
+        """
+        while self._held:
+            yield self._held.popleft()
+
+        while self._nspilled:
+            frames = self._spool.read(64)
+            if not frames:
+                break
+            for frame in frames:
+                self._nspilled -= 1
+                try:
+                    obj = decode(frame)
+                except Exception:  # NOQA
+                    self.logger.warning("failed to decode spilled frame",
+                                        exc_info=True)
+                    continue
+                yield obj
+        self._nspilled = 0
+
+    def close(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def register_metrics(self, registry, prefix="sn2d_holdback_"):
+        """
+        Register the queue metrics with a :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        registry.gauge_func(
+            prefix + "held",
+            "Decoded messages held back in memory",
+            lambda: self.held,
+        )
+        registry.counter_func(
+            prefix + "spilled_total",
+            "Messages spilled to disk",
+            lambda: self.spilled,
+        )
+        registry.counter_func(
+            prefix + "dropped_total",
+            "Messages dropped because the queue was full",
+            lambda: self.dropped,
+        )
@@ -32,13 +32,25 @@ def main():
     import signal
 
     import sn2daemon.daemon
+    import sn2daemon.event_loop
 
-    loop = asyncio.get_event_loop()
+    loop = sn2daemon.event_loop.new_event_loop(
+        config.get("loop", {}).get("implementation", "asyncio"),
+    )
+    asyncio.set_event_loop(loop)
     d = sn2daemon.daemon.SensorNode2Daemon(args, config, loop)
 
+    def reload():
+        try:
+            with open(args.config.name) as f:
+                d.reload_rewrite_rules(toml.load(f))
+        except Exception:  # NOQA
+            logging.exception("failed to reload configuration")
+
     task = asyncio.ensure_future(d.run())
     loop.add_signal_handler(signal.SIGINT, task.cancel)
     loop.add_signal_handler(signal.SIGTERM, task.cancel)
+    loop.add_signal_handler(signal.SIGHUP, reload)
 
     try:
         loop.run_until_complete(task)
@@ -0,0 +1,423 @@
+"""
+Lightweight metrics for monitoring the daemon.
+
+Components register their metrics with a :class:`Registry`; the registry can
+render all metrics in the Prometheus text exposition format, and
+:func:`start_server` makes that available on a local TCP or Unix socket.
+
+Most counters in the daemon are plain attributes on the objects which
+maintain them. Those are exported through :meth:`Registry.counter_func` and
+:meth:`Registry.gauge_func`, which read the attribute only when the metrics
+are collected, so the hot paths are not affected.
+
+Components which exist once per sensor node register through a
+:class:`LabelledRegistry`, which adds a constant ``node`` label, so that the
+metric names are the same for all nodes.
+"""
+import asyncio
+import bisect
+import collections
+import logging
+import math
+
+
+logger = logging.getLogger(__name__)
+
+
+class Counter:
+    """
+    A monotonically increasing value.
+    """
+
+    type_ = "counter"
+    label_names = ()
+
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def collect(self):
+        yield (), self.value
+
+
+class Gauge:
+    """
+    A value which can go up and down.
+    """
+
+    type_ = "gauge"
+    label_names = ()
+
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def collect(self):
+        yield (), self.value
+
+
+class Histogram:
+    """
+    A histogram over fixed buckets.
+
+    :param buckets: Upper bounds (inclusive) of the buckets.
+    :type buckets: iterable of :class:`float`
+
+    An implicit bucket with an infinite upper bound catches all values larger
+    than the largest given bound.
+    """
+
+    type_ = "histogram"
+    label_names = ()
+
+    def __init__(self, buckets):
+        super().__init__()
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def iter_cumulative(self):
+        """
+        Iterate over the buckets and cumulative counts.
+
+        :return: Pairs of upper bound and the number of observations less
+                 than or equal to that bound, ending with :data:`math.inf`.
+        """
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), self._counts):
+            total += count
+            yield bound, total
+
+
+class FuncMetric:
+    """
+    A counter or gauge whose value is obtained from a callable on collection.
+
+    :param type_: ``"counter"`` or ``"gauge"``.
+    :param func: Callable returning the value. If `label_names` is not empty,
+                 it must return a mapping from tuples of label values to
+                 values instead.
+    :param label_names: Names of the labels.
+    """
+
+    def __init__(self, type_, func, label_names=()):
+        super().__init__()
+        self.type_ = type_
+        self.label_names = tuple(label_names)
+        self._func = func
+
+    def collect(self):
+        value = self._func()
+        if not self.label_names:
+            yield (), value
+            return
+        yield from value.items()
+
+
+class _LabelledFamily:
+    """
+    Metrics of one name, registered with different constant label values.
+
+    :param type_: Type of the metrics.
+    :param constant_names: Names of the constant labels.
+    :param inner_names: Names of the labels of the metrics themselves.
+    """
+
+    def __init__(self, type_, constant_names, inner_names):
+        super().__init__()
+        self.type_ = type_
+        self.constant_names = tuple(constant_names)
+        self.label_names = self.constant_names + tuple(inner_names)
+        self.children = collections.OrderedDict()
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{{{}}}".format(",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace(
+                "\n", "\\n"
+            ),
+        )
+        for name, value in zip(names, values)
+    ))
+
+
+class Registry:
+    """
+    A collection of named metrics.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._metrics = collections.OrderedDict()
+
+    def register(self, name, help_, metric):
+        """
+        Register a metric object under `name`.
+
+        :raises ValueError: if a metric with that name already exists.
+        :return: `metric`
+        """
+        if name in self._metrics:
+            raise ValueError("duplicate metric: {!r}".format(name))
+        self._metrics[name] = help_, metric
+        return metric
+
+    def unregister(self, name):
+        del self._metrics[name]
+
+    def _register_child(self, name, help_, labels, metric):
+        names = tuple(label for label, _ in labels)
+        values = tuple(value for _, value in labels)
+        try:
+            _, family = self._metrics[name]
+        except KeyError:
+            family = _LabelledFamily(metric.type_, names, metric.label_names)
+            self._metrics[name] = help_, family
+        else:
+            if (not isinstance(family, _LabelledFamily) or
+                    family.type_ != metric.type_ or
+                    family.label_names != names + metric.label_names or
+                    values in family.children):
+                raise ValueError("duplicate metric: {!r}".format(name))
+        family.children[values] = metric
+        return metric
+
+    def _unregister_child(self, name, labels):
+        _, family = self._metrics[name]
+        del family.children[tuple(value for _, value in labels)]
+        if not family.children:
+            del self._metrics[name]
+
+    def labelled(self, **labels):
+        """
+        Return a view of the registry which adds constant labels.
+
+        :return: A :class:`LabelledRegistry`.
+        """
+        return LabelledRegistry(self, labels)
+
+    def unregister_prefix(self, prefix):
+        """
+        Remove all metrics whose names start with `prefix`.
+        """
+        for name in list(self._metrics):
+            if name.startswith(prefix):
+                del self._metrics[name]
+
+    def counter(self, name, help_):
+        return self.register(name, help_, Counter())
+
+    def gauge(self, name, help_):
+        return self.register(name, help_, Gauge())
+
+    def histogram(self, name, help_, buckets):
+        return self.register(name, help_, Histogram(buckets))
+
+    def counter_func(self, name, help_, func, label_names=()):
+        return self.register(name, help_,
+                             FuncMetric("counter", func, label_names))
+
+    def gauge_func(self, name, help_, func, label_names=()):
+        return self.register(name, help_,
+                             FuncMetric("gauge", func, label_names))
+
+    def get(self, name):
+        return self._metrics[name][1]
+
+    def __contains__(self, name):
+        return name in self._metrics
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        :rtype: :class:`str`
+        """
+        lines = []
+        for name, (help_, metric) in self._metrics.items():
+            lines.append("# HELP {} {}".format(
+                name,
+                help_.replace("\\", "\\\\").replace("\n", "\\n"),
+            ))
+            lines.append("# TYPE {} {}".format(name, metric.type_))
+
+            if isinstance(metric, _LabelledFamily):
+                for values, child in metric.children.items():
+                    self._render_metric(lines, name, child,
+                                        metric.constant_names, values)
+            else:
+                self._render_metric(lines, name, metric, (), ())
+
+        lines.append("")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _render_metric(lines, name, metric, constant_names, constant_values):
+        if isinstance(metric, Histogram):
+            for bound, count in metric.iter_cumulative():
+                lines.append("{}_bucket{} {}".format(
+                    name,
+                    _format_labels(constant_names + ("le",),
+                                   constant_values + (_format_value(bound),)),
+                    count,
+                ))
+            labels = _format_labels(constant_names, constant_values)
+            lines.append("{}_sum{} {}".format(
+                name, labels, _format_value(metric.sum)
+            ))
+            lines.append("{}_count{} {}".format(name, labels, metric.count))
+            return
+
+        try:
+            samples = list(metric.collect())
+        except Exception:  # NOQA
+            logger.warning("failed to collect metric %r", name,
+                           exc_info=True)
+            return
+
+        for label_values, value in samples:
+            lines.append("{}{} {}".format(
+                name,
+                _format_labels(constant_names + metric.label_names,
+                               constant_values + tuple(label_values)),
+                _format_value(value),
+            ))
+
+
+class LabelledRegistry:
+    """
+    View of a :class:`Registry` which adds constant labels to the metrics
+    registered through it.
+
+    :param registry: The registry to register the metrics with.
+    :param labels: Mapping of label names to values.
+
+    Views with the same label names share the metric families in
+    `registry`; each metric is rendered with the labels of the view it was
+    registered through. The view has the registration methods of
+    :class:`Registry`, so components can register with either.
+    """
+
+    def __init__(self, registry, labels):
+        super().__init__()
+        self.registry = registry
+        self.labels = tuple(labels.items())
+        self._names = []
+
+    def register(self, name, help_, metric):
+        """
+        Register a metric object under `name`.
+
+        :raises ValueError: if a metric with that name and labels exists, or
+            a metric with that name and other label names.
+        :return: `metric`
+        """
+        self.registry._register_child(name, help_, self.labels, metric)
+        self._names.append(name)
+        return metric
+
+    def unregister_all(self):
+        """
+        Remove all metrics registered through this view.
+        """
+        for name in self._names:
+            self.registry._unregister_child(name, self.labels)
+        self._names.clear()
+
+    def counter(self, name, help_):
+        return self.register(name, help_, Counter())
+
+    def gauge(self, name, help_):
+        return self.register(name, help_, Gauge())
+
+    def histogram(self, name, help_, buckets):
+        return self.register(name, help_, Histogram(buckets))
+
+    def counter_func(self, name, help_, func, label_names=()):
+        return self.register(name, help_,
+                             FuncMetric("counter", func, label_names))
+
+    def gauge_func(self, name, help_, func, label_names=()):
+        return self.register(name, help_,
+                             FuncMetric("gauge", func, label_names))
+
+
+async def _handle_client(registry, reader, writer):
+    try:
+        # we answer every request with the metrics, but read the request
+        # first so that HTTP clients do not see a connection reset
+        try:
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 1)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            pass
+
+        body = registry.render().encode("utf-8")
+        writer.write(b"".join([
+            b"HTTP/1.0 200 OK\r\n",
+            b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n",
+            "Content-Length: {}\r\n".format(len(body)).encode("ascii"),
+            b"\r\n",
+            body,
+        ]))
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(registry, *, path=None, host=None, port=None):
+    """
+    Serve the metrics of `registry` on a Unix or TCP socket.
+
+    :param path: Path of the Unix socket to listen on.
+    :param host: Address to listen on for TCP.
+    :param port: Port to listen on for TCP.
+    :return: The :class:`asyncio.AbstractServer`.
+
+    Each connection receives a minimal HTTP response with the current metrics
+    and is closed afterwards, which is sufficient for Prometheus and for
+    ``curl`` (use ``--unix-socket`` for the Unix socket).
+    """
+    def handle(reader, writer):
+        return _handle_client(registry, reader, writer)
+
+    if path is not None:
+        return await asyncio.start_unix_server(handle, path=str(path))
+    if port is None:
+        raise ValueError("either path or port must be given")
+    return await asyncio.start_server(handle, host=host or "127.0.0.1",
+                                      port=port)
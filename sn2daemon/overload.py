@@ -0,0 +1,468 @@
+"""
+Overload detection and load shedding.
+
+:class:`OverloadController` decides, per received message, whether it is
+processed, dropped or deferred, based on the event loop lag measured by a
+:class:`LoopLagMonitor`, the depths of registered queues and a per-type
+policy.
+"""
+import asyncio
+import collections
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+import traceback
+
+from enum import Enum
+
+from . import metrics
+
+
+LAG_BUCKETS = [
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+]
+
+
+class Action(Enum):
+    """
+    What to do with messages of a type while the daemon is overloaded.
+    """
+
+    #: Process the message as usual.
+    KEEP = "keep"
+
+    #: Process only every n-th run of messages.
+    DECIMATE = "decimate"
+
+    #: Store the message in the :class:`FrameSpool` and process it once the
+    #: overload is over.
+    DEFER = "defer"
+
+    #: Drop the message.
+    DROP = "drop"
+
+
+#: Default policy: sensor stream packets are deferred, everything else is
+#: kept. Dropping single stream packets would make every kept packet start a
+#: new stream block, so they are not decimated by default.
+DEFAULT_POLICY = {
+    "SENSOR_STREAM_ACCEL_X": Action.DEFER,
+    "SENSOR_STREAM_ACCEL_Y": Action.DEFER,
+    "SENSOR_STREAM_ACCEL_Z": Action.DEFER,
+    "SENSOR_STREAM_COMPASS_X": Action.DEFER,
+    "SENSOR_STREAM_COMPASS_Y": Action.DEFER,
+    "SENSOR_STREAM_COMPASS_Z": Action.DEFER,
+}
+
+
+class LoopLagMonitor:
+    """
+    Measure how late the event loop runs callbacks.
+
+    :param interval: Interval between measurements in seconds.
+    :param slow_threshold: If not :data:`None`, log the stack of the event
+        loop thread when the loop does not get to a measurement for this
+        many seconds after it was due.
+
+    A callback is scheduled every `interval` seconds; the lag is the time
+    between its scheduled and its actual run time.
+
+    To identify what blocks the loop, a watchdog thread checks whether the
+    measurements are late by more than `slow_threshold`. If so, it logs the
+    current stack of the thread running the loop, which is the stack of the
+    blocking callback, once per stall.
+
+    .. attribute:: lag
+
+       The most recently measured lag in seconds.
+
+    .. attribute:: max_lag
+
+       The largest lag measured so far.
+
+    .. attribute:: lag_histogram
+
+       :class:`~.metrics.Histogram` of all measured lags.
+
+    .. attribute:: slow_callbacks
+
+       Number of stalls longer than `slow_threshold`.
+    """
+
+    def __init__(self, interval=0.1, *, loop=None, slow_threshold=None,
+                 logger=None):
+        super().__init__()
+        self.logger = logger or logging.getLogger(__name__)
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self._loop = loop or asyncio.get_event_loop()
+        self._handle = None
+        self._expected = None
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.lag_histogram = metrics.Histogram(LAG_BUCKETS)
+        self.slow_callbacks = 0
+        self._watchdog = None
+        self._watchdog_stop = threading.Event()
+        # monotonic deadline of the next measurement, for the watchdog
+        self._deadline = None
+        self._loop_thread_id = None
+
+    def start(self):
+        if self._handle is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._schedule()
+        if self.slow_threshold is not None:
+            self._watchdog_stop.clear()
+            self._watchdog = threading.Thread(
+                target=self._watch,
+                name="sn2d-loop-watchdog",
+                daemon=True,
+            )
+            self._watchdog.start()
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._watchdog is not None:
+            self._watchdog_stop.set()
+            self._watchdog.join()
+            self._watchdog = None
+
+    def _schedule(self):
+        self._expected = self._loop.time() + self.interval
+        self._deadline = time.monotonic() + self.interval
+        self._handle = self._loop.call_at(self._expected, self._tick)
+
+    def _tick(self):
+        self.lag = max(self._loop.time() - self._expected, 0.0)
+        self.max_lag = max(self.max_lag, self.lag)
+        self.lag_histogram.observe(self.lag)
+        self._schedule()
+
+    def _watch(self):
+        reported = None
+        while not self._watchdog_stop.wait(self.slow_threshold / 2):
+            deadline = self._deadline
+            if deadline is None or deadline == reported:
+                continue
+            stalled = time.monotonic() - deadline
+            if stalled < self.slow_threshold:
+                continue
+
+            reported = deadline
+            self.slow_callbacks += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "?"
+            self.logger.warning(
+                "event loop blocked for more than %.3fs in:\n%s",
+                stalled,
+                stack,
+            )
+
+    def register_metrics(self, registry, prefix="sn2d_loop_"):
+        """
+        Register the monitor metrics with a :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        registry.register(
+            prefix + "lag_seconds",
+            "Delay of the periodic event loop probe",
+            self.lag_histogram,
+        )
+        registry.gauge_func(
+            prefix + "max_lag_seconds",
+            "Largest event loop lag measured",
+            lambda: self.max_lag,
+        )
+        registry.counter_func(
+            prefix + "slow_callbacks_total",
+            "Event loop stalls longer than the slow callback threshold",
+            lambda: self.slow_callbacks,
+        )
+
+
+class FrameSpool:
+    """
+    Bounded on-disk FIFO of frames.
+
+    :param path: The spool file. Frames left in it from a previous run are
+        read first.
+    :type path: :class:`pathlib.Path`
+    :param max_size: Maximum size of the spool file in bytes.
+    """
+
+    _length = struct.Struct("<H")
+
+    def __init__(self, path, max_size=16*1024*1024):
+        super().__init__()
+        self.max_size = max_size
+        self._file = open(path, "a+b")
+        self._file.seek(0, os.SEEK_END)
+        self._size = self._file.tell()
+        self._read_offset = 0
+
+    def __len__(self):
+        """
+        Number of bytes not read yet.
+        """
+        return self._size - self._read_offset
+
+    def append(self, frame):
+        """
+        Append a frame.
+
+        :return: :data:`False` if the spool is full and the frame was not
+                 stored.
+        """
+        if self._size + self._length.size + len(frame) > self.max_size:
+            return False
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(self._length.pack(len(frame)))
+        self._file.write(frame)
+        self._size += self._length.size + len(frame)
+        return True
+
+    def read(self, max_frames):
+        """
+        Remove and return up to `max_frames` frames from the front.
+
+        Once all frames have been read, the file is truncated.
+        """
+        self._file.flush()
+        self._file.seek(self._read_offset)
+        result = []
+        while len(result) < max_frames and self._read_offset < self._size:
+            length, = self._length.unpack(self._file.read(self._length.size))
+            result.append(self._file.read(length))
+            self._read_offset += self._length.size + length
+
+        if self._read_offset >= self._size:
+            self._file.truncate(0)
+            self._size = 0
+            self._read_offset = 0
+        return result
+
+    def close(self):
+        self._file.close()
+
+
+class OverloadController:
+    """
+    Decide which messages to shed while the daemon is overloaded.
+
+    :param monitor: Loop lag monitor, or :data:`None` to not use the loop
+        lag.
+    :type monitor: :class:`LoopLagMonitor`
+    :param lag_threshold: Loop lag in seconds above which the daemon is
+        overloaded, or :data:`None` to not use the loop lag.
+    :param queue_threshold: Queue depth above which the daemon is
+        overloaded, see :meth:`add_queue`.
+    :param policy: Mapping of message type names (the names of
+        :class:`~.sbx_protocol.MsgType` members and ``"ESP_STATUS"``) to
+        :class:`Action`. Types without an entry are kept.
+    :param decimation: For :attr:`Action.DECIMATE`, keep one run of
+        messages out of this many.
+    :param decimation_run: Number of consecutive messages of a type which
+        are kept or dropped together by :attr:`Action.DECIMATE`. For sensor
+        stream packets, runs of about one stream buffer batch avoid that
+        each kept packet starts a new stream block.
+    :param spool: Spool for :attr:`Action.DEFER`. Without a spool, a
+        warning is logged and deferring types are kept.
+    :type spool: :class:`FrameSpool`
+
+    Without a threshold, the daemon is never considered overloaded and all
+    messages are kept.
+
+    .. attribute:: decisions
+
+       :class:`collections.Counter` of the decisions taken while overloaded,
+       keyed by message type name and outcome (``"keep"``, ``"decimated"``,
+       ``"deferred"`` or ``"dropped"``). Messages of a deferring type which
+       are spooled after the overload is over, because older messages are
+       still spooled, count as ``"deferred"`` too.
+
+    .. attribute:: overload_episodes
+
+       Number of times the daemon became overloaded.
+    """
+
+    def __init__(self, *,
+                 monitor=None,
+                 lag_threshold=None,
+                 queue_threshold=None,
+                 policy=None,
+                 decimation=4,
+                 decimation_run=1,
+                 spool=None,
+                 logger=None):
+        super().__init__()
+        self.logger = logger or logging.getLogger(__name__)
+        self.monitor = monitor
+        self.lag_threshold = lag_threshold
+        self.queue_threshold = queue_threshold
+        self.policy = dict(DEFAULT_POLICY if policy is None else policy)
+        self.decimation = decimation
+        self.decimation_run = decimation_run
+        self.spool = spool
+        self._queues = {}
+        self._decimation_counters = collections.Counter()
+        self._overloaded = False
+        self.decisions = collections.Counter()
+        self.overload_episodes = 0
+
+        if self.spool is None:
+            deferring = sorted(
+                type_name for type_name, action in self.policy.items()
+                if action == Action.DEFER
+            )
+            if deferring:
+                self.logger.warning(
+                    "no overload spool configured, messages of types %s "
+                    "are kept while overloaded",
+                    ", ".join(deferring),
+                )
+
+    def add_queue(self, name, depth):
+        """
+        Take the depth of a queue into account.
+
+        :param name: Name of the queue, for logging.
+        :param depth: Function returning the current depth of the queue.
+        """
+        self._queues[name] = depth
+
+    def _check(self):
+        reasons = []
+        if (self.monitor is not None and
+                self.lag_threshold is not None and
+                self.monitor.lag > self.lag_threshold):
+            reasons.append("loop lag {:.3f}s".format(self.monitor.lag))
+        if self.queue_threshold is not None:
+            for name, depth in self._queues.items():
+                value = depth()
+                if value is not None and value > self.queue_threshold:
+                    reasons.append("{} depth {}".format(name, value))
+
+        overloaded = bool(reasons)
+        if overloaded and not self._overloaded:
+            self.overload_episodes += 1
+            self.logger.warning("overloaded (%s), shedding load",
+                                ", ".join(reasons))
+        elif not overloaded and self._overloaded:
+            self.logger.info("overload is over")
+        self._overloaded = overloaded
+        return overloaded
+
+    @property
+    def overloaded(self):
+        return self._check()
+
+    def _action(self, type_name):
+        action = self.policy.get(type_name, Action.KEEP)
+        if action == Action.DEFER and self.spool is None:
+            return Action.KEEP
+        return action
+
+    def decide(self, type_name):
+        """
+        Decide what to do with a message.
+
+        :param type_name: The name of the message type.
+        :rtype: :class:`Action`
+        :return: :attr:`Action.KEEP`, :attr:`Action.DEFER` or
+                 :attr:`Action.DROP`.
+        """
+        action = self._action(type_name)
+        deferring = action == Action.DEFER and self.has_deferred
+
+        if not self._check() and not deferring:
+            return Action.KEEP
+
+        if action == Action.DECIMATE:
+            n = self._decimation_counters[type_name]
+            self._decimation_counters[type_name] = \
+                (n + 1) % (self.decimation * self.decimation_run)
+            if n < self.decimation_run:
+                outcome = "keep"
+                action = Action.KEEP
+            else:
+                outcome = "decimated"
+                action = Action.DROP
+        elif action == Action.DEFER:
+            # counted by defer()
+            return action
+        else:
+            outcome = "keep" if action == Action.KEEP else "dropped"
+
+        self.decisions[type_name, outcome] += 1
+        return action
+
+    def defer(self, type_name, frame):
+        """
+        Store a frame for which :meth:`decide` returned
+        :attr:`Action.DEFER`.
+
+        If the spool is full, the frame is dropped.
+        """
+        if self.spool.append(frame):
+            self.decisions[type_name, "deferred"] += 1
+        else:
+            self.decisions[type_name, "dropped"] += 1
+
+    @property
+    def has_deferred(self):
+        """
+        Whether deferred frames are waiting to be processed.
+        """
+        return self.spool is not None and len(self.spool) > 0
+
+    def take_deferred(self, max_frames):
+        """
+        Return up to `max_frames` deferred frames, if the daemon is not
+        overloaded.
+        """
+        if not self.has_deferred or self._check():
+            return []
+        return self.spool.read(max_frames)
+
+    def register_metrics(self, registry, prefix="sn2d_overload_"):
+        """
+        Register the controller metrics with a :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        registry.counter_func(
+            prefix + "decisions_total",
+            "Messages received while overloaded, by type and outcome",
+            lambda: dict(self.decisions),
+            label_names=("type", "outcome"),
+        )
+        registry.counter_func(
+            prefix + "episodes_total",
+            "Number of times the daemon became overloaded",
+            lambda: self.overload_episodes,
+        )
+        registry.gauge_func(
+            prefix + "active",
+            "Whether the daemon is overloaded",
+            lambda: int(self._overloaded),
+        )
+        if self.monitor is not None:
+            registry.gauge_func(
+                prefix + "loop_lag_seconds",
+                "Most recently measured event loop lag",
+                lambda: self.monitor.lag,
+            )
+        if self.spool is not None:
+            registry.gauge_func(
+                prefix + "spool_bytes",
+                "Bytes of deferred frames on disk",
+                lambda: len(self.spool),
+            )
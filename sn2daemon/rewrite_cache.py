@@ -0,0 +1,215 @@
+"""
+Caching of rewrite decisions per sensor path.
+
+The rewriters from :mod:`hintlib.rewrite` evaluate their rules for every
+sample and every batch. For most paths, the outcome only depends on the
+path: the item is dropped, passed through unchanged or moved to another
+path. :class:`SampleRewriteCache` and :class:`BatchRewriteCache` remember
+that outcome per path after the first evaluation and apply it directly to
+later items.
+
+The outcome is not taken from the first item alone, whose value may happen
+to be left unchanged by a value transformation (for example zero under a
+scaling rule). Instead, the rules for the path are also evaluated on items
+with probe values, and only an outcome shared by all of them is cached.
+Items whose value (or samples) the rules change are always passed to the
+rewriter, because the transformation itself cannot be extracted from it.
+Rules whose outcome depends on the value, for example a rule which only
+applies to values in a certain range, must not be used with a cache.
+"""
+import collections
+
+from hintlib import sample
+
+
+#: The rewriter returned the item unchanged.
+_PASS = object()
+
+#: The rewriter dropped the item.
+_DROP = object()
+
+#: The rewriter changed more than the path; it has to be called every time.
+_CALL = object()
+
+#: Values the rules of a path are evaluated on in addition to the first
+#: item. They are chosen to not be fixed points of common transformations
+#: like scaling, offsets, rounding, clamping or taking the absolute value.
+_PROBE_VALUES = (-1234.5678, 0.3125)
+
+
+class _RewriteCache:
+    """
+    Base class of the rewrite caches.
+
+    :param rewriter: The rewriter to cache the decisions of.
+    :param max_size: Maximum number of paths to remember. The least
+        recently used path is evicted first. With zero, nothing is cached.
+
+    .. attribute:: hits
+
+       Number of items rewritten from the cache.
+
+    .. attribute:: misses
+
+       Number of items passed to the rewriter.
+    """
+
+    def __init__(self, rewriter, max_size=1024):
+        super().__init__()
+        self.rewriter = rewriter
+        self.max_size = max_size
+        self._outcomes = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._outcomes)
+
+    def reset(self, rewriter=None):
+        """
+        Forget all cached decisions.
+
+        :param rewriter: If given, use this rewriter from now on, for
+            example after the rules were reloaded.
+        """
+        if rewriter is not None:
+            self.rewriter = rewriter
+        self._outcomes.clear()
+
+    def _key(self, item):
+        raise NotImplementedError
+
+    def _outcome(self, item, result):
+        raise NotImplementedError
+
+    def _probe(self, item, value):
+        raise NotImplementedError
+
+    def _classify(self, item, result):
+        outcome = self._outcome(item, result)
+        if outcome is _CALL:
+            return _CALL
+        for value in _PROBE_VALUES:
+            probe = self._probe(item, value)
+            if self._outcome(probe, self.rewriter.rewrite(probe)) != outcome:
+                return _CALL
+        return outcome
+
+    def _move(self, item, path):
+        raise NotImplementedError
+
+    def rewrite(self, item):
+        key = self._key(item)
+        try:
+            outcome = self._outcomes[key]
+        except KeyError:
+            pass
+        else:
+            self._outcomes.move_to_end(key)
+            if outcome is not _CALL:
+                self.hits += 1
+                if outcome is _PASS:
+                    return item
+                if outcome is _DROP:
+                    return None
+                return self._move(item, outcome)
+
+        self.misses += 1
+        result = self.rewriter.rewrite(item)
+        if self.max_size > 0 and key not in self._outcomes:
+            if len(self._outcomes) >= self.max_size:
+                self._outcomes.popitem(last=False)
+            self._outcomes[key] = self._classify(item, result)
+        return result
+
+    def register_metrics(self, registry, prefix):
+        """
+        Register the cache metrics with a :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        registry.counter_func(
+            prefix + "hits_total",
+            "Items rewritten with a cached decision",
+            lambda: self.hits,
+        )
+        registry.counter_func(
+            prefix + "misses_total",
+            "Items passed to the rewriter",
+            lambda: self.misses,
+        )
+        registry.gauge_func(
+            prefix + "paths",
+            "Paths with a cached decision",
+            lambda: len(self._outcomes),
+        )
+
+
+class SampleRewriteCache(_RewriteCache):
+    """
+    Cache the decisions of a
+    :class:`hintlib.rewrite.IndividualSampleRewriter` per sensor path.
+
+    See :class:`_RewriteCache` for the parameters.
+    """
+
+    def _key(self, item):
+        return item.sensor
+
+    def _outcome(self, item, result):
+        if result is None:
+            return _DROP
+        if (result.timestamp != item.timestamp or
+                result.value != item.value):
+            return _CALL
+        if result.sensor == item.sensor:
+            return _PASS
+        return result.sensor
+
+    def _probe(self, item, value):
+        return item.replace(value=value)
+
+    def _move(self, item, path):
+        return item.replace(sensor=path)
+
+    def register_metrics(self, registry, prefix="sn2d_rewrite_cache_sample_"):
+        super().register_metrics(registry, prefix)
+
+
+class BatchRewriteCache(_RewriteCache):
+    """
+    Cache the decisions of a :class:`hintlib.rewrite.SampleBatchRewriter`
+    per bare path.
+
+    See :class:`_RewriteCache` for the parameters.
+    """
+
+    def _key(self, item):
+        return item.bare_path
+
+    def _outcome(self, item, result):
+        if result is None:
+            return _DROP
+        if (result.timestamp != item.timestamp or
+                result.samples != item.samples):
+            return _CALL
+        if result.bare_path == item.bare_path:
+            return _PASS
+        return result.bare_path
+
+    def _probe(self, item, value):
+        return sample.SampleBatch(
+            timestamp=item.timestamp,
+            bare_path=item.bare_path,
+            samples=dict.fromkeys(item.samples, value),
+        )
+
+    def _move(self, item, path):
+        return sample.SampleBatch(
+            timestamp=item.timestamp,
+            bare_path=path,
+            samples=item.samples,
+        )
+
+    def register_metrics(self, registry, prefix="sn2d_rewrite_cache_batch_"):
+        super().register_metrics(registry, prefix)
@@ -0,0 +1,221 @@
+"""
+Aggregates of high-rate sample streams.
+
+The LSM303D streams carry hundreds of samples per second and axis, while
+most consumers only need coarse statistics. :class:`Rollup` turns the
+blocks emitted by a :class:`~.sensor_stream.Buffer` into minimum, maximum,
+mean and root mean square per window, for windows of several sizes aligned
+to the unix epoch, and returns them as sample batches for the sample sinks.
+
+The aggregates are in the raw sample units of the stream.
+"""
+import collections
+import logging
+import math
+
+from datetime import datetime, timedelta
+
+from hintlib import sample
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#: Part of the sensor paths of the rollup sample batches.
+ROLLUP_PART = "sn2-rollup"
+
+EPOCH = datetime(1970, 1, 1)
+
+_Window = collections.namedtuple(
+    "_Window",
+    ["index", "count", "min", "max", "sum", "sum_squares"],
+)
+
+
+def _merge(a, b):
+    return _Window(
+        a.index,
+        a.count + b.count,
+        min(a.min, b.min),
+        max(a.max, b.max),
+        a.sum + b.sum,
+        a.sum_squares + b.sum_squares,
+    )
+
+
+def _first_window(start, resolution):
+    # sample times are computed relative to the first window to keep the
+    # precision of the float timestamps
+    first = math.floor(start / resolution)
+    return first, start - first * resolution
+
+
+def _aggregate_numpy(start, period, resolution, data):
+    first, offset = _first_window(start, resolution)
+    values = numpy.asarray(data, dtype=numpy.float64)
+    indices = numpy.floor(
+        (offset + numpy.arange(len(values)) * period) / resolution
+    ).astype(numpy.int64)
+    starts = numpy.concatenate((
+        [0],
+        numpy.flatnonzero(numpy.diff(indices)) + 1,
+    ))
+    counts = numpy.diff(numpy.append(starts, len(values)))
+    return [
+        _Window(first + int(index), int(count), min_, max_, sum_, squares)
+        for index, count, min_, max_, sum_, squares in zip(
+            indices[starts],
+            counts,
+            numpy.minimum.reduceat(values, starts).tolist(),
+            numpy.maximum.reduceat(values, starts).tolist(),
+            numpy.add.reduceat(values, starts).tolist(),
+            numpy.add.reduceat(values * values, starts).tolist(),
+        )
+    ]
+
+
+def _aggregate_python(start, period, resolution, data):
+    first, offset = _first_window(start, resolution)
+    windows = []
+    for i, value in enumerate(data):
+        index = first + math.floor((offset + i * period) / resolution)
+        window = _Window(index, 1, value, value, value, value * value)
+        if windows and windows[-1].index == index:
+            windows[-1] = _merge(windows[-1], window)
+        else:
+            windows.append(window)
+    return windows
+
+
+def aggregate(start, period, resolution, data):
+    """
+    Aggregate a block of equidistant samples into windows.
+
+    :param start: Time of the first sample in seconds since the epoch.
+    :param period: Interval between two samples in seconds.
+    :param resolution: Size of the windows in seconds.
+    :param data: The sample values.
+    :return: The windows touched by the samples, in order.
+    :rtype: :class:`list` of :class:`_Window`
+
+    Uses NumPy if it is available.
+    """
+    if not data:
+        return []
+    if numpy is not None:
+        return _aggregate_numpy(start, period, resolution, data)
+    return _aggregate_python(start, period, resolution, data)
+
+
+class Rollup:
+    """
+    Aggregate stream blocks at several resolutions.
+
+    :param resolutions: Window sizes in seconds.
+    :type resolutions: iterable of :class:`int`
+
+    The last window of a block is held back until a later block shows that
+    it is complete, so that windows spanning several blocks are aggregated
+    as a whole. Windows held back when the daemon stops are lost.
+
+    .. attribute:: windows
+
+       Number of windows emitted.
+
+    .. attribute:: samples
+
+       Number of stream samples aggregated.
+    """
+
+    def __init__(self, resolutions=(1, 60), *, logger=None):
+        super().__init__()
+        self.logger = logger or logging.getLogger(__name__)
+        self.resolutions = tuple(sorted(resolutions))
+        if not self.resolutions or self.resolutions[0] <= 0:
+            raise ValueError("resolutions must be positive")
+        self._open = {}
+        self.windows = 0
+        self.samples = 0
+
+    def _batch(self, path, resolution, window):
+        subpart = path.subpart.value
+        mean = window.sum / window.count
+        return sample.SampleBatch(
+            timestamp=EPOCH + timedelta(seconds=window.index * resolution),
+            bare_path=sample.SensorPath(
+                ROLLUP_PART,
+                "{}-{}-{}s".format(path.part.value, path.instance, resolution),
+                None,
+            ),
+            samples={
+                subpart + "-min": window.min,
+                subpart + "-max": window.max,
+                subpart + "-mean": mean,
+                subpart + "-rms": math.sqrt(window.sum_squares
+                                            / window.count),
+            },
+        )
+
+    def submit(self, path, t0, period, data):
+        """
+        Aggregate a block emitted by a stream buffer.
+
+        :param path: Path of the stream.
+        :type path: :class:`hintlib.sample.SensorPath`
+        :param t0: Timestamp of the first sample.
+        :type t0: :class:`datetime.datetime`
+        :param period: Interval between two samples.
+        :type period: :class:`datetime.timedelta`
+        :param data: The sample values.
+        :return: Sample batches of the completed windows.
+        :rtype: :class:`list` of :class:`hintlib.sample.SampleBatch`
+        """
+        start = (t0 - EPOCH).total_seconds()
+        period = period.total_seconds()
+        end = start + len(data) * period
+        self.samples += len(data)
+
+        result = []
+        for resolution in self.resolutions:
+            key = path, resolution
+            open_ = self._open.pop(key, None)
+            for window in aggregate(start, period, resolution, data):
+                if open_ is None:
+                    open_ = window
+                elif window.index == open_.index:
+                    open_ = _merge(open_, window)
+                elif window.index < open_.index:
+                    # data from before the open window, e.g. blocks
+                    # recovered after a restart
+                    result.append(self._batch(path, resolution, window))
+                else:
+                    result.append(self._batch(path, resolution, open_))
+                    open_ = window
+
+            if open_ is not None:
+                if (open_.index + 1) * resolution <= end:
+                    result.append(self._batch(path, resolution, open_))
+                else:
+                    self._open[key] = open_
+
+        self.windows += len(result)
+        return result
+
+    def register_metrics(self, registry, prefix="sn2d_rollup_"):
+        """
+        Register the rollup metrics with a :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        registry.counter_func(
+            prefix + "windows_total",
+            "Rollup windows emitted",
+            lambda: self.windows,
+        )
+        registry.counter_func(
+            prefix + "samples_total",
+            "Stream samples aggregated",
+            lambda: self.samples,
+        )
@@ -12,12 +12,17 @@ from enum import Enum
 
 import aioxmpp.callbacks
 
-from . import sensor_stream, bme280
+from . import sensor_stream, bme280, overload
 from hintlib.utils import unpack_and_splice, unpack_all
 from hintlib import sample
 
 from _sn2d_comm import lib
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class DataFrameType(Enum):
     SBX = 0x00
@@ -56,15 +61,131 @@ msgtype_to_ctype = {
 }
 
 
+def _numpy_dtype(fields):
+    if numpy is None:
+        return None
+    return numpy.dtype(fields)
+
+
+def _require_numpy():
+    if numpy is None:
+        raise RuntimeError("columnar access requires NumPy")
+
+
+@functools.lru_cache(maxsize=1024)
+def sensor_path(part, instance, subpart=None):
+    """
+    Return a shared :class:`hintlib.sample.SensorPath`.
+
+    Paths are immutable, so messages use this function instead of
+    constructing a new path for each sample.
+    """
+    return sample.SensorPath(part, instance, subpart)
+
+
+@functools.lru_cache(maxsize=256)
+def _ds18b20_path(id_):
+    return sensor_path(sample.Part.DS18B20, binascii.b2a_hex(id_).decode())
+
+
+def _decode_records(buf, dtype):
+    """
+    Decode all complete records in `buf` into a structured NumPy array.
+
+    The array refers to `buf` instead of copying it.
+    """
+    return numpy.frombuffer(buf, dtype=dtype,
+                            count=len(buf) // dtype.itemsize)
+
+
+class _LazySection:
+    """
+    Attribute of a :class:`StatusMessage` which is decoded on first access.
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            return instance.__dict__[self.name]
+        except KeyError:
+            pass
+        instance._decode_sections()
+        return instance.__dict__.get(self.name)
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+
+
+class _StatusSectionDecoder:
+    """
+    Decoder for the sections of one status message version which follow the
+    stream state.
+
+    :param fixed: Struct for all fixed-size sections.
+    :param steps: Functions which build the sections from the unpacked data.
+    :param task_count_offset: Offset of the task count inside the fixed-size
+                              part, or :data:`None` if there is no task list.
+    """
+
+    def __init__(self, fixed, steps, task_count_offset):
+        super().__init__()
+        self.fixed = fixed
+        self.steps = steps
+        self.task_count_offset = task_count_offset
+
+    def check_size(self, buf, offset):
+        """
+        Raise :class:`struct.error` if `buf` is too short to hold the sections
+        starting at `offset`.
+        """
+        size = self.fixed.size
+        if len(buf) - offset >= size and self.task_count_offset is not None:
+            size += buf[offset + self.task_count_offset] * 2
+        if len(buf) - offset < size:
+            raise struct.error(
+                "status message requires {} bytes after the stream state, "
+                "got {}".format(size, len(buf) - offset)
+            )
+
+    def __call__(self, buf, offset):
+        """
+        Decode the sections in `buf` starting at `offset`.
+
+        :return: Mapping of attribute names to section values.
+        """
+        data = self.fixed.unpack_from(buf, offset)
+        sections = {}
+        for step in self.steps:
+            step(sections, data, buf, offset)
+        return sections
+
+
 class StatusMessage:
+    """
+    A status message.
+
+    The header and the stream state are decoded by :meth:`from_buf`. All
+    other sections are decoded from the buffer, which is kept referenced
+    until then, when any of them is accessed first.
+    """
+
     rtc = None
     uptime = None
     v1_accel_stream_state = None
     v1_compass_stream_state = None
-    v2_i2c_metrics = None
-    v5_tx_metrics = None
-    v5_task_metrics = None
-    v6_cpu_metrics = None
+    v2_i2c_metrics = _LazySection()
+    v2_bme280_metrics = _LazySection()
+    v4_bme280_metrics = _LazySection()
+    v5_tx_metrics = _LazySection()
+    v5_task_metrics = _LazySection()
+    v6_cpu_metrics = _LazySection()
+
+    # decoder, buffer and offset of the sections not decoded yet
+    _pending_sections = None
 
     class I2CMetrics:
         transaction_overruns = None
@@ -249,17 +370,141 @@ class StatusMessage:
         "HHH"
     )
 
+    _v1_stream_states = struct.Struct(
+        "<" + _v1_stream_state.format.lstrip("<") * 2
+    )
+
+    # compiled section decoders by status version, see _compile_decoder
+    _decoders = {}
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _task_list_struct(count):
+        return struct.Struct("<" + "H" * count)
+
+    @classmethod
+    def _compile_decoder(cls, status_version):
+        """
+        Build the decoder for the sections of a status message of the given
+        version which follow the stream state.
+
+        All fixed-size sections are decoded with a single
+        :class:`struct.Struct`, which is concatenated from the formats of the
+        nested section classes. The only variable-length section, the task
+        list of version 5, is decoded by a separate tail step.
+
+        :rtype: :class:`_StatusSectionDecoder`
+        """
+        # all section formats use one character per field, so the length of
+        # the layout so far is the index of the next field
+        def fields(fmt):
+            return fmt.format.lstrip("<")
+
+        layout = []
+        steps = []
+
+        def i2c_step(i):
+            def step(sections, data, buf, offset):
+                i2c_metrics = []
+                for overruns in data[i:i+2]:
+                    metrics = cls.I2CMetrics()
+                    metrics.transaction_overruns = overruns
+                    i2c_metrics.append(metrics)
+                sections["v2_i2c_metrics"] = i2c_metrics
+            return step
+
+        def bme280_step(i, ninstances, has_configure_status):
+            def step(sections, data, buf, offset):
+                bme280_metrics = []
+                for j in range(ninstances):
+                    metrics = cls.BME280Metrics()
+                    if has_configure_status:
+                        metrics.configure_status = data[i+2*j]
+                        metrics.timeouts = data[i+2*j+1]
+                    else:
+                        metrics.configure_status = 0x00
+                        metrics.timeouts = data[i+j]
+                    bme280_metrics.append(metrics)
+                if ninstances < 2:
+                    bme280_metrics.append(cls.BME280Metrics())
+                sections["v2_bme280_metrics"] = bme280_metrics[0]
+                sections["v4_bme280_metrics"] = bme280_metrics
+            return step
+
+        def tx_step(i):
+            def step(sections, data, buf, offset):
+                sections["v5_tx_metrics"] = cls.TXMetrics._make(data[i:i+4])
+            return step
+
+        def tasks_step(i, tail_offset):
+            def step(sections, data, buf, offset):
+                count, idle_ticks = data[i:i+2]
+                tasks = cls._task_list_struct(count).unpack_from(
+                    buf, offset + tail_offset,
+                )
+                sections["v5_task_metrics"] = cls.TasksMetrics(
+                    idle_ticks,
+                    tuple(map(cls.TasksMetrics.TaskMetrics, tasks)),
+                )
+            return step
+
+        def cpu_step(i):
+            def step(sections, data, buf, offset):
+                cpu = data[i:i+0x20]
+                sections["v6_cpu_metrics"] = cls.CPUMetrics(
+                    cpu[lib.CPU_IDLE],
+                    cpu[lib.CPU_SCHED],
+                    {
+                        name: cpu[index]
+                        for index, name in cls.CPUMetrics.INTERRUPT_MAP.items()
+                    },
+                    list(cpu[lib.CPU_TASK_BASE:]),
+                )
+            return step
+
+        def add(fmt, step_factory, *args):
+            steps.append(step_factory(sum(map(len, layout)), *args))
+            layout.append(fmt)
+
+        task_count_offset = None
+
+        if 2 <= status_version:
+            add(fields(cls.I2CMetrics._v2) * 2, i2c_step)
+            if status_version >= 4:
+                add(fields(cls.BME280Metrics._v3) * 2, bme280_step, 2, True)
+            elif status_version >= 3:
+                add(fields(cls.BME280Metrics._v3), bme280_step, 1, True)
+            else:
+                add(fields(cls.BME280Metrics._v2), bme280_step, 1, False)
+
+        if 5 <= status_version:
+            add(fields(cls.TXMetrics._v1), tx_step)
+
+        if 6 <= status_version:
+            add(fields(cls.CPUMetrics._v1), cpu_step)
+        elif 5 <= status_version:
+            # the task list follows the fixed-size part; the task count is
+            # the first field of the tasks header
+            task_count_offset = struct.calcsize("<" + "".join(layout))
+            fixed_size = struct.calcsize(
+                "<" + "".join(layout) + fields(cls.TasksMetrics._v1)
+            )
+            add(fields(cls.TasksMetrics._v1), tasks_step, fixed_size)
+
+        return _StatusSectionDecoder(
+            struct.Struct("<" + "".join(layout)),
+            tuple(steps),
+            task_count_offset,
+        )
+
     @classmethod
     def from_buf(cls, type_, buf):
         result = cls()
         result.type_ = type_
-        buf, (rtc,
-              uptime,
-              protocol_version,
-              status_version) = unpack_and_splice(
-                  buf,
-                  cls._base_header,
-              )
+        (rtc,
+         uptime,
+         protocol_version,
+         status_version) = cls._base_header.unpack_from(buf)
 
         if protocol_version != 1:
             raise ValueError("unsupported protocol")
@@ -269,68 +514,57 @@ class StatusMessage:
 
         result.rtc = None
         result.uptime = uptime
+        offset = cls._base_header.size
+
         if 1 <= status_version:
-            buf, result.v1_accel_stream_state = \
-                cls.IMUStreamState.unpack_and_splice(status_version, buf)
-            buf, result.v1_compass_stream_state = \
-                cls.IMUStreamState.unpack_and_splice(status_version, buf)
+            (accel_seq, accel_ts, accel_period,
+             compass_seq, compass_ts, compass_period) = \
+                cls._v1_stream_states.unpack_from(buf, offset)
+            result.v1_accel_stream_state = cls.IMUStreamState(
+                accel_seq, accel_ts, timedelta(milliseconds=accel_period),
+            )
+            result.v1_compass_stream_state = cls.IMUStreamState(
+                compass_seq, compass_ts,
+                timedelta(milliseconds=compass_period),
+            )
+            offset += cls._v1_stream_states.size
 
         if 2 <= status_version:
-            result.v2_i2c_metrics = []
-            for i2c_bus_no in range(2):
-                buf, metrics = cls.I2CMetrics.unpack_and_splice(
-                    status_version,
-                    buf,
-                )
-                result.v2_i2c_metrics.append(metrics)
-
-            if status_version >= 4:
-                result.v4_bme280_metrics = []
-                buf, metrics = \
-                    cls.BME280Metrics.unpack_and_splice(
-                        status_version,
-                        buf,
-                    )
-                result.v4_bme280_metrics.append(metrics)
+            result._defer_sections(status_version, buf, offset)
 
-                buf, metrics = \
-                    cls.BME280Metrics.unpack_and_splice(
-                        status_version,
-                        buf,
-                    )
-                result.v4_bme280_metrics.append(metrics)
-
-                result.v2_bme280_metrics = result.v4_bme280_metrics[0]
-            else:
-                buf, result.v2_bme280_metrics = \
-                    cls.BME280Metrics.unpack_and_splice(
-                        status_version,
-                        buf,
-                    )
-                result.v4_bme280_metrics = [
-                    result.v2_bme280_metrics,
-                    cls.BME280Metrics(),
-                ]
+        return result
 
-        if 5 <= status_version:
-            buf, result.v5_tx_metrics = cls.TXMetrics.unpack_and_splice(
-                status_version,
-                buf,
-            )
+    def _defer_sections(self, status_version, buf, offset):
+        """
+        Arrange for the sections following the stream state to be decoded
+        from `buf` at `offset` on first access.
 
-        if 5 <= status_version < 6:
-            buf, result.v5_task_metrics = cls.TasksMetrics.unpack_and_splice(
-                status_version,
-                buf,
-            )
+        :raises struct.error: if `buf` is too short to hold the sections.
+        """
+        try:
+            decoder = self._decoders[status_version]
+        except KeyError:
+            decoder = self._compile_decoder(status_version)
+            self._decoders[status_version] = decoder
+
+        # reject truncated messages now instead of on first access
+        decoder.check_size(buf, offset)
+        self._pending_sections = decoder, buf, offset
+
+    def _decode_sections(self):
+        pending = self._pending_sections
+        if pending is None:
+            return
+        self._pending_sections = None
 
-        if 6 <= status_version:
-            buf, result.v6_cpu_metrics = cls.CPUMetrics.unpack_and_splice(
-                status_version,
-                buf,
-            )
+        decoder, buf, offset = pending
+        for name, value in decoder(buf, offset).items():
+            self.__dict__.setdefault(name, value)
 
-        return result
+    def __getstate__(self):
+        # the compiled decoders cannot be pickled
+        self._decode_sections()
+        return self.__dict__
 
     def __repr__(self):
         return "<{}.{} rtc={} uptime={} at 0x{:x}>".format(
@@ -343,8 +577,18 @@ class StatusMessage:
 
 
 class DS18B20Message:
+    """
+    Temperature samples of DS18B20 sensors.
+
+    If NumPy is available, :meth:`from_buf` decodes the samples into a
+    structured array and :attr:`samples` is only built when it is accessed.
+    """
+
     timestamp = None
-    samples = None
+
+    # structured array of the undecoded samples, see from_buf
+    _records = None
+    _samples = None
 
     _header = struct.Struct(
         "<"
@@ -356,12 +600,34 @@ class DS18B20Message:
         "8sh"
     )
 
+    _sample_dtype = _numpy_dtype([
+        ("id", "V8"),
+        ("raw_value", "<i2"),
+    ])
+
     def __init__(self, timestamp, samples, type_=MsgType.SENSOR_DS18B20):
         super().__init__()
         self.type_ = type_
         self.timestamp = timestamp
         self.samples = list(samples)
 
+    @property
+    def samples(self):
+        if self._samples is None:
+            ids = self._records["id"].tobytes()
+            self._samples = [
+                (ids[i*8:(i+1)*8], value)
+                for i, value in enumerate(
+                    (self._records["raw_value"] / 16).tolist()
+                )
+            ]
+        return self._samples
+
+    @samples.setter
+    def samples(self, value):
+        self._samples = value
+        self._records = None
+
     @classmethod
     def from_buf(cls, type_, buf):
         buf, (timestamp,) = unpack_and_splice(
@@ -369,6 +635,12 @@ class DS18B20Message:
             cls._header,
         )
 
+        if numpy is not None:
+            result = cls(timestamp, (), type_=type_)
+            result._records = _decode_records(buf, cls._sample_dtype)
+            result._samples = None
+            return result
+
         return cls(
             timestamp,
             (
@@ -387,20 +659,57 @@ class DS18B20Message:
             id(self),
         )
 
+    def _hex_ids(self):
+        if self._records is None:
+            return [binascii.b2a_hex(id_).decode() for id_, _ in self.samples]
+
+        # one hex conversion for all IDs
+        ids = self._records["id"].tobytes().hex()
+        return [ids[i:i+16] for i in range(0, len(ids), 16)]
+
+    def columns(self):
+        """
+        Return the samples as columns.
+
+        :return: Mapping of ``"id"`` to the hex encoded sensor IDs and
+                 ``"value"`` to the temperatures in degree Celsius, both as
+                 NumPy arrays.
+        :raises RuntimeError: if NumPy is not available.
+        """
+        _require_numpy()
+        if self._records is not None:
+            values = self._records["raw_value"] / 16
+        else:
+            values = numpy.array([value for _, value in self.samples],
+                                 dtype=numpy.float64)
+        return {
+            "id": numpy.array(self._hex_ids(), dtype="U16"),
+            "value": values,
+        }
+
     def get_samples(self):
-        for id_, value in self.samples:
-            yield sample.Sample(
-                self.timestamp,
-                sample.SensorPath(
-                    sample.Part.DS18B20,
-                    binascii.b2a_hex(id_).decode(),
-                ),
-                value,
-            )
+        if self._records is not None:
+            ids = self._records["id"].tolist()
+            values = (self._records["raw_value"] / 16).tolist()
+        else:
+            ids = [id_ for id_, _ in self.samples]
+            values = [value for _, value in self.samples]
+
+        timestamp = self.timestamp
+        for id_, value in zip(ids, values):
+            yield sample.Sample(timestamp, _ds18b20_path(id_), value)
 
 
 class NoiseMessage:
-    samples = None
+    """
+    Noise level samples.
+
+    If NumPy is available, :meth:`from_buf` decodes the samples into a
+    structured array and :attr:`samples` is only built when it is accessed.
+    """
+
+    _records = None
+    _samples = None
 
     _header = struct.Struct(
         "<"
@@ -412,19 +721,54 @@ class NoiseMessage:
         "HLhh"
     )
 
-    _sensor_path = sample.SensorPath(
-        sample.Part.CUSTOM_NOISE,
-        0,
-    )
+    _sample_dtype = _numpy_dtype([
+        ("timestamp", "<u2"),
+        ("sqavg", "<u4"),
+        ("min", "<i2"),
+        ("max", "<i2"),
+    ])
+
+    _sensor_path = sensor_path(sample.Part.CUSTOM_NOISE, 0)
+
+    _rms_path = sensor_path(sample.Part.CUSTOM_NOISE, 0,
+                            sample.CustomNoiseSubpart.RMS)
+    _min_path = sensor_path(sample.Part.CUSTOM_NOISE, 0,
+                            sample.CustomNoiseSubpart.MIN)
+    _max_path = sensor_path(sample.Part.CUSTOM_NOISE, 0,
+                            sample.CustomNoiseSubpart.MAX)
 
     def __init__(self, samples, type_=MsgType.SENSOR_NOISE):
         super().__init__()
         self.type_ = type_
         self.samples = list(samples)
 
+    @property
+    def samples(self):
+        if self._samples is None:
+            self._samples = list(zip(
+                self._records["timestamp"].tolist(),
+                self._scaled_sqavg().tolist(),
+                self._records["min"].tolist(),
+                self._records["max"].tolist(),
+            ))
+        return self._samples
+
+    @samples.setter
+    def samples(self, value):
+        self._samples = value
+        self._records = None
+
     @classmethod
     def from_buf(cls, type_, buf):
         buf, (factor,) = unpack_and_splice(buf, cls._header)
+
+        if numpy is not None:
+            result = cls((), type_=type_)
+            result._records = _decode_records(buf, cls._sample_dtype)
+            result._factor = factor
+            result._samples = None
+            return result
+
         return cls(
             [
                 (ts, sqavg / (2**24-1) / factor, min_, max_)
@@ -442,40 +786,83 @@ class NoiseMessage:
             id(self),
         )
 
+    def _scaled_sqavg(self):
+        return self._records["sqavg"] / (2**24-1) / self._factor
+
+    def columns(self):
+        """
+        Return the samples as columns.
+
+        :return: Mapping of ``"timestamp"``, ``"rms"``, ``"min"`` and
+                 ``"max"`` to NumPy arrays, scaled like the values emitted
+                 by :meth:`get_samples`.
+        :raises RuntimeError: if NumPy is not available.
+        """
+        _require_numpy()
+        if self._records is not None:
+            timestamp = self._records["timestamp"]
+            sqavg = self._scaled_sqavg()
+            min_ = self._records["min"]
+            max_ = self._records["max"]
+        else:
+            rows = numpy.array(self.samples,
+                               dtype=numpy.float64).reshape(-1, 4)
+            timestamp = rows[:, 0].astype(numpy.uint16)
+            sqavg, min_, max_ = rows[:, 1], rows[:, 2], rows[:, 3]
+
+        return {
+            "timestamp": timestamp,
+            "rms": numpy.sqrt(sqavg),
+            "min": min_ / (2**15-1),
+            "max": max_ / (2**15-1),
+        }
+
     def get_samples(self):
-        for ts, sqavg, min_, max_ in self.samples:
-            rms = math.sqrt(sqavg)
-            yield sample.Sample(
-                ts,
-                self._sensor_path.replace(
-                    subpart=sample.CustomNoiseSubpart.RMS
-                ),
-                rms,
-            )
-            yield sample.Sample(
-                ts,
-                self._sensor_path.replace(
-                    subpart=sample.CustomNoiseSubpart.MIN
-                ),
-                min_ / (2**15-1)
+        rms_path = self._rms_path
+        min_path = self._min_path
+        max_path = self._max_path
+
+        if self._records is not None:
+            columns = self.columns()
+            rows = zip(
+                columns["timestamp"].tolist(),
+                columns["rms"].tolist(),
+                columns["min"].tolist(),
+                columns["max"].tolist(),
             )
-            yield sample.Sample(
-                ts,
-                self._sensor_path.replace(
-                    subpart=sample.CustomNoiseSubpart.MAX
-                ),
-                max_ / (2**15-1)
+        else:
+            rows = (
+                (ts, math.sqrt(sqavg), min_ / (2**15-1), max_ / (2**15-1))
+                for ts, sqavg, min_, max_ in self.samples
             )
 
+        for ts, rms, min_, max_ in rows:
+            yield sample.Sample(ts, rms_path, rms)
+            yield sample.Sample(ts, min_path, min_)
+            yield sample.Sample(ts, max_path, max_)
+
 
 class LightMessage:
-    samples = None
+    """
+    Colour samples of the TCS3200 sensor.
+
+    If NumPy is available, :meth:`from_buf` decodes the samples into a
+    structured array and :attr:`samples` is only built when it is accessed.
+    """
+
+    _records = None
+    _samples = None
 
     _sample = struct.Struct(
         "<"
         "H4H"
     )
 
+    _sample_dtype = _numpy_dtype([
+        ("timestamp", "<u2"),
+        ("ch", "<u2", (4,)),
+    ])
+
     _ch_parts = [
         sample.TCS3200Subpart.RED,
         sample.TCS3200Subpart.GREEN,
@@ -483,13 +870,38 @@ class LightMessage:
         sample.TCS3200Subpart.CLEAR,
     ]
 
+    _ch_paths = tuple(
+        sensor_path(sample.Part.TCS3200, 0, ch_subpart)
+        for ch_subpart in _ch_parts
+    )
+
     def __init__(self, samples, type_=MsgType.SENSOR_LIGHT):
         super().__init__()
         self.type_ = type_
         self.samples = list(samples)
 
+    @property
+    def samples(self):
+        if self._samples is None:
+            self._samples = list(zip(
+                self._records["timestamp"].tolist(),
+                map(tuple, self._records["ch"].tolist()),
+            ))
+        return self._samples
+
+    @samples.setter
+    def samples(self, value):
+        self._samples = value
+        self._records = None
+
     @classmethod
     def from_buf(cls, type_, buf):
+        if numpy is not None:
+            result = cls((), type_=type_)
+            result._records = _decode_records(buf, cls._sample_dtype)
+            result._samples = None
+            return result
+
         return cls(
             (
                 (timestamp, tuple(values))
@@ -506,17 +918,44 @@ class LightMessage:
             id(self),
         )
 
+    def columns(self):
+        """
+        Return the samples as columns.
+
+        :return: Mapping of ``"timestamp"`` to an array of timestamps and
+                 ``"channels"`` to an array with one row per sample and one
+                 column per entry of :attr:`_ch_parts`.
+        :raises RuntimeError: if NumPy is not available.
+        """
+        _require_numpy()
+        if self._records is not None:
+            return {
+                "timestamp": self._records["timestamp"],
+                "channels": self._records["ch"],
+            }
+
+        return {
+            "timestamp": numpy.array([ts for ts, _ in self.samples],
+                                     dtype=numpy.uint16),
+            "channels": numpy.array([channels for _, channels in self.samples],
+                                    dtype=numpy.uint16).reshape(-1, 4),
+        }
+
     def get_samples(self):
-        for ts, channels in self.samples:
-            for ch_i, ch_subpart in enumerate(self._ch_parts):
+        paths = self._ch_paths
+
+        if self._records is not None:
+            rows = zip(self._records["timestamp"].tolist(),
+                       self._records["ch"].tolist())
+        else:
+            rows = self.samples
+
+        for ts, channels in rows:
+            for path, value in zip(paths, channels):
                 yield sample.Sample(
                     ts,
-                    sample.SensorPath(
-                        sample.Part.TCS3200,
-                        0,
-                        ch_subpart,
-                    ),
-                    channels[ch_i]
+                    path,
+                    value,
                 )
 
 
@@ -553,7 +992,7 @@ class BME280Message:
         if buf:
             raise ValueError("too much data in buffer")
 
-        calibration = bme280.get_calibration(dig88, dige1)
+        calibration = bme280.calibration_cache.get(instance, dig88, dige1)
         temp_raw, pressure_raw, humidity_raw = bme280.get_readout(readout)
 
         temperature = bme280.compensate_temperature(
@@ -592,36 +1031,23 @@ class BME280Message:
             id(self),
         )
 
-    def get_samples(self):
-        yield sample.Sample(
-            self.timestamp,
-            sample.SensorPath(
-                sample.Part.BME280,
-                self.instance,
-                sample.BME280Subpart.TEMPERATURE,
-            ),
-            self.temperature,
-        )
-
-        yield sample.Sample(
-            self.timestamp,
-            sample.SensorPath(
-                sample.Part.BME280,
-                self.instance,
-                sample.BME280Subpart.PRESSURE,
-            ),
-            self.pressure,
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _paths(instance):
+        return tuple(
+            sensor_path(sample.Part.BME280, instance, subpart)
+            for subpart in [sample.BME280Subpart.TEMPERATURE,
+                            sample.BME280Subpart.PRESSURE,
+                            sample.BME280Subpart.HUMIDITY]
         )
 
-        yield sample.Sample(
-            self.timestamp,
-            sample.SensorPath(
-                sample.Part.BME280,
-                self.instance,
-                sample.BME280Subpart.HUMIDITY,
-            ),
-            self.humidity,
-        )
+    def get_samples(self):
+        temperature_path, pressure_path, humidity_path = \
+            self._paths(self.instance)
+        yield sample.Sample(self.timestamp, temperature_path,
+                            self.temperature)
+        yield sample.Sample(self.timestamp, pressure_path, self.pressure)
+        yield sample.Sample(self.timestamp, humidity_path, self.humidity)
 
 
 class SensorStreamMessage:
@@ -680,7 +1106,7 @@ class SensorStreamMessage:
 
     @property
     def path(self):
-        return sample.SensorPath(
+        return sensor_path(
             sample.Part.LSM303D,
             0,
             self._partmap[self.type_]
@@ -777,25 +1203,27 @@ class ESPStatusMessage:
             id(self),
         )
 
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _fields(cls):
+        # (attribute, path) pairs, in the order dir() used to yield them
+        return tuple(
+            (attr, sensor_path(
+                sample.Part.ESP8266_TX,
+                None,
+                sample.ESP8266TXSubpart(attr[3:].replace("_", "-")),
+            ))
+            for attr in sorted(dir(cls))
+            if attr.startswith("tx_")
+        )
+
     def get_samples(self):
-        for attr in dir(self):
-            if not attr.startswith("tx_"):
-                continue
+        for attr, path in self._fields():
             value = getattr(self, attr)
             if value is None:
                 continue
 
-            yield sample.Sample(
-                self.rtc_timestamp,
-                sample.SensorPath(
-                    sample.Part.ESP8266_TX,
-                    instance=None,
-                    subpart=sample.ESP8266TXSubpart(
-                        attr[3:].replace("_", "-"),
-                    )
-                ),
-                getattr(self, attr)
-            )
+            yield sample.Sample(self.rtc_timestamp, path, value)
 
 
 app_req_set_sntp_server_fmt = struct.Struct(
@@ -811,23 +1239,106 @@ data_frame_header_fmt = struct.Struct(
 )
 
 
+def decode_data_frame(type_, rtc_timestamp, buf, decoder=None):
+    """
+    Decode the payload of a data frame.
+
+    :param type_: The type of the data frame.
+    :type type_: :class:`DataFrameType`
+    :param rtc_timestamp: The timestamp from the data frame header.
+    :param buf: The payload.
+    :param decoder: Function used to decode SBX messages, defaults to
+                    :func:`decode_sbx_message`.
+    """
+    if type_ == DataFrameType.SBX:
+        return (decoder or decode_sbx_message)(buf)
+    elif type_ == DataFrameType.ESP_STATUS:
+        return ESPStatusMessage.from_buf(rtc_timestamp, buf)
+    raise ValueError("no decoder for {} data frame".format(type_))
+
+
 class SBXClient:
+    """
+    Decode the data frames received via a datagram stream protocol.
+
+    :param decoder: Function used to decode SBX messages, defaults to
+                    :func:`decode_sbx_message`.
+    :param decode_pool: Pool to decode the data frames in, instead of
+                        decoding them in the receive callback.
+    :type decode_pool: :class:`~.decode_pool.DecodePool` with
+                       :func:`decode_data_frame` as function
+
+    :param overload: Controller deciding which data frames to shed under
+                     load.
+    :type overload: :class:`~.overload.OverloadController`
+
+    With a `decode_pool`, :meth:`on_message` is emitted once the pool has
+    decoded the message, still in the order in which the data frames were
+    received. For a process pool, `decoder` must return picklable objects,
+    which excludes the views of :mod:`.sbx_views`. The pool may be shared by
+    several clients.
+
+    With `overload`, the type of each data frame is determined before it is
+    decoded and the frame is processed, dropped or deferred as decided by the
+    controller. Deferred frames are processed in small chunks, in the order
+    they were received, once the overload is over. Frames the controller
+    still holds from a previous run are processed in the same way, starting
+    right after construction.
+
+    .. signal:: on_message(rtc_timestamp, obj)
+
+       Emitted for each decoded message.
+
+    .. signal:: on_message_frame(frame, rtc_timestamp, obj)
+
+       Emitted before :meth:`on_message`, additionally with the data frame
+       the message was decoded from, which can be decoded again with
+       :meth:`decode_frame`.
+    """
+
+    #: Number of deferred frames to process per event loop iteration.
+    REPLAY_CHUNK = 16
+
+    #: Seconds to wait before retrying to process deferred frames while the
+    #: overload persists.
+    REPLAY_RETRY = 0.5
+
     on_message = aioxmpp.callbacks.Signal()
+    on_message_frame = aioxmpp.callbacks.Signal()
 
-    def __init__(self, protocol, *, logger=None):
+    def __init__(self, protocol, *, decoder=None, decode_pool=None,
+                 overload=None, logger=None):
         super().__init__()
         self.logger = logger or logging.getLogger(__name__)
+        self._decode_sbx_message = decoder or decode_sbx_message
+        self._decode_pool = decode_pool
+        self._pool_token = None
+        if decode_pool is not None:
+            self._pool_token = decode_pool.on_result.connect(
+                self._on_pool_result
+            )
+        self._overload = overload
+        self._replay_scheduled = False
         self._trigger_sync = asyncio.Event()
         self._protocol = protocol
-        self._protocol.on_resync.connect(
+        self._resync_token = self._protocol.on_resync.connect(
             self._trigger_sync.set,
         )
-        self._protocol.on_data_received.connect(self._on_datagram)
+        self._data_token = self._protocol.on_data_received.connect(
+            self._on_datagram
+        )
 
         self.ntp_server = None
 
+        self.rx_messages = collections.Counter()
+        self.rx_decode_errors = collections.Counter()
+        self.rx_invalid_frames = 0
+
         self._resync_task = asyncio.ensure_future(self._resync_impl())
 
+        if overload is not None and overload.has_deferred:
+            self._schedule_replay()
+
     async def _do_resync(self):
         if self.ntp_server is None:
             return
@@ -853,7 +1364,49 @@ class SBXClient:
             self._trigger_sync.clear()
             await self._do_resync()
 
-    def _on_datagram(self, remainder):
+    @staticmethod
+    def _frame_type_name(type_, remainder):
+        if type_ == DataFrameType.SBX and remainder:
+            try:
+                return MsgType(remainder[0]).name
+            except ValueError:
+                pass
+        return type_.name
+
+    def _replay_deferred(self):
+        self._replay_scheduled = False
+        frames = self._overload.take_deferred(self.REPLAY_CHUNK)
+        for frame in frames:
+            self._on_datagram(frame, shed=False)
+        if frames:
+            self._schedule_replay()
+        elif self._overload.has_deferred:
+            self._schedule_replay(self.REPLAY_RETRY)
+
+    def _schedule_replay(self, delay=0):
+        if not self._replay_scheduled:
+            self._replay_scheduled = True
+            asyncio.get_event_loop().call_later(delay, self._replay_deferred)
+
+    def decode_frame(self, frame):
+        """
+        Decode a data frame synchronously.
+
+        :param frame: A data frame as passed to :meth:`on_message_frame`.
+        :raises ValueError: if the data frame type is not supported.
+        :return: The RTC timestamp and the decoded message.
+        """
+        remainder, (rtc_timestamp, type_raw) = unpack_and_splice(
+            frame,
+            data_frame_header_fmt,
+        )
+        rtc_timestamp = datetime.utcfromtimestamp(rtc_timestamp)
+        obj = decode_data_frame(DataFrameType(type_raw), rtc_timestamp,
+                                remainder, self._decode_sbx_message)
+        return rtc_timestamp, obj
+
+    def _on_datagram(self, remainder, *, shed=True):
+        frame = remainder
         remainder, (rtc_timestamp, type_raw) = unpack_and_splice(
             remainder,
             data_frame_header_fmt,
@@ -865,34 +1418,109 @@ class SBXClient:
             type_ = DataFrameType(type_raw)
         except ValueError:
             self.logger.error("invalid data frame type: %r", type_raw)
+            self.rx_invalid_frames += 1
             return
 
-        if type_ == DataFrameType.SBX:
-            try:
-                obj = decode_sbx_message(remainder)
-            except Exception:  # NOQA
+        if (type_ != DataFrameType.SBX and
+                type_ != DataFrameType.ESP_STATUS):
+            self.logger.debug("no handler for %s data frame",
+                              type_)
+            return
+
+        if shed and self._overload is not None:
+            type_name = self._frame_type_name(type_, remainder)
+            action = self._overload.decide(type_name)
+            if action == overload.Action.DEFER:
+                self._overload.defer(type_name, bytes(frame))
+                self._schedule_replay()
+                return
+            elif action == overload.Action.DROP:
+                return
+
+        context = type_, rtc_timestamp, remainder, frame
+        if self._decode_pool is not None:
+            self._decode_pool.submit(
+                (self, context),
+                type_,
+                rtc_timestamp,
+                bytes(remainder),
+                self._decode_sbx_message,
+            )
+            return
+
+        try:
+            obj = decode_data_frame(type_, rtc_timestamp, remainder,
+                                    self._decode_sbx_message)
+        except Exception as exc:  # NOQA
+            self._on_decoded(context, None, exc)
+        else:
+            self._on_decoded(context, obj, None)
+
+    def _on_pool_result(self, context, obj, exc):
+        # the pool may be shared with the clients of other sensor nodes
+        client, context = context
+        if client is self:
+            self._on_decoded(context, obj, exc)
+
+    def _on_decoded(self, context, obj, exc):
+        type_, rtc_timestamp, remainder, frame = context
+        if exc is not None:
+            if type_ == DataFrameType.SBX:
                 self.logger.warning("failed to decode SBX message",
-                                    exc_info=True)
+                                    exc_info=exc)
             else:
-                self.on_message(
-                    rtc_timestamp,
-                    obj,
-                )
-        elif type_ == DataFrameType.ESP_STATUS:
-            try:
-                obj = ESPStatusMessage.from_buf(rtc_timestamp, remainder)
-            except Exception:
                 self.logger.warning("failed to decode ESP status message %r",
                                     remainder,
-                                    exc_info=True)
-            else:
-                self.on_message(
-                    rtc_timestamp,
-                    obj,
-                )
+                                    exc_info=exc)
+            self.rx_decode_errors[type_.name] += 1
+            return
+
+        if type_ == DataFrameType.SBX:
+            self.rx_messages[obj.type_.name] += 1
         else:
-            self.logger.debug("no handler for %s data frame",
-                              type_)
+            self.rx_messages[type_.name] += 1
+        self.on_message_frame(frame, rtc_timestamp, obj)
+        self.on_message(
+            rtc_timestamp,
+            obj,
+        )
+
+    def close(self):
+        """
+        Stop processing the data frames of the protocol.
+
+        Frames still being decoded by a pool are discarded.
+        """
+        self._resync_task.cancel()
+        self._protocol.on_resync.disconnect(self._resync_token)
+        self._protocol.on_data_received.disconnect(self._data_token)
+        if self._pool_token is not None:
+            self._decode_pool.on_result.disconnect(self._pool_token)
+            self._pool_token = None
+
+    def register_metrics(self, registry, prefix="sn2d_sbx_"):
+        """
+        Register the message counters with a :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        registry.counter_func(
+            prefix + "messages_total",
+            "Messages decoded, by type",
+            lambda: {(k,): v for k, v in self.rx_messages.items()},
+            label_names=("type",),
+        )
+        registry.counter_func(
+            prefix + "decode_errors_total",
+            "Data frames which failed to decode, by data frame type",
+            lambda: {(k,): v for k, v in self.rx_decode_errors.items()},
+            label_names=("frame_type",),
+        )
+        registry.counter_func(
+            prefix + "invalid_frames_total",
+            "Data frames with an unknown type",
+            lambda: self.rx_invalid_frames,
+        )
 
 
 SENDER_PORT = 7285
@@ -0,0 +1,218 @@
+"""
+Zero-copy views on SBX messages.
+
+The views cast the received buffer to the packed cffi definitions of the
+firmware structs (see :data:`.sbx_protocol.msgtype_to_ctype`) and read each
+field from the buffer only when it is accessed. They subclass the message
+classes of :mod:`.sbx_protocol` and can be used in their place.
+
+Message types without a view, or whose struct is not known to the compiled
+cffi module, are decoded with the :mod:`struct` based decoders.
+"""
+import functools
+
+from datetime import timedelta
+
+from _sn2d_comm import ffi
+
+from . import sbx_protocol, sensor_stream
+from .sbx_protocol import MsgType
+
+
+def _cast(type_, buf):
+    """
+    Cast the payload of the message in `buf` to the struct for `type_`.
+
+    :return: The buffer cdata, which must be kept alive as long as the
+             struct pointer is in use, and the struct pointer.
+    """
+    raw = ffi.from_buffer(buf)
+    return raw, ffi.cast(sbx_protocol.msgtype_to_ctype[type_], raw + 1)
+
+
+def _struct_name(type_):
+    return sbx_protocol.msgtype_to_ctype[type_].rstrip("*").strip()
+
+
+@functools.lru_cache(maxsize=None)
+def _sizeof(ctype):
+    return ffi.sizeof(ctype)
+
+
+@functools.lru_cache(maxsize=None)
+def _offsetof(type_, field):
+    return ffi.offsetof(_struct_name(type_), field)
+
+
+class DS18B20View(sbx_protocol.DS18B20Message):
+    _sample_ctype = "struct sbx_msg_ds18b20_sample_t"
+
+    def __init__(self, type_, buf):
+        # no call to super().__init__(), all data is read from the buffer
+        self.type_ = type_
+        self._raw, self._msg = _cast(type_, buf)
+        header_size = _offsetof(type_, "samples")
+        if len(buf) - 1 < header_size:
+            raise ValueError("message too short")
+        self._count = (
+            (len(buf) - 1 - header_size) // _sizeof(self._sample_ctype)
+        )
+
+    @property
+    def timestamp(self):
+        return self._msg.timestamp
+
+    @property
+    def samples(self):
+        samples = self._msg.samples
+        return [
+            (ffi.buffer(samples[i].id)[:], samples[i].raw_value / 16)
+            for i in range(self._count)
+        ]
+
+
+class LightView(sbx_protocol.LightMessage):
+    _sample_ctype = "struct sbx_msg_light_sample_t"
+
+    def __init__(self, type_, buf):
+        self.type_ = type_
+        self._raw, self._msg = _cast(type_, buf)
+        header_size = _offsetof(type_, "samples")
+        self._count = max(
+            (len(buf) - 1 - header_size) // _sizeof(self._sample_ctype),
+            0
+        )
+
+    @property
+    def samples(self):
+        samples = self._msg.samples
+        return [
+            (samples[i].timestamp, tuple(samples[i].ch))
+            for i in range(self._count)
+        ]
+
+
+class SensorStreamView(sbx_protocol.SensorStreamMessage):
+    def __init__(self, type_, buf):
+        self.type_ = type_
+        self._buf = buf
+        self._raw, self._msg = _cast(type_, buf)
+        self._data_offset = 1 + _sizeof(_struct_name(type_))
+        if len(buf) < self._data_offset:
+            raise ValueError("message too short")
+
+    @property
+    def seq(self):
+        return self._msg.seq
+
+    @property
+    def data(self):
+        return sensor_stream.decompress(
+            self._msg.average & 0xffff,
+            memoryview(self._buf)[self._data_offset:],
+        )
+
+
+class StatusView(sbx_protocol.StatusMessage):
+    """
+    View on a status message.
+
+    The header and stream state are read from the buffer; the diagnostic
+    sections are decoded like in :class:`~.sbx_protocol.StatusMessage` when
+    any of them is accessed first.
+    """
+
+    def __init__(self, type_, buf):
+        self.type_ = type_
+        self._raw, self._msg = _cast(type_, buf)
+
+        header = sbx_protocol.StatusMessage._base_header
+        if len(buf) - 1 < header.size:
+            raise ValueError("message too short")
+
+        if self._msg.protocol_version != 1:
+            raise ValueError("unsupported protocol")
+
+        self._status_version = self._msg.status_version
+        if self._status_version > 6:
+            raise ValueError("unsupported status version")
+
+        offset = 1 + header.size
+        if self._status_version >= 1:
+            offset += sbx_protocol.StatusMessage._v1_stream_states.size
+            if len(buf) < offset:
+                raise ValueError("message too short")
+
+        if self._status_version >= 2:
+            self._defer_sections(self._status_version, buf, offset)
+
+    @property
+    def uptime(self):
+        return self._msg.uptime
+
+    def _stream_state(self, i):
+        if self._status_version < 1:
+            return None
+        state = self._msg.imu.stream_state[i]
+        return self.IMUStreamState(
+            state.sequence_number,
+            state.timestamp,
+            timedelta(milliseconds=state.period),
+        )
+
+    @property
+    def v1_accel_stream_state(self):
+        return self._stream_state(0)
+
+    @property
+    def v1_compass_stream_state(self):
+        return self._stream_state(1)
+
+
+def _available_views():
+    views = {
+        MsgType.STATUS: StatusView,
+        MsgType.SENSOR_DS18B20: DS18B20View,
+        MsgType.SENSOR_LIGHT: LightView,
+        MsgType.SENSOR_STREAM_ACCEL_X: SensorStreamView,
+        MsgType.SENSOR_STREAM_ACCEL_Y: SensorStreamView,
+        MsgType.SENSOR_STREAM_ACCEL_Z: SensorStreamView,
+        MsgType.SENSOR_STREAM_COMPASS_X: SensorStreamView,
+        MsgType.SENSOR_STREAM_COMPASS_Y: SensorStreamView,
+        MsgType.SENSOR_STREAM_COMPASS_Z: SensorStreamView,
+    }
+
+    result = {}
+    for type_, view_cls in views.items():
+        try:
+            ffi.sizeof(_struct_name(type_))
+        except (KeyError, ffi.error):
+            continue
+        result[type_] = view_cls
+    return result
+
+
+#: Map of message types to view classes. Types without an entry are decoded
+#: by :func:`.sbx_protocol.decode_sbx_message`.
+msgtype_to_view = _available_views()
+
+
+def decode_sbx_message(buf):
+    """
+    Decode the SBX message in `buf`, using a view if one is available.
+
+    This is a drop-in replacement for
+    :func:`.sbx_protocol.decode_sbx_message`. The returned view references
+    `buf`, which must therefore not be modified afterwards.
+    """
+    try:
+        type_ = MsgType(buf[0])
+    except ValueError:
+        raise ValueError("unknown message type: 0x{:02x}".format(buf[0]))
+
+    try:
+        view_cls = msgtype_to_view[type_]
+    except KeyError:
+        return sbx_protocol.decode_sbx_message(buf)
+
+    return view_cls(type_, buf)
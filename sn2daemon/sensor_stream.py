@@ -76,7 +76,8 @@ class Buffer:
 
        The `handle` object has a :meth:`close` method which must be called
        after the data has been successfully processed. Only then the data will
-       be deleted from the persistent storage.
+       be deleted from the persistent storage. Its `path` attribute is the
+       file the data is stored in.
 
     """
 
@@ -89,6 +90,10 @@ class Buffer:
             super().__init__()
             self.__path = path
 
+        @property
+        def path(self):
+            return self.__path
+
         def close(self):
             try:
                 self.__path.unlink()
@@ -0,0 +1,150 @@
+"""
+Single-producer single-consumer ring buffer in shared memory.
+
+:class:`RingBuffer` passes length-prefixed records between two processes
+without locks: the producer only ever writes the write position and the
+consumer only ever writes the read position. Both positions count bytes
+since the creation of the ring and are only reduced modulo the capacity
+when they are used as offsets.
+"""
+import struct
+
+from multiprocessing import resource_tracker, shared_memory
+
+
+class RingBuffer:
+    """
+    A ring buffer of byte records in a
+    :class:`multiprocessing.shared_memory.SharedMemory` block.
+
+    Use :meth:`create` in one process and :meth:`attach` with the
+    :attr:`name` in the other one. Only one process may call :meth:`put`
+    and only one process may call :meth:`get`.
+    """
+
+    _header = struct.Struct("<QQ")
+    _length = struct.Struct("<L")
+
+    #: Length value marking the rest of the data area as unused.
+    _WRAP = 0xffffffff
+
+    def __init__(self, shm, owner):
+        super().__init__()
+        self._shm = shm
+        self._owner = owner
+        self._buf = shm.buf
+        self.capacity = shm.size - self._header.size
+
+    @classmethod
+    def create(cls, size):
+        """
+        Create a new ring with `size` bytes of shared memory.
+        """
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        cls._header.pack_into(shm.buf, 0, 0, 0)
+        return cls(shm, True)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attach to a ring created by another process.
+        """
+        shm = shared_memory.SharedMemory(name=name)
+        # only the creating process may remove the block, see bpo-39959
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, False)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def _positions(self):
+        return self._header.unpack_from(self._buf, 0)
+
+    def __len__(self):
+        """
+        Number of bytes used, including record headers and padding.
+        """
+        write, read = self._positions()
+        return write - read
+
+    def fits(self, size):
+        """
+        Whether a record of `size` bytes can be put into the ring once it is
+        empty.
+
+        Records are stored contiguously, so this is only guaranteed for
+        records which take at most half of the capacity.
+        """
+        return self._length.size + size <= self.capacity // 2
+
+    def put(self, record):
+        """
+        Append a record.
+
+        :return: :data:`False` if there is not enough free space.
+        """
+        write, read = self._positions()
+        need = self._length.size + len(record)
+        free = self.capacity - (write - read)
+        offset = write % self.capacity
+        tail = self.capacity - offset
+
+        if tail < need:
+            # records are contiguous; skip the rest of the data area
+            if free < tail + need:
+                return False
+            if tail >= self._length.size:
+                self._length.pack_into(self._buf,
+                                       self._header.size + offset,
+                                       self._WRAP)
+            write += tail
+            offset = 0
+        elif free < need:
+            return False
+
+        start = self._header.size + offset
+        self._length.pack_into(self._buf, start, len(record))
+        start += self._length.size
+        self._buf[start:start+len(record)] = record
+        # publish the record only after it has been written
+        struct.pack_into("<Q", self._buf, 0, write + need)
+        return True
+
+    def get(self):
+        """
+        Remove and return the oldest record, or :data:`None` if the ring is
+        empty.
+        """
+        write, read = self._positions()
+        if read == write:
+            return None
+
+        offset = read % self.capacity
+        tail = self.capacity - offset
+        if tail < self._length.size:
+            read += tail
+            offset = 0
+        else:
+            length, = self._length.unpack_from(self._buf,
+                                               self._header.size + offset)
+            if length == self._WRAP:
+                read += tail
+                offset = 0
+
+        start = self._header.size + offset
+        length, = self._length.unpack_from(self._buf, start)
+        start += self._length.size
+        record = bytes(self._buf[start:start+length])
+        struct.pack_into("<Q", self._buf, 8,
+                         read + self._length.size + length)
+        return record
+
+    def close(self):
+        """
+        Detach from the shared memory; the creating process also removes it.
+        """
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
@@ -7,6 +7,13 @@ import aioxmpp
 
 from hintlib import sample, services, xso
 
+from . import metrics
+
+
+LATENCY_BUCKETS = [
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+]
+
 
 class Sink(metaclass=abc.ABCMeta):
     @abc.abstractmethod
@@ -36,6 +43,14 @@ class Sink(metaclass=abc.ABCMeta):
         for batch in batches:
             self.submit_batch(batch)
 
+    @property
+    def queue_depth(self) -> typing.Optional[int]:
+        """
+        Number of items waiting in the internal queue of this sink, or
+        :data:`None` if the sink does not know.
+        """
+        return None
+
 
 class MetricCollectorSink(Sink):
     def __init__(self, service: services.BatchSubmitterService):
@@ -107,6 +122,10 @@ class PubSubSink(Sink):
             # exponential back off
             self._worker_task.backoff.reset()
 
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
     def _enqueue_dropping_old(self, item):
         try:
             self._queue.put_nowait(item)
@@ -134,3 +153,122 @@ class PubSubSink(Sink):
 
         for item in most_recent_by_sensor.values():
             self.submit_batch(item)
+
+
+class BatchingSink(Sink):
+    """
+    Collect sample batches over a time window and pass them on together.
+
+    :param sinks: The sinks to pass the batches to.
+    :param window: Maximum time in seconds a batch is held back.
+    :param max_batches: Number of held back batches at which they are passed
+        on immediately.
+
+    Instead of one :meth:`~Sink.submit_batches` call per decoded message, the
+    downstream sinks get one call per window with the batches of all
+    messages received in it. This adds up to `window` seconds of latency.
+
+    .. attribute:: latency
+
+       :class:`~.metrics.Histogram` of the time submissions were held back.
+
+    .. attribute:: submits
+
+       Number of submissions received.
+
+    .. attribute:: flushes
+
+       Number of times the held back batches were passed on, i.e. the number
+       of calls made to each downstream sink.
+    """
+
+    def __init__(self,
+                 sinks: typing.Iterable[Sink],
+                 window: float = 0.25,
+                 max_batches: int = 64,
+                 *,
+                 loop=None):
+        super().__init__()
+        self._sinks = list(sinks)
+        self.window = window
+        self.max_batches = max_batches
+        self._loop = loop or asyncio.get_event_loop()
+        self._batches = []
+        self._submitted_at = []
+        self._flush_handle = None
+        self.latency = metrics.Histogram(LATENCY_BUCKETS)
+        self.batches = 0
+        self.submits = 0
+        self.flushes = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._batches)
+
+    def submit_batch(self, batch: sample.SampleBatch):
+        self.submit_batches([batch])
+
+    def submit_batches(self, batches: typing.Iterable[sample.SampleBatch]):
+        nbatches = len(self._batches)
+        self._batches.extend(batches)
+        if len(self._batches) == nbatches:
+            return
+
+        self.submits += 1
+        self.batches += len(self._batches) - nbatches
+        self._submitted_at.append(self._loop.time())
+        if len(self._batches) >= self.max_batches:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self.window,
+                                                       self.flush)
+
+    def flush(self):
+        """
+        Pass all held back batches on now.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._batches:
+            return
+
+        batches, self._batches = self._batches, []
+        now = self._loop.time()
+        for submitted_at in self._submitted_at:
+            self.latency.observe(now - submitted_at)
+        self._submitted_at.clear()
+        self.flushes += 1
+
+        for sink in self._sinks:
+            sink.submit_batches(batches)
+
+    def close(self):
+        self.flush()
+
+    def register_metrics(self, registry, prefix="sn2d_sink_batching_"):
+        """
+        Register the batching metrics with a :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        registry.register(
+            prefix + "latency_seconds",
+            "Time sample batches were held back before passing them on",
+            self.latency,
+        )
+        registry.counter_func(
+            prefix + "submits_total",
+            "Submissions of sample batches received",
+            lambda: self.submits,
+        )
+        registry.counter_func(
+            prefix + "batches_total",
+            "Sample batches received",
+            lambda: self.batches,
+        )
+        registry.counter_func(
+            prefix + "flushes_total",
+            "Calls made to each downstream sink",
+            lambda: self.flushes,
+        )
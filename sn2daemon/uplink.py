@@ -0,0 +1,377 @@
+"""
+Running the uplink in a separate process.
+
+By default, the daemon runs the datagram transport, the decoding, the
+stream buffers and the XMPP clients in a single event loop, so a reconnect
+or a burst of publishes delays the acknowledgements to the sensor node. With
+``uplink.process`` enabled, the XMPP clients and the sample sinks run in a
+child process instead (see :class:`UplinkProcess`). The ingest process
+passes sample batches and stream block descriptors to it through a
+:class:`~.shm_ring.RingBuffer`, with :class:`RingSender` taking the place of
+the sinks and the stream submitter service.
+"""
+import asyncio
+import collections
+import contextlib
+import logging
+import logging.config
+import multiprocessing
+import os
+import pathlib
+import pickle
+
+from . import event_loop, sink, sensor_stream, shm_ring
+
+
+class RingSender(sink.Sink):
+    """
+    Forward sample batches and stream blocks to the uplink process.
+
+    :param ring: The ring to write to.
+    :type ring: :class:`~.shm_ring.RingBuffer`
+    :param max_pending: Maximum number of records held back while the ring
+        is full. Beyond that, the oldest record is dropped.
+    :param retry_interval: Interval in seconds in which held back records
+        are retried.
+
+    This implements the :class:`~.sink.Sink` interface and the
+    ``submit_block`` method of the stream submitter service. Stream block
+    handles are passed as the path of their file, which the uplink process
+    removes once the block has been submitted; dropped blocks are thus
+    emitted again after a restart.
+
+    .. attribute:: sent
+
+       Number of records written to the ring.
+
+    .. attribute:: dropped
+
+       Number of records dropped.
+    """
+
+    def __init__(self, ring, *, max_pending=1024, retry_interval=0.05,
+                 logger=None):
+        super().__init__()
+        self.logger = logger or logging.getLogger(__name__)
+        self._ring = ring
+        self.max_pending = max_pending
+        self.retry_interval = retry_interval
+        self._pending = collections.deque()
+        self._retry_handle = None
+        self.sent = 0
+        self.dropped = 0
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    def submit_batch(self, batch):
+        self.submit_batches([batch])
+
+    def submit_batches(self, batches):
+        batches = list(batches)
+        if batches:
+            self._send(("batches", batches))
+
+    def submit_block(self, item):
+        path, t0, seq0, period, data, range_, handle = item
+        self._send((
+            "block",
+            (path, t0, seq0, period, list(data), range_, str(handle.path)),
+        ))
+
+    def _send(self, message):
+        record = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        if not self._ring.fits(len(record)):
+            self.logger.error(
+                "dropping %s record of %d bytes, which exceeds the ring",
+                message[0], len(record),
+            )
+            self.dropped += 1
+            return
+
+        if not self._pending and self._ring.put(record):
+            self.sent += 1
+            return
+
+        if len(self._pending) >= self.max_pending:
+            self._pending.popleft()
+            self.dropped += 1
+        self._pending.append(record)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._retry_handle is None:
+            self._retry_handle = asyncio.get_event_loop().call_later(
+                self.retry_interval,
+                self._flush,
+            )
+
+    def _put_pending(self):
+        while self._pending and self._ring.put(self._pending[0]):
+            self._pending.popleft()
+            self.sent += 1
+
+    def _flush(self):
+        self._retry_handle = None
+        self._put_pending()
+        if self._pending:
+            self._schedule_flush()
+
+    async def drain(self, timeout):
+        """
+        Write the held back records to the ring.
+
+        :param timeout: Maximum time in seconds to wait for space in the
+            ring.
+        :return: :data:`True` if no records are held back anymore.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        self._put_pending()
+        while self._pending and loop.time() < deadline:
+            await asyncio.sleep(self.retry_interval)
+            self._put_pending()
+        return not self._pending
+
+    def close(self):
+        """
+        Stop retrying to write held back records.
+
+        Records which are still held back are dropped; use :meth:`drain`
+        first to pass them on.
+        """
+        if self._retry_handle is not None:
+            self._retry_handle.cancel()
+            self._retry_handle = None
+        if self._pending:
+            self.logger.warning("dropping %d held back records on close",
+                                len(self._pending))
+            self.dropped += len(self._pending)
+            self._pending.clear()
+
+    def register_metrics(self, registry, prefix="sn2d_uplink_"):
+        """
+        Register the sender metrics with a :class:`~.metrics.Registry`.
+
+        :param prefix: Prefix for the metric names.
+        """
+        registry.counter_func(
+            prefix + "records_sent_total",
+            "Records written to the uplink ring",
+            lambda: self.sent,
+        )
+        registry.counter_func(
+            prefix + "records_dropped_total",
+            "Records dropped because the uplink ring was full",
+            lambda: self.dropped,
+        )
+        registry.gauge_func(
+            prefix + "records_pending",
+            "Records waiting for space in the uplink ring",
+            lambda: len(self._pending),
+        )
+        registry.gauge_func(
+            prefix + "ring_bytes",
+            "Bytes used in the uplink ring",
+            lambda: len(self._ring),
+        )
+
+
+class Uplink:
+    """
+    Read the records of a :class:`RingSender` from a ring and pass them on.
+
+    :param ring: The ring to read from.
+    :type ring: :class:`~.shm_ring.RingBuffer`
+    :param xmpp_clients: The XMPP clients, which are started by :meth:`run`.
+    :param sinks: The sample sinks.
+    :param stream_service: The stream submitter service.
+    :param poll_interval: Interval in seconds in which an empty ring is
+        polled.
+    """
+
+    #: Number of records to process before yielding to the event loop.
+    CHUNK = 64
+
+    def __init__(self, ring, xmpp_clients, sinks, stream_service, *,
+                 poll_interval=0.01, logger=None):
+        super().__init__()
+        self.logger = logger or logging.getLogger(__name__)
+        self._ring = ring
+        self._xmpp_clients = xmpp_clients
+        self._sinks = sinks
+        self._stream_service = stream_service
+        self.poll_interval = poll_interval
+
+    def _dispatch(self, record):
+        kind, payload = pickle.loads(record)
+        if kind == "batches":
+            for sink_ in self._sinks:
+                sink_.submit_batches(payload)
+        elif kind == "block":
+            *item, handle_path = payload
+            item.append(sensor_stream.Buffer._Handle(
+                pathlib.Path(handle_path)
+            ))
+            self._stream_service.submit_block(tuple(item))
+        else:
+            raise ValueError("unknown record kind: {!r}".format(kind))
+
+    def process(self, max_records):
+        """
+        Process up to `max_records` records from the ring.
+
+        :return: The number of records processed.
+        """
+        for i in range(max_records):
+            record = self._ring.get()
+            if record is None:
+                return i
+            try:
+                self._dispatch(record)
+            except Exception:  # NOQA
+                self.logger.exception("failed to process uplink record")
+        return max_records
+
+    async def run(self, parent_pid):
+        """
+        Process records until the process with `parent_pid` exits.
+        """
+        async with contextlib.AsyncExitStack() as stack:
+            for client in self._xmpp_clients.values():
+                await stack.enter_async_context(client)
+
+            while os.getppid() == parent_pid:
+                if self.process(self.CHUNK) < self.CHUNK:
+                    await asyncio.sleep(self.poll_interval)
+                else:
+                    await asyncio.sleep(0)
+
+
+def main(config, ring_name, parent_pid):
+    """
+    Entry point of the uplink process.
+    """
+    logging.basicConfig(level=logging.INFO)
+    file_config = config.get("logging", {}).get("file_config")
+    if file_config is not None:
+        logging.config.fileConfig(file_config)
+
+    from . import daemon
+
+    logger = logging.getLogger("sn2d.uplink")
+    xmpp_clients, sinks, stream_service = daemon.configure_uplink(
+        config,
+        logger,
+    )
+
+    ring = shm_ring.RingBuffer.attach(ring_name)
+    loop = event_loop.new_event_loop(
+        config.get("loop", {}).get("implementation", "asyncio"),
+        logger=logger,
+    )
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(Uplink(
+            ring, xmpp_clients, sinks, stream_service,
+            poll_interval=config.get("uplink", {}).get("poll_interval",
+                                                       0.01),
+            logger=logger,
+        ).run(parent_pid))
+    finally:
+        ring.close()
+        loop.close()
+
+
+class UplinkProcess:
+    """
+    Manage the uplink child process.
+
+    :param config: The daemon configuration, passed to the child.
+    :param ring: The ring the child reads from.
+    :type ring: :class:`~.shm_ring.RingBuffer`
+
+    The read position is kept in the ring, so a restarted child continues
+    with the first record its predecessor had not read yet.
+    """
+
+    def __init__(self, config, ring, *, logger=None):
+        super().__init__()
+        self.logger = logger or logging.getLogger(__name__)
+        self._config = config
+        self._ring = ring
+        self._context = multiprocessing.get_context("spawn")
+        self._process = None
+        self.restarts = 0
+
+    def start(self):
+        self._process = self._context.Process(
+            target=main,
+            args=(self._config, self._ring.name, os.getpid()),
+            name="sn2d-uplink",
+            daemon=True,
+        )
+        self._process.start()
+
+    def check(self):
+        """
+        Restart the child if it has exited.
+        """
+        if self._process is None or self._process.is_alive():
+            return
+        self.logger.error("uplink process exited with code %s, restarting",
+                          self._process.exitcode)
+        self.restarts += 1
+        self.start()
+
+    async def drain(self, timeout, poll_interval=0.01):
+        """
+        Wait until the child has read all records from the ring.
+
+        :param timeout: Maximum time in seconds to wait.
+        :return: :data:`True` if the ring is empty.
+
+        Returns early if the child is not running.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while (len(self._ring) > 0 and
+               self._process is not None and
+               self._process.is_alive() and
+               loop.time() < deadline):
+            await asyncio.sleep(poll_interval)
+        return len(self._ring) == 0
+
+    def stop(self, timeout=5):
+        if self._process is None:
+            return
+        self._process.terminate()
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.kill()
+        self._process = None
+
+
+async def shutdown(sender, process, timeout=5):
+    """
+    Pass the remaining records to the uplink process and stop it.
+
+    :param sender: The sender writing to the ring of `process`.
+    :type sender: :class:`RingSender`
+    :param process: The uplink process.
+    :type process: :class:`UplinkProcess`
+    :param timeout: Maximum time in seconds to wait for each of the held back
+        records to be written and the ring to be read.
+
+    The records held back by `sender` are written to the ring first, then
+    the child is given time to read the ring before it is terminated.
+    """
+    if not await sender.drain(timeout):
+        sender.logger.warning("uplink ring still full after %.1f s", timeout)
+    sender.close()
+    if not await process.drain(timeout):
+        process.logger.warning(
+            "uplink process did not read the ring within %.1f s", timeout,
+        )
+    process.stop(timeout)
@@ -0,0 +1,201 @@
+"""
+Builders for SBX messages in wire format.
+
+These are used by the tests and by the benchmarks in ``benchmarks/``. All
+builders return the complete message including the type byte, except for
+:func:`pack_esp_status`, whose result is the payload of an ESP status data
+frame.
+"""
+import struct
+
+import sn2daemon.sbx_protocol as sbx_protocol
+
+from sn2daemon.sbx_protocol import MsgType, StatusMessage
+
+import _sn2d_comm
+
+
+# calibration values from the example in the BME280 datasheet; humidity
+# values are made up
+BME280_CALIBRATION = (
+    27504, 26435, -1000,
+    36477, -10685, 3024, 2855, 140, -7, 15500, -14600, 6000,
+    75, 362, 0, 313, 50, 30,
+)
+
+
+def make_message(type_, payload_ctype, extra=0):
+    """
+    Allocate a zeroed message for the cffi struct `payload_ctype`.
+
+    :return: The buffer and the ``struct sbx_msg_t`` cdata pointing into
+             it, with the type already set.
+    """
+    buf = bytearray(
+        _sn2d_comm.ffi.sizeof("uint8_t") +
+        _sn2d_comm.ffi.sizeof(payload_ctype) +
+        extra
+    )
+    struct = _sn2d_comm.ffi.cast(
+        "struct sbx_msg_t*",
+        _sn2d_comm.ffi.from_buffer(buf)
+    )
+    struct.type = type_
+    return buf, struct
+
+
+def pack_calibration(values):
+    """
+    Pack BME280 calibration values into the ``dig88`` and ``dige1`` blocks.
+    """
+    dig_H4, dig_H5 = values[15:17]
+    dig88 = sbx_protocol.bme280.Dig88.pack(*values[:12], values[12])
+    dige1 = sbx_protocol.bme280.Dige1.pack(
+        values[13],
+        values[14],
+        dig_H4 >> 4,
+        (dig_H4 & 0xf) | ((dig_H5 & 0xf) << 4),
+        dig_H5 >> 4,
+        values[17],
+    )
+    return dig88, dige1
+
+
+def pack_status(status_version, rtc=12345678, uptime=12345, ntasks=3):
+    """
+    Pack a status message of the given version.
+
+    :param ntasks: Number of tasks in the task list of version 5.
+    """
+    parts = [
+        bytes([MsgType.STATUS.value]),
+        StatusMessage._base_header.pack(rtc, uptime, 1, status_version),
+    ]
+
+    if status_version >= 1:
+        parts.append(StatusMessage._v1_stream_states.pack(
+            12, 123, 5,
+            13, 124, 64,
+        ))
+
+    if status_version >= 2:
+        parts.append(StatusMessage.I2CMetrics._v2.pack(2))
+        parts.append(StatusMessage.I2CMetrics._v2.pack(3))
+        if status_version >= 4:
+            parts.append(StatusMessage.BME280Metrics._v3.pack(0x12, 20))
+            parts.append(StatusMessage.BME280Metrics._v3.pack(0x34, 1204))
+        elif status_version >= 3:
+            parts.append(StatusMessage.BME280Metrics._v3.pack(0x12, 20))
+        else:
+            parts.append(StatusMessage.BME280Metrics._v2.pack(20))
+
+    if status_version >= 5:
+        parts.append(StatusMessage.TXMetrics._v1.pack(101, 102, 103, 104))
+
+    if status_version == 5:
+        parts.append(StatusMessage.TasksMetrics._v1.pack(ntasks, 10))
+        for i in range(ntasks):
+            parts.append(StatusMessage.TasksMetrics.TaskMetrics._v1.pack(
+                (i + 2) * 10
+            ))
+
+    if status_version >= 6:
+        parts.append(StatusMessage.CPUMetrics._v1.pack(
+            *((i * 97) & 0xffff for i in range(0x20))
+        ))
+
+    return b"".join(parts)
+
+
+def pack_ds18b20(nsamples=4, timestamp=12345):
+    return b"".join(
+        [
+            bytes([MsgType.SENSOR_DS18B20.value]),
+            sbx_protocol.DS18B20Message._header.pack(timestamp),
+        ] + [
+            sbx_protocol.DS18B20Message._sample.pack(
+                bytes([0x28, i, 0x4c, 0x1f, 0x07, 0x00, 0x00, 0x5a]),
+                21 * 16 + i,
+            )
+            for i in range(nsamples)
+        ]
+    )
+
+
+def pack_light(nsamples=8):
+    return b"".join(
+        [bytes([MsgType.SENSOR_LIGHT.value])] + [
+            sbx_protocol.LightMessage._sample.pack(
+                i * 1000,
+                *(i * 100 + ch * 4 for ch in range(4))
+            )
+            for i in range(nsamples)
+        ]
+    )
+
+
+def pack_noise(nsamples=8, factor=1):
+    return b"".join(
+        [
+            bytes([MsgType.SENSOR_NOISE.value]),
+            sbx_protocol.NoiseMessage._header.pack(factor),
+        ] + [
+            sbx_protocol.NoiseMessage._sample.pack(
+                i * 100,
+                i * 1024,
+                -i * 64,
+                i * 64,
+            )
+            for i in range(nsamples)
+        ]
+    )
+
+
+def pack_bme280(instance=0, timestamp=12345,
+                calibration=BME280_CALIBRATION,
+                temp_raw=519888, pressure_raw=415148, humidity_raw=30000):
+    dig88, dige1 = pack_calibration(calibration)
+    readout = (
+        (pressure_raw << 4).to_bytes(3, "big") +
+        (temp_raw << 4).to_bytes(3, "big") +
+        humidity_raw.to_bytes(2, "big")
+    )
+    return bytes([MsgType.SENSOR_BME280.value]) + \
+        sbx_protocol.BME280Message._message.pack(
+            timestamp, instance, dig88, dige1, readout,
+        )
+
+
+def compress_stream(average, values):
+    """
+    Compress `values` for a sensor stream message with the reference
+    `average`, the inverse of :func:`sn2daemon.sensor_stream.decompress`.
+
+    Values which exceed `average` by less than 256 are stored as one byte.
+    """
+    bitmaps = bytearray()
+    data = bytearray()
+    for i, value in enumerate(values):
+        if i % 8 == 0:
+            bitmaps.append(0)
+        diff = (value - average) % 65536
+        if diff < 256:
+            bitmaps[-1] |= 0x80 >> (i % 8)
+            data.append(diff)
+        else:
+            data += struct.pack("<H", diff)
+    return bytes(bitmaps + data)
+
+
+def pack_sensor_stream(type_=MsgType.SENSOR_STREAM_ACCEL_X, seq=123,
+                       nsamples=64, average=1000):
+    values = [average + (i * 37) % 300 for i in range(nsamples)]
+    return bytes([type_.value]) + \
+        sbx_protocol.SensorStreamMessage._header.pack(seq, average) + \
+        compress_stream(average, values)
+
+
+def pack_esp_status():
+    return sbx_protocol.ESPStatusMessage._v1.pack(
+        10000, 12, 1, 3, 150, 20, 0, 4,
+    )
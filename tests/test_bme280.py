@@ -0,0 +1,219 @@
+import os
+import unittest
+import unittest.mock
+
+import sn2daemon.bme280 as bme280
+
+from .sbx_messages import BME280_CALIBRATION as CALIBRATION, pack_calibration
+
+
+class Testget_calibration(unittest.TestCase):
+    def test_unpacks_values(self):
+        calibration = bme280.get_calibration(*pack_calibration(CALIBRATION))
+        self.assertIsInstance(calibration, bme280.Calibration)
+        self.assertEqual(calibration.values, CALIBRATION)
+        self.assertEqual(calibration[:3], CALIBRATION[:3])
+
+
+class TestCompensation(unittest.TestCase):
+    def setUp(self):
+        self.calibration = bme280.Calibration(CALIBRATION)
+
+    def test_datasheet_example(self):
+        temperature = self.calibration.temperature(519888)
+        self.assertAlmostEqual(temperature, 25.08, places=2)
+        self.assertAlmostEqual(
+            self.calibration.pressure(415148, temperature),
+            100653.27,
+            places=1,
+        )
+
+    def test_functions_accept_tuples(self):
+        temperature = bme280.compensate_temperature(CALIBRATION, 519888)
+        self.assertEqual(temperature,
+                         self.calibration.temperature(519888))
+        self.assertEqual(
+            bme280.compensate_pressure(CALIBRATION, 415148, temperature),
+            self.calibration.pressure(415148, temperature),
+        )
+        self.assertEqual(
+            bme280.compensate_humidity(CALIBRATION, 30000, temperature),
+            self.calibration.humidity(30000, temperature),
+        )
+
+    def test_pressure_with_zero_p1(self):
+        calibration = bme280.Calibration(
+            CALIBRATION[:3] + (0,) + CALIBRATION[4:]
+        )
+        self.assertEqual(calibration.pressure(415148, 25.0), 0)
+
+
+class TestFixedPoint(unittest.TestCase):
+    def setUp(self):
+        self.calibration = bme280.Calibration(CALIBRATION)
+
+    def test_datasheet_example(self):
+        temperature, t_fine = self.calibration.temperature_int32(519888)
+        self.assertEqual(temperature, 2508)
+        self.assertEqual(t_fine, 128422)
+        self.assertEqual(self.calibration.pressure_int64(415148, t_fine),
+                         25767233)
+
+    def test_humidity_is_clamped(self):
+        _, t_fine = self.calibration.temperature_int32(519888)
+        self.assertEqual(self.calibration.humidity_int32(0, t_fine), 0)
+        self.assertEqual(self.calibration.humidity_int32(65535, t_fine),
+                         100 * 1024)
+
+    def test_pressure_with_zero_p1(self):
+        calibration = bme280.Calibration(
+            CALIBRATION[:3] + (0,) + CALIBRATION[4:]
+        )
+        self.assertEqual(calibration.pressure_int64(415148, 128422), 0)
+
+
+@unittest.skipIf(bme280.numpy is None, "requires NumPy")
+class Testcompensate_batch(unittest.TestCase):
+    # differences between the floating and fixed point formulas over the
+    # ranges below
+    TEMPERATURE_TOLERANCE = 0.01  # °C
+    PRESSURE_TOLERANCE = 1  # Pa
+    HUMIDITY_TOLERANCE = 0.02  # %
+
+    def setUp(self):
+        self.calibration = bme280.Calibration(CALIBRATION)
+        rng = bme280.numpy.random.default_rng(1)
+        self.temp_raw = rng.integers(400000, 600000, 1000)
+        self.pressure_raw = rng.integers(250000, 500000, 1000)
+        self.humidity_raw = rng.integers(20000, 40000, 1000)
+
+    def test_get_readouts(self):
+        readouts = os.urandom(8 * 10)
+        temp_raw, pressure_raw, humidity_raw = bme280.get_readouts(readouts)
+        for i in range(10):
+            self.assertEqual(
+                (temp_raw[i], pressure_raw[i], humidity_raw[i]),
+                bme280.get_readout(readouts[i*8:(i+1)*8]),
+            )
+
+    def test_float_matches_scalar_functions(self):
+        temperature, pressure, humidity = bme280.compensate_batch(
+            CALIBRATION,
+            self.temp_raw, self.pressure_raw, self.humidity_raw,
+        )
+        for i in range(len(self.temp_raw)):
+            t = self.calibration.temperature(int(self.temp_raw[i]))
+            self.assertEqual(temperature[i], t)
+            self.assertEqual(
+                pressure[i],
+                self.calibration.pressure(int(self.pressure_raw[i]), t),
+            )
+            self.assertEqual(
+                humidity[i],
+                self.calibration.humidity(int(self.humidity_raw[i]), t),
+            )
+
+    def test_fixed_point_matches_scalar_methods(self):
+        for _ in range(20):
+            calibration = bme280.get_calibration(os.urandom(26),
+                                                 os.urandom(7))
+            temp_raw, pressure_raw, humidity_raw = bme280.get_readouts(
+                os.urandom(8 * 50)
+            )
+            temperature, pressure, humidity = bme280.compensate_batch(
+                calibration, temp_raw, pressure_raw, humidity_raw,
+                fixed_point=True,
+            )
+            for i in range(len(temp_raw)):
+                t, t_fine = calibration.temperature_int32(int(temp_raw[i]))
+                self.assertEqual(temperature[i], t / 100)
+                self.assertEqual(
+                    pressure[i],
+                    calibration.pressure_int64(int(pressure_raw[i]),
+                                               t_fine) / 256,
+                )
+                self.assertEqual(
+                    humidity[i],
+                    calibration.humidity_int32(int(humidity_raw[i]),
+                                               t_fine) / 1024,
+                )
+
+    def test_fixed_point_agrees_with_float(self):
+        results = [
+            bme280.compensate_batch(
+                self.calibration,
+                self.temp_raw, self.pressure_raw, self.humidity_raw,
+                fixed_point=fixed_point,
+            )
+            for fixed_point in [False, True]
+        ]
+        (t_float, p_float, h_float), (t_int, p_int, h_int) = results
+        # the fixed point humidity is clamped to 0..100 %
+        valid = (h_float > 0) & (h_float < 100)
+
+        self.assertLessEqual(abs(t_float - t_int).max(),
+                             self.TEMPERATURE_TOLERANCE)
+        self.assertLessEqual(abs(p_float - p_int).max(),
+                             self.PRESSURE_TOLERANCE)
+        self.assertLessEqual(abs(h_float - h_int)[valid].max(),
+                             self.HUMIDITY_TOLERANCE)
+
+    def test_requires_numpy(self):
+        with unittest.mock.patch.object(bme280, "numpy", None):
+            with self.assertRaises(RuntimeError):
+                bme280.compensate_batch(CALIBRATION, [0], [0], [0])
+
+
+class TestCalibrationCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = bme280.CalibrationCache()
+        self.dig88, self.dige1 = pack_calibration(CALIBRATION)
+
+    def test_hits_for_same_instance_and_bytes(self):
+        first = self.cache.get(0, self.dig88, self.dige1)
+        second = self.cache.get(0, bytes(self.dig88), bytes(self.dige1))
+        self.assertIs(first, second)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_instances_are_cached_separately(self):
+        first = self.cache.get(0, self.dig88, self.dige1)
+        second = self.cache.get(1, self.dig88, self.dige1)
+        self.assertIsNot(first, second)
+        self.assertEqual(self.cache.misses, 2)
+        self.assertEqual(len(self.cache), 2)
+
+    def test_changed_bytes_are_parsed(self):
+        first = self.cache.get(0, self.dig88, self.dige1)
+        other_dig88, _ = pack_calibration((27000,) + CALIBRATION[1:])
+        second = self.cache.get(0, other_dig88, self.dige1)
+        self.assertEqual(second[0], 27000)
+        self.assertIsNot(first, second)
+        self.assertEqual(self.cache.misses, 2)
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_chips_sharing_an_instance(self):
+        other_dig88, _ = pack_calibration((27000,) + CALIBRATION[1:])
+        for _ in range(5):
+            first = self.cache.get(0, self.dig88, self.dige1)
+            second = self.cache.get(0, other_dig88, self.dige1)
+        self.assertEqual(first[0], CALIBRATION[0])
+        self.assertEqual(second[0], 27000)
+        self.assertEqual(self.cache.misses, 2)
+        self.assertEqual(self.cache.hits, 8)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.max_size = 2
+        for instance in [0, 1, 0, 2]:
+            self.cache.get(instance, self.dig88, self.dige1)
+        self.assertEqual(len(self.cache), 2)
+        self.cache.get(0, self.dig88, self.dige1)
+        self.cache.get(1, self.dig88, self.dige1)
+        self.assertEqual(self.cache.misses, 4)
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_clear(self):
+        self.cache.get(0, self.dig88, self.dige1)
+        self.cache.clear()
+        self.cache.get(0, self.dig88, self.dige1)
+        self.assertEqual(self.cache.misses, 2)
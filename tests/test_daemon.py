@@ -0,0 +1,298 @@
+import pathlib
+import tempfile
+import unittest
+import unittest.mock
+
+from datetime import datetime, timedelta
+
+import sn2daemon.daemon as daemon
+import sn2daemon.metrics as metrics
+import sn2daemon.sbx_protocol as sbx_protocol
+
+from hintlib import sample
+
+from . import sbx_messages
+
+
+class FakeRTCifier:
+    def __init__(self):
+        self.calls = 0
+
+    def map_to_rtc(self, timestamp):
+        self.calls += 1
+        return datetime(2020, 1, 1) + timedelta(milliseconds=timestamp)
+
+
+class FakeIndividualRewriter:
+    # moves the red light channel to instance 1 and scales noise values
+    def rewrite(self, s):
+        if s.sensor.part == "tcs3200" and s.sensor.subpart == "r":
+            return s.replace(sensor=s.sensor.replace(instance=1))
+        if s.sensor.part == "custom-noise":
+            return s.replace(value=s.value * 2)
+        return s
+
+
+class FakeBatchRewriter:
+    def rewrite(self, batch):
+        return batch._replace(samples=dict(batch.samples, rewritten=True))
+
+
+def chain(samples, individual_rewriter, batch_rewriter, rtcifier):
+    return list(map(
+        batch_rewriter.rewrite,
+        daemon.batch_samples(
+            daemon.rtcify_samples(
+                map(
+                    individual_rewriter.rewrite,
+                    daemon.deenumify_samples(samples)
+                ),
+                rtcifier
+            )
+        )
+    ))
+
+
+class TestSamplePipeline(unittest.TestCase):
+    def setUp(self):
+        self.rtcifier = FakeRTCifier()
+        self.pipeline = daemon.SamplePipeline(
+            FakeIndividualRewriter(),
+            FakeBatchRewriter(),
+            self.rtcifier,
+        )
+        self.messages = [
+            sbx_protocol.decode_sbx_message(buf)
+            for buf in [
+                sbx_messages.pack_ds18b20(),
+                sbx_messages.pack_light(),
+                sbx_messages.pack_noise(),
+                sbx_messages.pack_bme280(),
+                sbx_messages.pack_bme280(instance=1),
+            ]
+        ]
+        self.messages.append(sbx_protocol.ESPStatusMessage.from_buf(
+            datetime(2020, 1, 2),
+            sbx_messages.pack_esp_status(),
+        ))
+
+    def test_equals_chain(self):
+        for msg in self.messages * 2:
+            expected = chain(msg.get_samples(),
+                             FakeIndividualRewriter(),
+                             FakeBatchRewriter(),
+                             FakeRTCifier())
+            self.assertEqual(self.pipeline.process(msg.get_samples()),
+                             expected)
+
+    def test_compiles_each_path_once(self):
+        msg = self.messages[1]
+        self.pipeline.process(msg.get_samples())
+        compiled = dict(self.pipeline._compiled)
+        self.assertEqual(len(compiled), 4)
+        self.pipeline.process(msg.get_samples())
+        self.assertEqual(self.pipeline._compiled, compiled)
+
+    def test_limits_compiled_paths(self):
+        self.pipeline.max_paths = 2
+        self.pipeline.process(self.messages[1].get_samples())
+        self.assertLessEqual(len(self.pipeline._compiled), 2)
+
+    def test_maps_shared_timestamps_once(self):
+        msg = self.messages[3]
+        self.pipeline.process(msg.get_samples())
+        self.assertEqual(self.rtcifier.calls, 1)
+
+    def test_rejects_duplicate_subparts(self):
+        path = sample.SensorPath(sample.Part.BME280, 0,
+                                 sample.BME280Subpart.TEMPERATURE)
+        with self.assertRaises(RuntimeError):
+            self.pipeline.process([
+                sample.Sample(1, path, 1.0),
+                sample.Sample(1, path, 2.0),
+            ])
+
+    def test_empty(self):
+        self.assertEqual(self.pipeline.process([]), [])
+
+
+class WrappingRTCifier:
+    # tracks the 16 bit wraparound like hintlib's RTCifier on a Timeline
+    def __init__(self):
+        self.rtc = None
+        self.last = None
+        self.offset = 0
+
+    def align(self, rtc, uptime):
+        self.rtc = rtc - timedelta(milliseconds=uptime)
+        self.last = uptime
+        self.offset = 0
+
+    def map_to_rtc(self, uptime):
+        if uptime < self.last - 30000:
+            self.offset += 2**16
+        self.last = uptime
+        return self.rtc + timedelta(milliseconds=uptime + self.offset)
+
+
+class TestMemoizingRTCifier(unittest.TestCase):
+    def setUp(self):
+        self.inner = FakeRTCifier()
+        self.inner.align = unittest.mock.Mock()
+        self.rtcifier = daemon.MemoizingRTCifier(self.inner)
+
+    def test_maps_repeated_uptime_once(self):
+        a = self.rtcifier.map_to_rtc(100)
+        self.assertEqual(a, self.inner.map_to_rtc(100))
+        self.inner.calls = 0
+        self.assertIs(self.rtcifier.map_to_rtc(100), a)
+        self.assertEqual(self.inner.calls, 0)
+        self.assertEqual((self.rtcifier.hits, self.rtcifier.misses), (1, 1))
+
+    def test_align_invalidates(self):
+        self.rtcifier.map_to_rtc(100)
+        self.rtcifier.align(datetime(2020, 1, 1), 100)
+        self.inner.align.assert_called_once_with(datetime(2020, 1, 1), 100)
+        self.assertEqual(self.rtcifier.epoch, 1)
+        self.rtcifier.map_to_rtc(100)
+        self.assertEqual(self.rtcifier.misses, 2)
+
+    def test_map_many(self):
+        result = self.rtcifier.map_many([1, 1, 2, 1, 3])
+        self.assertEqual(result,
+                         [self.inner.map_to_rtc(ts)
+                          for ts in [1, 1, 2, 1, 3]])
+        self.assertEqual((self.rtcifier.hits, self.rtcifier.misses), (1, 4))
+
+    def test_follows_wraparound_within_epoch(self):
+        rtcifier = daemon.MemoizingRTCifier(WrappingRTCifier())
+        rtc = datetime(2020, 1, 1)
+        rtcifier.align(rtc, 0)
+        result = rtcifier.map_many([0, 20000, 40000, 60000, 0])
+        self.assertEqual(result[0], rtc)
+        self.assertEqual(result[3], rtc + timedelta(milliseconds=60000))
+        self.assertEqual(result[4], rtc + timedelta(milliseconds=2**16))
+
+
+class Testtag_path(unittest.TestCase):
+    def test_prepends_node_to_instance(self):
+        self.assertEqual(
+            daemon.tag_path(
+                sample.SensorPath(sample.Part.BME280, 1,
+                                  sample.BME280Subpart.TEMPERATURE),
+                "kitchen",
+            ),
+            sample.SensorPath(sample.Part.BME280, "kitchen.1",
+                              sample.BME280Subpart.TEMPERATURE),
+        )
+
+
+class TestSensorNode(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.batches = []
+        self.blocks = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _node(self, name, config={}):
+        node = daemon.SensorNode(
+            name,
+            config,
+            pathlib.Path(self.tmpdir.name) / "node",
+            FakeIndividualRewriter(),
+            FakeBatchRewriter(),
+            self.batches.extend,
+            lambda *args: self.blocks.append(args),
+        )
+        self.addCleanup(node.close)
+        return node
+
+    def _status(self, node):
+        node.on_message(
+            datetime.utcnow(),
+            sbx_protocol.decode_sbx_message(sbx_messages.pack_status(1)),
+        )
+
+    def test_holds_messages_until_status(self):
+        node = self._node("kitchen")
+        node.on_message(
+            datetime(2020, 1, 1),
+            sbx_protocol.decode_sbx_message(sbx_messages.pack_bme280()),
+        )
+        self.assertEqual(self.batches, [])
+
+        self._status(node)
+        self.assertTrue(self.batches)
+        for batch in self.batches:
+            self.assertEqual(batch.bare_path.part, "bme280")
+            self.assertEqual(batch.bare_path.instance, "kitchen.0")
+            self.assertTrue(batch.samples["rewritten"])
+
+    def test_single_node_paths_are_not_tagged(self):
+        node = self._node(None)
+        self._status(node)
+        node.on_message(
+            datetime(2020, 1, 1),
+            sbx_protocol.decode_sbx_message(
+                sbx_messages.pack_bme280(instance=1)
+            ),
+        )
+        self.assertEqual({batch.bare_path.instance for batch in self.batches},
+                         {1})
+
+    def test_tags_stream_paths(self):
+        node = self._node("kitchen", {"streams": {"batch_size": 2}})
+        self._status(node)
+        node.on_message(
+            datetime(2020, 1, 1),
+            sbx_protocol.decode_sbx_message(
+                sbx_messages.pack_sensor_stream(seq=12)
+            ),
+        )
+        (path, t0, seq0, period, data, handle), *_ = self.blocks
+        self.assertEqual(path, sample.SensorPath(
+            sample.Part.LSM303D,
+            "kitchen.0",
+            sample.LSM303DSubpart.ACCEL_X,
+        ))
+        self.assertEqual(seq0, 12)
+        handle.close()
+
+    def test_tags_health_batches(self):
+        node = self._node("kitchen", {"health": {"interval": 0,
+                                                 "sinks": True}})
+        node.on_message(
+            datetime.utcnow(),
+            sbx_protocol.decode_sbx_message(sbx_messages.pack_status(4)),
+        )
+        self.assertTrue(self.batches)
+        for batch in self.batches:
+            self.assertTrue(batch.bare_path.instance.startswith("kitchen."))
+
+    def test_metrics_registry(self):
+        registry = metrics.Registry()
+        self.assertIs(self._node(None).metrics_registry(registry), registry)
+
+        for name in ["kitchen", "living room"]:
+            node = self._node(name)
+            node.register_metrics(node.metrics_registry(registry))
+        rendered = registry.render()
+        self.assertEqual(
+            rendered.count("# TYPE sn2d_holdback_held gauge\n"), 1
+        )
+        self.assertIn('sn2d_holdback_held{node="kitchen"} 0\n', rendered)
+        self.assertIn('sn2d_holdback_held{node="living room"} 0\n',
+                      rendered)
+
+    def test_close_detaches_and_unregisters_metrics(self):
+        registry = metrics.Registry()
+        node = self._node("kitchen")
+        node.register_metrics(node.metrics_registry(registry))
+        client = unittest.mock.Mock()
+        node.attach(client)
+        node.close()
+        client.close.assert_called_once_with()
+        self.assertIsNone(node.sbx_client)
+        self.assertNotIn("sn2d_holdback_held", registry)
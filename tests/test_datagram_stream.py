@@ -1,6 +1,11 @@
+import asyncio
 import unittest
+import unittest.mock
+
+from datetime import timedelta
 
 import sn2daemon.datagram_stream as datagram_stream
+import sn2daemon.metrics as metrics
 
 
 class TestSerialNumber(unittest.TestCase):
@@ -401,6 +406,14 @@ class TestSerialNumberRangeSet(unittest.TestCase):
         self.assertIsNone(self.rs.first_end)
         self.assertIsNone(self.rs.first_start)
 
+    def test_count_before(self):
+        for i in [9, 2, 3, 4, 7]:
+            self.rs.add(i)
+        self.assertEqual(self.rs.count_before(2), 0)
+        self.assertEqual(self.rs.count_before(4), 2)
+        self.assertEqual(self.rs.count_before(9), 4)
+        self.assertEqual(self.rs.count_before(100), 5)
+
     def test_contains_check(self):
         self.assertNotIn(2, self.rs)
 
@@ -414,3 +427,593 @@ class TestSerialNumberRangeSet(unittest.TestCase):
         self.assertIn(1, self.rs)
         self.assertIn(2, self.rs)
         self.assertIn(3, self.rs)
+
+
+class TestPacketSizeController(unittest.TestCase):
+    def setUp(self):
+        self.psc = datagram_stream.PacketSizeController(
+            400, 1200,
+            bucket_width=100,
+            loss_threshold=0.2,
+            min_samples=4,
+            smoothing=0.5,
+        )
+
+    def tearDown(self):
+        del self.psc
+
+    def _sn(self, value):
+        return datagram_stream.SerialNumber(16, value)
+
+    def test_init_rejects_invalid_bounds(self):
+        with self.assertRaises(ValueError):
+            datagram_stream.PacketSizeController(1200, 400)
+
+        with self.assertRaises(ValueError):
+            datagram_stream.PacketSizeController(0, 400)
+
+    def test_starts_at_max_size(self):
+        self.assertEqual(self.psc.packet_size, 1200)
+        self.assertEqual(self.psc.stats, {})
+
+    def test_feedback_counts_received_and_lost_packets(self):
+        self.psc.record_sent(self._sn(1), 1150)
+        self.psc.record_sent(self._sn(2), 250)
+        self.psc.record_sent(self._sn(3), 1180)
+
+        self.psc.record_feedback(self._sn(2))
+
+        self.assertEqual(
+            self.psc.stats,
+            {
+                200: (1, 0, 0.0),
+                1100: (1, 1, 1.0),
+            }
+        )
+
+        self.psc.record_feedback(self._sn(3))
+
+        self.assertEqual(
+            self.psc.stats,
+            {
+                200: (1, 0, 0.0),
+                1100: (2, 1, 0.5),
+            }
+        )
+
+    def test_feedback_is_idempotent(self):
+        self.psc.record_sent(self._sn(1), 1150)
+        self.psc.record_feedback(self._sn(1))
+        self.psc.record_feedback(self._sn(1))
+
+        self.assertEqual(self.psc.stats, {1100: (1, 0, 0.0)})
+
+    def test_lowers_size_on_loss(self):
+        for i in range(1, 5, 2):
+            self.psc.record_sent(self._sn(i), 1150)
+            self.psc.record_sent(self._sn(i+1), 1150)
+            self.psc.record_feedback(self._sn(i+1))
+
+        self.assertEqual(self.psc.packet_size, 1100)
+
+    def test_does_not_go_below_min_size(self):
+        sn = 0
+        for i in range(100):
+            sn += 1
+            self.psc.record_sent(self._sn(sn), self.psc.packet_size)
+            sn += 1
+            self.psc.record_sent(self._sn(sn), self.psc.packet_size)
+            self.psc.record_feedback(self._sn(sn))
+
+        self.assertEqual(self.psc.packet_size, 400)
+
+    def test_raises_size_without_loss(self):
+        sn = 0
+        for i in range(100):
+            sn += 1
+            self.psc.record_sent(self._sn(sn), self.psc.packet_size)
+            sn += 1
+            self.psc.record_sent(self._sn(sn), self.psc.packet_size)
+            self.psc.record_feedback(self._sn(sn))
+
+        for i in range(100):
+            sn += 1
+            self.psc.record_sent(self._sn(sn), self.psc.packet_size)
+            self.psc.record_feedback(self._sn(sn))
+
+        self.assertEqual(self.psc.packet_size, 1200)
+
+    def test_small_packets_do_not_influence_size(self):
+        sn = 0
+        for i in range(100):
+            sn += 1
+            self.psc.record_sent(self._sn(sn), 200)
+            sn += 1
+            self.psc.record_sent(self._sn(sn), 200)
+            self.psc.record_feedback(self._sn(sn))
+
+        self.assertEqual(self.psc.packet_size, 1200)
+
+    def test_clear_pending_forgets_unacked_packets(self):
+        self.psc.record_sent(self._sn(1), 1150)
+        self.psc.clear_pending()
+        self.psc.record_sent(self._sn(2), 1150)
+        self.psc.record_feedback(self._sn(2))
+
+        self.assertEqual(self.psc.stats, {1100: (1, 0, 0.0)})
+
+
+class TestAppRequestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.transmit = unittest.mock.Mock()
+        self.scheduler = datagram_stream.AppRequestScheduler(
+            self.transmit,
+            timedelta(seconds=0.01),
+        )
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_transmits_immediately(self):
+        fut = self.scheduler.submit(1, b"foo", "addr", 3)
+
+        self.transmit.assert_called_once_with(b"foo", "addr")
+        self.assertFalse(fut.done())
+        self.assertEqual(self.scheduler.in_flight, 1)
+
+    def test_response_resolves_future(self):
+        fut = self.scheduler.submit(1, b"foo", "addr", 3)
+
+        self.assertTrue(self.scheduler.response_received(1, b"bar"))
+
+        self.assertEqual(self._run(fut), b"bar")
+        self.assertEqual(self.scheduler.in_flight, 0)
+        self.assertEqual(self.scheduler.latency.count, 1)
+
+    def test_unknown_response_is_rejected(self):
+        self.assertFalse(self.scheduler.response_received(1, b"bar"))
+
+    def test_retransmits_until_max_retries(self):
+        fut = self.scheduler.submit(1, b"foo", "addr", 3)
+
+        with self.assertRaises(TimeoutError):
+            self._run(fut)
+
+        self.assertEqual(self.transmit.call_count, 3)
+        self.assertEqual(self.scheduler.in_flight, 0)
+        self.assertEqual(self.scheduler.timeouts, 1)
+
+    def test_per_request_max_retries(self):
+        fut1 = self.scheduler.submit(1, b"foo", "addr", 1)
+        fut2 = self.scheduler.submit(2, b"bar", "addr", 4)
+
+        with self.assertRaises(TimeoutError):
+            self._run(fut1)
+
+        self.assertEqual(self.scheduler.in_flight, 1)
+
+        with self.assertRaises(TimeoutError):
+            self._run(fut2)
+
+        self.assertSequenceEqual(
+            self.transmit.mock_calls,
+            [unittest.mock.call(b"foo", "addr")] +
+            [unittest.mock.call(b"bar", "addr")] * 4
+        )
+
+    def test_cancel(self):
+        fut = self.scheduler.submit(1, b"foo", "addr", 3)
+
+        self.assertTrue(self.scheduler.cancel(1))
+
+        self.assertTrue(fut.cancelled())
+        self.assertEqual(self.scheduler.in_flight, 0)
+        self.assertFalse(self.scheduler.cancel(1))
+
+        self._run(asyncio.sleep(0.05))
+        self.transmit.assert_called_once_with(b"foo", "addr")
+
+    def test_cancelled_future_stops_retransmission(self):
+        fut = self.scheduler.submit(1, b"foo", "addr", 3)
+        fut.cancel()
+
+        self._run(asyncio.sleep(0.05))
+        self.transmit.assert_called_once_with(b"foo", "addr")
+
+    def test_transmit_error_fails_future(self):
+        exc = ConnectionError()
+        self.transmit.side_effect = exc
+
+        fut = self.scheduler.submit(1, b"foo", "addr", 3)
+
+        self.assertIs(fut.exception(), exc)
+        self.assertEqual(self.scheduler.in_flight, 0)
+
+
+class TestXorFrames(unittest.TestCase):
+    def test_empty(self):
+        self.assertEqual(datagram_stream.xor_frames([]), b"")
+
+    def test_pads_to_longest_frame(self):
+        self.assertEqual(
+            datagram_stream.xor_frames([b"\x01\x02", b"\x10\x20\x30", b"\x01"]),
+            b"\x10\x22\x30",
+        )
+
+    def test_recovers_frame(self):
+        frames = [b"foo", b"barbaz", b"", b"q"]
+        parity = datagram_stream.xor_frames(frames)
+        self.assertEqual(
+            datagram_stream.xor_frames([parity] + frames[:1] + frames[2:]),
+            b"barbaz",
+        )
+
+
+class TestDatagramStreamProtocolFEC(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.sender = datagram_stream.DatagramStreamProtocol(
+            1,
+            fec_group_size=4,
+        )
+        self.receiver = datagram_stream.DatagramStreamProtocol(
+            2,
+            fec_group_size=4,
+        )
+        self.drop = set()
+        self.packets = []
+        self.received = []
+        self.receiver.on_data_received.connect(self.received.append)
+
+        def make_transport(peer, addr):
+            transport = unittest.mock.Mock()
+
+            def sendto(packet, dest):
+                index = len(self.packets)
+                self.packets.append(packet)
+                if index not in self.drop:
+                    peer.datagram_received(packet, addr)
+
+            transport.sendto.side_effect = sendto
+            return transport
+
+        self.sender._transport = make_transport(self.receiver, "sender")
+        self.receiver._transport = make_transport(self.sender, "receiver")
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def _packet_type(self, packet):
+        return datagram_stream.PacketType(packet[1])
+
+    def test_negotiation(self):
+        self.sender.send_frame(b"\x00")
+
+        self.assertSequenceEqual(
+            [self._packet_type(packet) for packet in self.packets],
+            [
+                datagram_stream.PacketType.DATA,
+                datagram_stream.PacketType.DACK,
+                datagram_stream.PacketType.FEC_REQ,
+            ]
+        )
+        self.assertEqual(self.sender._tx_fec_group_size, 4)
+
+    def test_no_fec_without_request(self):
+        self.receiver._fec_group_size = None
+        for i in range(8):
+            self.sender.send_frame(bytes([i]))
+
+        self.assertEqual(self.sender.tx_fec_sent, 0)
+        self.assertNotIn(
+            datagram_stream.PacketType.FEC,
+            [self._packet_type(packet) for packet in self.packets],
+        )
+
+    def test_stops_requesting_from_peer_without_fec(self):
+        self.sender._fec_group_size = None
+        for i in range(30):
+            self.sender.send_frame(bytes([i]))
+
+        requests = [
+            packet for packet in self.packets
+            if self._packet_type(packet) ==
+            datagram_stream.PacketType.FEC_REQ
+        ]
+        self.assertEqual(
+            len(requests),
+            4 + datagram_stream.DatagramStreamProtocol.FEC_REQ_RETRIES,
+        )
+
+    def test_recovers_single_lost_frame(self):
+        self.sender.send_frame(b"\x00")
+        del self.received[:]
+
+        # drop the DATA packet of the last frame of the group, so that it
+        # cannot be recovered by piggybacking
+        for i in range(3):
+            self.sender.send_frame(bytes([i+1]) * (i+1))
+        self.drop.add(len(self.packets))
+        self.sender.send_frame(b"\x04\x04")
+
+        self.assertEqual(self.sender.tx_fec_sent, 1)
+        self.assertEqual(self.receiver.rx_fec_recovered, 1)
+        self.assertSequenceEqual(
+            self.received,
+            [b"\x01", b"\x02\x02", b"\x03\x03\x03", b"\x04\x04"],
+        )
+        self.assertEqual(self.sender.tx_buffer_size, 0)
+
+
+class TestDatagramStreamProtocolGiveUp(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.protocol = datagram_stream.DatagramStreamProtocol(1)
+        self.protocol._transport = unittest.mock.Mock()
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def _data(self, min_avail_sn, *sns):
+        return datagram_stream.common_header_fmt.pack(
+            0,
+            datagram_stream.PacketType.DATA.value,
+            1,
+            min_avail_sn,
+            0,
+            0,
+        ) + b"".join(
+            datagram_stream.data_entry_header_fmt.pack(sn, 1) + b"\x00"
+            for sn in sns
+        )
+
+    def test_counts_only_frames_never_received(self):
+        self.protocol.datagram_received(self._data(0, 0), "sender")
+        self.protocol.datagram_received(self._data(0, 3), "sender")
+        # 1, 2 and 4 are lost; 3 was received out of order and 5 is
+        # still available
+        self.protocol.datagram_received(self._data(5, 5), "sender")
+        self.assertEqual(self.protocol.rx_given_up_count, 3)
+
+
+class TestDatagramStreamProtocolWindow(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.sender = datagram_stream.DatagramStreamProtocol(
+            1,
+            retransmit_threshold=timedelta(seconds=0.01),
+            tx_max_buffer_size=16,
+            tx_initial_window=4,
+        )
+        self.receiver = datagram_stream.DatagramStreamProtocol(2)
+        self.link_up = True
+        self.received = []
+        self.receiver.on_data_received.connect(self.received.append)
+
+        def sender_sendto(packet, dest):
+            if self.link_up:
+                self.receiver.datagram_received(packet, "sender")
+
+        def receiver_sendto(packet, dest):
+            self.sender.datagram_received(packet, "receiver")
+
+        self.sender._transport = unittest.mock.Mock()
+        self.sender._transport.sendto.side_effect = sender_sendto
+        self.receiver._transport = unittest.mock.Mock()
+        self.receiver._transport.sendto.side_effect = receiver_sendto
+
+        # handshake; the first frame is only acknowledged with the second
+        self.sender.send_frame(b"\x00")
+        self.sender.send_frame(b"\x00")
+        del self.received[:]
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_window_grows_with_acks(self):
+        for i in range(32):
+            self.sender.send_frame(bytes([i]))
+            self.assertTrue(self.sender.writable)
+
+        self.assertGreater(self.sender.tx_window, 4)
+        self.assertEqual(self.sender.tx_dropped, 0)
+        self.assertEqual(len(self.received), 32)
+
+    def test_window_limits_unacked_frames(self):
+        on_pause = unittest.mock.Mock()
+        on_pause.return_value = None
+        self.sender.on_pause_writing.connect(on_pause)
+
+        self.link_up = False
+        for i in range(10):
+            self.sender.send_frame(bytes([i]))
+
+        self.assertEqual(self.sender.tx_buffer_size, 4)
+        self.assertEqual(self.sender.tx_pending_size, 6)
+        self.assertFalse(self.sender.writable)
+        on_pause.assert_called_once_with()
+
+    def test_overflow_drops_oldest_frame(self):
+        self.link_up = False
+        for i in range(20):
+            self.sender.send_frame(bytes([i]))
+
+        self.assertEqual(self.sender.tx_dropped, 4)
+        self.assertEqual(
+            self.sender.tx_buffer_size + self.sender.tx_pending_size,
+            16,
+        )
+
+    def test_drain_waits_for_feedback(self):
+        on_resume = unittest.mock.Mock()
+        on_resume.return_value = None
+        self.sender.on_resume_writing.connect(on_resume)
+
+        self.link_up = False
+        for i in range(6):
+            self.sender.send_frame(bytes([i+1]))
+
+        drain = asyncio.ensure_future(self.sender.drain())
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertFalse(drain.done())
+
+        self.link_up = True
+        self.loop.run_until_complete(asyncio.wait_for(drain, 1))
+
+        on_resume.assert_called_once_with()
+        self.assertEqual(self.sender.tx_pending_size, 0)
+        self.assertSequenceEqual(
+            self.received,
+            [bytes([i+1]) for i in range(6)],
+        )
+
+    def test_loss_shrinks_window(self):
+        for i in range(32):
+            self.sender.send_frame(bytes([i]))
+        window = self.sender.tx_window
+
+        self.link_up = False
+        self.sender.send_frame(b"lost")
+        self.link_up = True
+        self.sender.send_frame(b"next")
+
+        self.assertLess(self.sender.tx_window, window)
+
+    def test_register_metrics(self):
+        registry = metrics.Registry()
+        self.sender.register_metrics(registry)
+        self.receiver.register_metrics(registry, prefix="rx_")
+
+        self.sender.send_frame(b"\x01")
+
+        rendered = registry.render()
+        self.assertIn(
+            "\nsn2d_stream_tx_frames_total {}\n".format(self.sender.tx_sent),
+            rendered,
+        )
+        self.assertIn(
+            "\nsn2d_stream_tx_window {}\n".format(self.sender.tx_window),
+            rendered,
+        )
+        self.assertIn(
+            "\nrx_tx_acks_total {}\n".format(self.receiver.tx_ack_count),
+            rendered,
+        )
+        self.assertGreater(self.receiver.tx_ack_count, 0)
+        self.assertEqual(self.sender.rx_ack_count,
+                         self.receiver.tx_ack_count)
+        self.assertIn("sn2d_stream_app_request_latency_seconds_count 0\n",
+                      rendered)
+
+
+class TestDatagramDemultiplexer(unittest.TestCase):
+    def setUp(self):
+        self.protocols = {}
+        self.transport = unittest.mock.Mock()
+
+    def _factory(self, host):
+        if host == "192.0.2.99":
+            return None
+        protocol = unittest.mock.Mock()
+        self.protocols[host] = protocol
+        return protocol
+
+    def test_dispatches_by_host(self):
+        demux = datagram_stream.DatagramDemultiplexer(self._factory)
+        added = []
+        demux.on_peer_added.connect(
+            lambda host, protocol: added.append(host)
+        )
+        demux.connection_made(self.transport)
+
+        demux.datagram_received(b"a", ("192.0.2.1", 7285))
+        demux.datagram_received(b"b", ("192.0.2.2", 7285))
+        # a new source port does not create a new protocol
+        demux.datagram_received(b"c", ("192.0.2.1", 1234))
+
+        self.assertEqual(added, ["192.0.2.1", "192.0.2.2"])
+        first = self.protocols["192.0.2.1"]
+        first.connection_made.assert_called_once_with(self.transport)
+        self.assertEqual(first.datagram_received.mock_calls, [
+            unittest.mock.call(b"a", ("192.0.2.1", 7285)),
+            unittest.mock.call(b"c", ("192.0.2.1", 1234)),
+        ])
+        self.protocols["192.0.2.2"].datagram_received.assert_called_once_with(
+            b"b", ("192.0.2.2", 7285),
+        )
+        self.assertEqual(set(demux.peers), {"192.0.2.1", "192.0.2.2"})
+
+        demux.connection_lost(None)
+        first.connection_lost.assert_called_once_with(None)
+
+    def test_rejects_peers(self):
+        demux = datagram_stream.DatagramDemultiplexer(self._factory,
+                                                      max_peers=1)
+        demux.datagram_received(b"a", ("192.0.2.99", 7285))
+        demux.datagram_received(b"b", ("192.0.2.1", 7285))
+        demux.datagram_received(b"c", ("192.0.2.2", 7285))
+        self.assertEqual(set(self.protocols), {"192.0.2.1"})
+        self.assertEqual(demux.rejected, 2)
+
+        # protocols created before the transport get it later
+        demux.connection_made(self.transport)
+        self.protocols["192.0.2.1"].connection_made.assert_called_once_with(
+            self.transport,
+        )
+
+    def test_expires_idle_peers(self):
+        demux = datagram_stream.DatagramDemultiplexer(self._factory,
+                                                      idle_timeout=10)
+        removed = []
+        demux.on_peer_removed.connect(
+            lambda host, protocol: removed.append((host, protocol))
+        )
+        with unittest.mock.patch("time.monotonic") as monotonic:
+            monotonic.return_value = 100
+            demux.datagram_received(b"a", ("192.0.2.1", 7285))
+            demux.datagram_received(b"b", ("192.0.2.2", 7285))
+            monotonic.return_value = 105
+            demux.datagram_received(b"c", ("192.0.2.2", 7285))
+            self.assertEqual(demux.expire_idle(109), [])
+            self.assertEqual(demux.expire_idle(110), ["192.0.2.1"])
+
+        first = self.protocols["192.0.2.1"]
+        first.connection_lost.assert_called_once_with(None)
+        self.assertEqual(removed, [("192.0.2.1", first)])
+        self.assertEqual(set(demux.peers), {"192.0.2.2"})
+        self.assertEqual(demux.expired, 1)
+
+        # the peer gets a new protocol when it comes back
+        demux.datagram_received(b"d", ("192.0.2.1", 7285))
+        self.assertIsNot(self.protocols["192.0.2.1"], first)
+
+    def test_keeps_peers_without_idle_timeout(self):
+        demux = datagram_stream.DatagramDemultiplexer(self._factory)
+        demux.datagram_received(b"a", ("192.0.2.1", 7285))
+        self.assertEqual(demux.expire_idle(float("inf")), [])
+        self.assertEqual(set(demux.peers), {"192.0.2.1"})
+
+    def test_register_metrics(self):
+        demux = datagram_stream.DatagramDemultiplexer(self._factory)
+        demux.datagram_received(b"a", ("192.0.2.1", 7285))
+        demux.datagram_received(b"a", ("192.0.2.99", 7285))
+        registry = metrics.Registry()
+        demux.register_metrics(registry)
+        rendered = registry.render()
+        self.assertIn("\nsn2d_peers_known 1\n", rendered)
+        self.assertIn("\nsn2d_peers_rejected_datagrams_total 1\n", rendered)
+        self.assertIn("\nsn2d_peers_expired_total 0\n", rendered)
@@ -0,0 +1,216 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+import unittest
+import unittest.mock
+
+import sn2daemon.decode_pool as decode_pool
+import sn2daemon.metrics as metrics
+import sn2daemon.sbx_protocol as sbx_protocol
+
+from . import sbx_messages
+
+
+def slow_double(x, delay=0):
+    time.sleep(delay)
+    if x < 0:
+        raise ValueError(x)
+    return x * 2
+
+
+class TestDecodePool(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        self.results = []
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.loop.close()
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 5))
+
+    async def _create(self, func=slow_double, **kwargs):
+        pool = decode_pool.DecodePool(func, self.executor, **kwargs)
+        pool.on_result.connect(
+            lambda *args: self.results.append(args)
+        )
+        return pool
+
+    async def _wait_for(self, n):
+        while len(self.results) < n:
+            await asyncio.sleep(0.001)
+
+    def test_collects_inputs_of_one_iteration_into_a_batch(self):
+        async def test():
+            pool = await self._create(batch_size=10)
+            for i in range(4):
+                pool.submit(i, i)
+            await self._wait_for(4)
+            return pool
+
+        pool = self._run(test())
+        self.assertEqual(pool.batches, 1)
+        self.assertEqual(self.results, [(i, i*2, None) for i in range(4)])
+
+    def test_splits_batches_at_batch_size(self):
+        async def test():
+            pool = await self._create(batch_size=3)
+            for i in range(7):
+                pool.submit(i, i)
+            await self._wait_for(7)
+            return pool
+
+        pool = self._run(test())
+        self.assertEqual(pool.batches, 3)
+        self.assertEqual(pool.inputs, 7)
+        self.assertEqual(pool.processing_time.count, 3)
+        self.assertEqual(pool.queue_time.count, 3)
+
+    def test_delivers_in_submission_order(self):
+        async def test():
+            pool = await self._create(batch_size=1)
+            # the first batches take longest
+            for i in range(4):
+                pool.submit(i, i, (4 - i) * 0.02)
+            await self._wait_for(4)
+
+        self._run(test())
+        self.assertEqual([context for context, *_ in self.results],
+                         [0, 1, 2, 3])
+
+    def test_limits_batches_in_flight(self):
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def func(x):
+            with lock:
+                running.append(x)
+                max_running.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(x)
+            return x
+
+        async def test():
+            pool = await self._create(func, batch_size=1, max_in_flight=2)
+            for i in range(6):
+                pool.submit(i, i)
+            await asyncio.sleep(0)
+            self.assertEqual(pool.in_flight, 2)
+            self.assertEqual(pool.held, 4)
+            await self._wait_for(6)
+
+        self._run(test())
+        self.assertLessEqual(max(max_running), 2)
+
+    def test_drops_inputs_beyond_max_held(self):
+        event = threading.Event()
+
+        def func(x):
+            event.wait(5)
+            return x
+
+        async def test():
+            pool = await self._create(func, batch_size=1, max_in_flight=1,
+                                      max_held=2)
+            self.assertTrue(pool.submit(0, 0))
+            await asyncio.sleep(0)
+            self.assertEqual(pool.in_flight, 1)
+            self.assertTrue(pool.submit(1, 1))
+            self.assertTrue(pool.submit(2, 2))
+            self.assertFalse(pool.submit(3, 3))
+            self.assertEqual((pool.held, pool.dropped), (2, 1))
+            event.set()
+            await self._wait_for(3)
+            self.assertEqual(pool.held, 0)
+            self.assertTrue(pool.submit(4, 4))
+            await self._wait_for(4)
+            return pool
+
+        pool = self._run(test())
+        self.assertEqual([context for context, *_ in self.results],
+                         [0, 1, 2, 4])
+        registry = metrics.Registry()
+        pool.register_metrics(registry)
+        self.assertIn("\nsn2d_decode_pool_inputs_dropped_total 1\n",
+                      registry.render())
+
+    def test_reports_exceptions_per_input(self):
+        async def test():
+            pool = await self._create()
+            pool.submit("a", 1)
+            pool.submit("b", -1)
+            pool.submit("c", 2)
+            await self._wait_for(3)
+
+        self._run(test())
+        self.assertEqual(self.results[0], ("a", 2, None))
+        self.assertEqual(self.results[1][:2], ("b", None))
+        self.assertIsInstance(self.results[1][2], ValueError)
+        self.assertEqual(self.results[2], ("c", 4, None))
+
+    def test_close(self):
+        async def test():
+            pool = await self._create()
+            pool.submit("a", 1)
+            pool.close()
+            with self.assertRaises(RuntimeError):
+                pool.submit("b", 1)
+            await asyncio.sleep(0.01)
+
+        self._run(test())
+        self.assertEqual(self.results, [])
+
+    def test_register_metrics(self):
+        async def test():
+            return await self._create()
+
+        pool = self._run(test())
+        registry = metrics.Registry()
+        pool.register_metrics(registry)
+        rendered = registry.render()
+        self.assertIn("\nsn2d_decode_pool_batches_in_flight 0\n", rendered)
+        self.assertIn("sn2d_decode_pool_processing_seconds_count 0\n",
+                      rendered)
+
+
+class TestProcessPool(unittest.TestCase):
+    def test_decodes_data_frames(self):
+        buf = sbx_messages.pack_status(6)
+        loop = asyncio.new_event_loop()
+        results = []
+
+        async def test():
+            pool = decode_pool.DecodePool.create(
+                sbx_protocol.decode_data_frame,
+                "process",
+                1,
+            )
+            pool.on_result.connect(lambda *args: results.append(args))
+            try:
+                pool.submit("status", sbx_protocol.DataFrameType.SBX,
+                            None, buf)
+                while not results:
+                    await asyncio.sleep(0.01)
+            finally:
+                pool.close()
+
+        try:
+            loop.run_until_complete(asyncio.wait_for(test(), 30))
+        finally:
+            loop.close()
+
+        (context, obj, exc), = results
+        self.assertIsNone(exc)
+        self.assertEqual(context, "status")
+        expected = sbx_protocol.decode_sbx_message(buf)
+        self.assertEqual(obj.uptime, expected.uptime)
+        self.assertEqual(obj.v6_cpu_metrics, expected.v6_cpu_metrics)
+
+    def test_rejects_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            decode_pool.DecodePool.create(slow_double, "fiber")
@@ -0,0 +1,34 @@
+import asyncio
+import unittest
+import unittest.mock
+
+import sn2daemon.event_loop as event_loop
+
+
+class Testnew_event_loop(unittest.TestCase):
+    def test_asyncio(self):
+        loop = event_loop.new_event_loop("asyncio")
+        self.addCleanup(loop.close)
+        self.assertIsInstance(loop, asyncio.AbstractEventLoop)
+
+    def test_rejects_unknown_implementation(self):
+        with self.assertRaises(ValueError):
+            event_loop.new_event_loop("tokio")
+
+    def test_falls_back_without_uvloop(self):
+        logger = unittest.mock.Mock()
+        with unittest.mock.patch.object(event_loop, "uvloop", None):
+            loop = event_loop.new_event_loop("uvloop", logger=logger)
+            self.addCleanup(loop.close)
+            auto_loop = event_loop.new_event_loop("auto", logger=logger)
+            self.addCleanup(auto_loop.close)
+        self.assertIsInstance(loop, asyncio.BaseEventLoop)
+        self.assertIsInstance(auto_loop, asyncio.BaseEventLoop)
+        logger.warning.assert_called_once()
+
+    def test_uses_uvloop(self):
+        uvloop = unittest.mock.Mock()
+        uvloop.__version__ = "0.17.0"
+        with unittest.mock.patch.object(event_loop, "uvloop", uvloop):
+            loop = event_loop.new_event_loop("auto")
+        self.assertIs(loop, uvloop.new_event_loop())
@@ -0,0 +1,98 @@
+import unittest
+import unittest.mock
+
+from datetime import datetime, timedelta
+
+import sn2daemon.health as health
+import sn2daemon.metrics as metrics
+import sn2daemon.sbx_protocol as sbx_protocol
+
+from . import sbx_messages
+
+
+def status(version, **kwargs):
+    return sbx_protocol.decode_sbx_message(
+        sbx_messages.pack_status(version, **kwargs)
+    )
+
+
+class Teststatus_values(unittest.TestCase):
+    def test_v1_has_no_values(self):
+        values = health.status_values(status(1))
+        self.assertEqual(set(values), {name for name, *_ in health.FAMILIES})
+        self.assertFalse(any(values.values()))
+
+    def test_v4(self):
+        values = health.status_values(status(4))
+        self.assertEqual(values["i2c_transaction_overruns"],
+                         {("1",): 2, ("2",): 3})
+        self.assertEqual(values["bme280_timeouts"],
+                         {("0",): 20, ("1",): 1204})
+        self.assertEqual(values["bme280_configure_status"],
+                         {("0",): 0x12, ("1",): 0x34})
+
+    def test_v5_cpu_percent_from_previous_status(self):
+        previous = status(5, uptime=1000)
+        current = status(5, uptime=1100)
+        self.assertEqual(health.status_values(current)["cpu_percent"], {})
+
+        values = health.status_values(current, previous)
+        self.assertEqual(values["tx_buffers"], {
+            ("allocated",): 102,
+            ("most_allocated",): 101,
+            ("ready",): 103,
+            ("total",): 104,
+        })
+        # the tick counters did not change between the two messages
+        self.assertEqual(values["cpu_percent"][("idle", "")], 0)
+        self.assertEqual(len(values["cpu_percent"]), 4)
+
+    def test_v6_cpu_percent_sums_to_100(self):
+        values = health.status_values(status(6))
+        cpu = values["cpu_percent"]
+        self.assertAlmostEqual(sum(cpu.values()), 100)
+        self.assertIn(("idle", ""), cpu)
+        self.assertIn(("sched", ""), cpu)
+
+    def test_health_batches(self):
+        values = health.status_values(status(4))
+        batches = health.health_batches(datetime(2020, 1, 1), values)
+        self.assertEqual(
+            sorted(batch.bare_path.instance for batch in batches),
+            ["bme280_configure_status", "bme280_timeouts",
+             "i2c_transaction_overruns"],
+        )
+        for batch in batches:
+            self.assertEqual(batch.bare_path.part, health.HEALTH_PART)
+            if batch.bare_path.instance == "bme280_timeouts":
+                self.assertEqual(batch.samples, {"0": 20, "1": 1204})
+
+
+class TestHealthExporter(unittest.TestCase):
+    def test_does_nothing_without_consumers(self):
+        exporter = health.HealthExporter()
+        msg = status(6)
+        exporter.submit(datetime(2020, 1, 1), msg)
+        self.assertEqual(exporter.exports, 0)
+        # the health sections were not even decoded
+        self.assertIsNotNone(msg._pending_sections)
+
+    def test_exports_at_interval(self):
+        sink = unittest.mock.Mock()
+        exporter = health.HealthExporter(30, sinks=[sink])
+        t0 = datetime(2020, 1, 1)
+        for i in range(7):
+            exporter.submit(t0 + timedelta(seconds=10 * i), status(6))
+        self.assertEqual(exporter.exports, 3)
+        self.assertEqual(sink.submit_batches.call_count, 3)
+
+    def test_register_metrics(self):
+        exporter = health.HealthExporter(0)
+        registry = metrics.Registry()
+        exporter.register_metrics(registry)
+        self.assertTrue(exporter.has_consumers)
+        exporter.submit(datetime(2020, 1, 1), status(4))
+        rendered = registry.render()
+        self.assertIn('sn2d_node_bme280_timeouts{instance="1"} 1204\n',
+                      rendered)
+        self.assertIn("\nsn2d_node_health_exports_total 1\n", rendered)
@@ -0,0 +1,91 @@
+import logging
+import os
+import tempfile
+import unittest
+
+import sn2daemon.holdback as holdback
+import sn2daemon.metrics as metrics
+
+
+class TestHoldbackQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.logger = logging.getLogger("test_holdback")
+        self.logger.disabled = True
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _queue(self, **kwargs):
+        queue = holdback.HoldbackQueue(spool_dir=self.tmpdir.name,
+                                       logger=self.logger,
+                                       **kwargs)
+        self.addCleanup(queue.close)
+        return queue
+
+    def _hold(self, queue, values):
+        for value in values:
+            queue.hold(("decoded", value), str(value).encode())
+
+    def _decode(self, frame):
+        return ("spilled", int(frame))
+
+    def test_holds_in_memory_up_to_limit(self):
+        queue = self._queue(max_held=4)
+        self._hold(queue, range(3))
+        self.assertEqual(queue.held, 3)
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(list(queue.drain(self._decode)),
+                         [("decoded", i) for i in range(3)])
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.spilled, 0)
+
+    def test_spills_beyond_limit_and_drains_in_order(self):
+        queue = self._queue(max_held=2)
+        self._hold(queue, range(5))
+        self.assertEqual(queue.held, 2)
+        self.assertEqual(queue.spilled, 3)
+        self.assertEqual(len(queue), 5)
+        # the spill file is unlinked right away
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+        self.assertEqual(
+            list(queue.drain(self._decode)),
+            [("decoded", 0), ("decoded", 1),
+             ("spilled", 2), ("spilled", 3), ("spilled", 4)],
+        )
+        self.assertEqual(len(queue), 0)
+
+        self._hold(queue, [5])
+        self.assertEqual(queue.held, 1)
+
+    def test_drops_when_spool_is_full(self):
+        queue = self._queue(max_held=1, spool_size=6)
+        self._hold(queue, range(4))
+        self.assertEqual(queue.spilled, 2)
+        self.assertEqual(queue.dropped, 1)
+        self.assertEqual(len(list(queue.drain(self._decode))), 3)
+
+    def test_drops_without_frame_or_spool(self):
+        queue = self._queue(max_held=1, spool_size=0)
+        self._hold(queue, range(3))
+        queue.hold("x")
+        self.assertEqual(queue.dropped, 3)
+        self.assertEqual(queue.spilled, 0)
+
+    def test_skips_undecodable_frames(self):
+        queue = self._queue(max_held=0)
+        queue.hold(None, b"1")
+        queue.hold(None, b"x")
+        queue.hold(None, b"3")
+        self.assertEqual(list(queue.drain(self._decode)),
+                         [("spilled", 1), ("spilled", 3)])
+
+    def test_register_metrics(self):
+        queue = self._queue(max_held=1, spool_size=0)
+        self._hold(queue, range(2))
+        registry = metrics.Registry()
+        queue.register_metrics(registry)
+        rendered = registry.render()
+        self.assertIn("\nsn2d_holdback_held 1\n", rendered)
+        self.assertIn("\nsn2d_holdback_dropped_total 1\n", rendered)
@@ -0,0 +1,188 @@
+import asyncio
+import math
+import os
+import tempfile
+import unittest
+
+import sn2daemon.metrics as metrics
+
+
+class TestHistogram(unittest.TestCase):
+    def test_iter_cumulative(self):
+        h = metrics.Histogram([1, 0.5])
+        for value in [0.1, 0.5, 0.7, 3]:
+            h.observe(value)
+
+        self.assertSequenceEqual(
+            list(h.iter_cumulative()),
+            [(0.5, 2), (1, 3), (math.inf, 4)],
+        )
+        self.assertEqual(h.count, 4)
+        self.assertAlmostEqual(h.sum, 4.3)
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.r = metrics.Registry()
+
+    def test_counter_and_gauge(self):
+        c = self.r.counter("foo_total", "Some foos")
+        g = self.r.gauge("bar", "The bar")
+        c.inc()
+        c.inc(2)
+        g.set(10)
+        g.dec(0.5)
+
+        self.assertEqual(
+            self.r.render(),
+            "# HELP foo_total Some foos\n"
+            "# TYPE foo_total counter\n"
+            "foo_total 3\n"
+            "# HELP bar The bar\n"
+            "# TYPE bar gauge\n"
+            "bar 9.5\n"
+        )
+
+    def test_rejects_duplicate_names(self):
+        self.r.counter("foo", "")
+        with self.assertRaisesRegex(ValueError, "duplicate metric"):
+            self.r.gauge("foo", "")
+
+    def test_func_metrics_are_read_on_render(self):
+        value = [1]
+        self.r.gauge_func("x", "x", lambda: value[0])
+        self.assertIn("\nx 1\n", self.r.render())
+        value[0] = 2
+        self.assertIn("\nx 2\n", self.r.render())
+
+    def test_labels(self):
+        self.r.counter_func(
+            "msgs_total", "Messages",
+            lambda: {("a",): 1, ('q"\\',): 2},
+            label_names=("type",),
+        )
+        rendered = self.r.render()
+        self.assertIn('msgs_total{type="a"} 1\n', rendered)
+        self.assertIn('msgs_total{type="q\\"\\\\"} 2\n', rendered)
+
+    def test_histogram(self):
+        h = self.r.histogram("lat_seconds", "Latency", [0.1, 1])
+        h.observe(0.05)
+        h.observe(2)
+        self.assertIn(
+            'lat_seconds_bucket{le="0.1"} 1\n'
+            'lat_seconds_bucket{le="1"} 1\n'
+            'lat_seconds_bucket{le="+Inf"} 2\n'
+            'lat_seconds_sum 2.05\n'
+            'lat_seconds_count 2\n',
+            self.r.render(),
+        )
+
+    def test_failing_func_is_skipped(self):
+        def fail():
+            raise RuntimeError()
+
+        self.r.gauge_func("a", "", fail)
+        self.r.gauge_func("b", "", lambda: 1)
+        rendered = self.r.render()
+        self.assertNotIn("\na ", rendered)
+        self.assertIn("\nb 1\n", rendered)
+
+    def test_unregister_prefix(self):
+        self.r.counter("x_a", "")
+        self.r.counter("x_b", "")
+        self.r.counter("y", "")
+        self.r.unregister_prefix("x_")
+        self.assertNotIn("x_a", self.r)
+        self.assertNotIn("x_b", self.r)
+        self.assertIn("y", self.r)
+
+    def test_labelled(self):
+        a = self.r.labelled(node="a")
+        b = self.r.labelled(node="b")
+        a.counter_func("rx_total", "Received", lambda: 1)
+        b.counter_func("rx_total", "Received", lambda: 2)
+        a.gauge_func("q", "Queues", lambda: {("x",): 3},
+                     label_names=("queue",))
+        a.histogram("lat_seconds", "Latency", [1]).observe(0.5)
+        rendered = self.r.render()
+        self.assertEqual(rendered.count("# TYPE rx_total counter\n"), 1)
+        self.assertIn('rx_total{node="a"} 1\n'
+                      'rx_total{node="b"} 2\n', rendered)
+        self.assertIn('q{node="a",queue="x"} 3\n', rendered)
+        self.assertIn(
+            'lat_seconds_bucket{node="a",le="1"} 1\n'
+            'lat_seconds_bucket{node="a",le="+Inf"} 1\n'
+            'lat_seconds_sum{node="a"} 0.5\n'
+            'lat_seconds_count{node="a"} 1\n',
+            rendered,
+        )
+
+    def test_labelled_rejects_duplicates(self):
+        a = self.r.labelled(node="a")
+        a.counter("x", "")
+        with self.assertRaisesRegex(ValueError, "duplicate metric"):
+            a.counter("x", "")
+        with self.assertRaisesRegex(ValueError, "duplicate metric"):
+            self.r.labelled(other="b").counter("x", "")
+        self.r.counter("y", "")
+        with self.assertRaisesRegex(ValueError, "duplicate metric"):
+            a.counter("y", "")
+
+    def test_labelled_unregister_all(self):
+        a = self.r.labelled(node="a")
+        b = self.r.labelled(node="b")
+        a.counter("x", "")
+        a.counter("y", "")
+        b.counter("x", "")
+        a.unregister_all()
+        self.assertNotIn("y", self.r)
+        rendered = self.r.render()
+        self.assertNotIn('node="a"', rendered)
+        self.assertIn('x{node="b"} 0\n', rendered)
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.r = metrics.Registry()
+        self.r.counter("foo_total", "").inc(5)
+
+    def tearDown(self):
+        self.loop.close()
+
+    async def _scrape(self, **kwargs):
+        server = await metrics.start_server(self.r, **kwargs)
+        try:
+            if "path" in kwargs:
+                reader, writer = await asyncio.open_unix_connection(
+                    kwargs["path"]
+                )
+            else:
+                port = server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection(
+                    "127.0.0.1", port
+                )
+            writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+            return response
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    def test_tcp(self):
+        response = self.loop.run_until_complete(self._scrape(port=0))
+        head, body = response.split(b"\r\n\r\n", 1)
+        self.assertTrue(head.startswith(b"HTTP/1.0 200 OK\r\n"))
+        self.assertIn(b"\nfoo_total 5\n", body)
+
+    def test_unix(self):
+        with tempfile.TemporaryDirectory() as dir_:
+            path = os.path.join(dir_, "metrics.sock")
+            response = self.loop.run_until_complete(self._scrape(path=path))
+        self.assertIn(b"\nfoo_total 5\n", response)
+
+    def test_requires_address(self):
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(metrics.start_server(self.r))
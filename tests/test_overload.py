@@ -0,0 +1,380 @@
+import asyncio
+import logging
+import pathlib
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+from datetime import datetime
+
+import sn2daemon.metrics as metrics
+import sn2daemon.overload as overload
+import sn2daemon.sbx_protocol as sbx_protocol
+
+from . import sbx_messages
+
+
+class FakeMonitor:
+    def __init__(self, lag=0.0):
+        self.lag = lag
+
+
+class TestFrameSpool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.tmpdir.name) / "spool"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_roundtrip_in_order(self):
+        spool = overload.FrameSpool(self.path)
+        frames = [bytes([i]) * (i + 1) for i in range(5)]
+        for frame in frames:
+            self.assertTrue(spool.append(frame))
+        self.assertEqual(len(spool), sum(len(f) + 2 for f in frames))
+
+        self.assertEqual(spool.read(2), frames[:2])
+        spool.append(b"late")
+        self.assertEqual(spool.read(10), frames[2:] + [b"late"])
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(self.path.stat().st_size, 0)
+        spool.close()
+
+    def test_rejects_frames_beyond_max_size(self):
+        spool = overload.FrameSpool(self.path, max_size=10)
+        self.assertTrue(spool.append(b"12345678"))
+        self.assertFalse(spool.append(b"x"))
+        self.assertEqual(spool.read(10), [b"12345678"])
+        spool.close()
+
+    def test_keeps_frames_from_previous_run(self):
+        spool = overload.FrameSpool(self.path)
+        spool.append(b"foo")
+        spool.close()
+
+        spool = overload.FrameSpool(self.path)
+        self.assertEqual(spool.read(10), [b"foo"])
+        spool.close()
+
+
+class TestOverloadController(unittest.TestCase):
+    def setUp(self):
+        self.monitor = FakeMonitor()
+        self.logger = logging.getLogger("test_overload")
+        self.logger.disabled = True
+
+    def _controller(self, **kwargs):
+        kwargs.setdefault("lag_threshold", 0.25)
+        return overload.OverloadController(
+            monitor=self.monitor,
+            logger=self.logger,
+            **kwargs
+        )
+
+    def test_never_overloaded_without_threshold(self):
+        controller = self._controller(lag_threshold=None)
+        self.monitor.lag = 10.0
+        self.assertFalse(controller.overloaded)
+        self.assertEqual(controller.decide("SENSOR_STREAM_ACCEL_X"),
+                         overload.Action.KEEP)
+
+    def test_keeps_everything_without_overload(self):
+        controller = self._controller()
+        for _ in range(10):
+            self.assertEqual(controller.decide("SENSOR_STREAM_ACCEL_X"),
+                             overload.Action.KEEP)
+        self.assertFalse(controller.decisions)
+        self.assertEqual(controller.overload_episodes, 0)
+
+    def test_decimates(self):
+        controller = self._controller(
+            policy={"SENSOR_LIGHT": overload.Action.DECIMATE},
+            decimation=4,
+        )
+        self.monitor.lag = 1.0
+        actions = [controller.decide("SENSOR_LIGHT") for _ in range(8)]
+        self.assertEqual(actions.count(overload.Action.KEEP), 2)
+        self.assertEqual(actions.count(overload.Action.DROP), 6)
+        self.assertEqual(
+            controller.decide("STATUS"),
+            overload.Action.KEEP,
+        )
+        self.assertEqual(controller.decisions, {
+            ("SENSOR_LIGHT", "keep"): 2,
+            ("SENSOR_LIGHT", "decimated"): 6,
+            ("STATUS", "keep"): 1,
+        })
+        self.assertEqual(controller.overload_episodes, 1)
+
+    def test_decimates_in_runs(self):
+        controller = self._controller(
+            policy={"SENSOR_STREAM_ACCEL_X": overload.Action.DECIMATE},
+            decimation=2,
+            decimation_run=3,
+        )
+        self.monitor.lag = 1.0
+        self.assertEqual(
+            [controller.decide("SENSOR_STREAM_ACCEL_X") for _ in range(8)],
+            [overload.Action.KEEP] * 3 + [overload.Action.DROP] * 3 +
+            [overload.Action.KEEP] * 2,
+        )
+
+    def test_default_policy_defers_streams(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            spool = overload.FrameSpool(pathlib.Path(tmpdir) / "spool")
+            self.addCleanup(spool.close)
+            controller = self._controller(spool=spool)
+            self.monitor.lag = 1.0
+            self.assertEqual(controller.decide("SENSOR_STREAM_COMPASS_Z"),
+                             overload.Action.DEFER)
+            self.assertEqual(controller.decide("STATUS"),
+                             overload.Action.KEEP)
+
+    def test_queue_threshold(self):
+        depth = 0
+        controller = self._controller(
+            queue_threshold=10,
+            policy={"SENSOR_LIGHT": overload.Action.DROP},
+        )
+        controller.add_queue("q", lambda: depth)
+        controller.add_queue("unknown", lambda: None)
+        self.assertEqual(controller.decide("SENSOR_LIGHT"),
+                         overload.Action.KEEP)
+        depth = 11
+        self.assertEqual(controller.decide("SENSOR_LIGHT"),
+                         overload.Action.DROP)
+        depth = 0
+        self.assertFalse(controller.overloaded)
+        depth = 11
+        self.assertTrue(controller.overloaded)
+        self.assertEqual(controller.overload_episodes, 2)
+        self.assertEqual(controller.decisions,
+                         {("SENSOR_LIGHT", "dropped"): 1})
+
+    def test_defer_without_spool_keeps(self):
+        self.logger.disabled = False
+        with self.assertLogs(self.logger, "WARNING") as cm:
+            controller = self._controller(
+                policy={"SENSOR_LIGHT": overload.Action.DEFER},
+            )
+        self.assertIn("SENSOR_LIGHT", cm.output[0])
+        self.monitor.lag = 1.0
+        self.assertEqual(
+            [controller.decide("SENSOR_LIGHT") for _ in range(4)],
+            [overload.Action.KEEP] * 4,
+        )
+
+    def test_defer_and_take_deferred(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            spool = overload.FrameSpool(pathlib.Path(tmpdir) / "spool",
+                                        max_size=8)
+            controller = self._controller(
+                policy={"SENSOR_LIGHT": overload.Action.DEFER},
+                spool=spool,
+            )
+            self.monitor.lag = 1.0
+            for frame in [b"a", b"b", b"c"]:
+                self.assertEqual(controller.decide("SENSOR_LIGHT"),
+                                 overload.Action.DEFER)
+                controller.defer("SENSOR_LIGHT", frame)
+            self.assertEqual(controller.take_deferred(10), [])
+
+            self.monitor.lag = 0.0
+            # still deferred, to stay behind the spooled frames
+            self.assertEqual(controller.decide("SENSOR_LIGHT"),
+                             overload.Action.DEFER)
+            self.assertEqual(controller.take_deferred(10), [b"a", b"b"])
+            self.assertFalse(controller.has_deferred)
+            self.assertEqual(controller.decide("SENSOR_LIGHT"),
+                             overload.Action.KEEP)
+            spool.close()
+
+        self.assertEqual(controller.decisions, {
+            ("SENSOR_LIGHT", "deferred"): 2,
+            ("SENSOR_LIGHT", "dropped"): 1,
+        })
+
+    def test_register_metrics(self):
+        controller = self._controller(
+            policy={"SENSOR_STREAM_ACCEL_X": overload.Action.DECIMATE},
+        )
+        self.monitor.lag = 1.0
+        controller.decide("SENSOR_STREAM_ACCEL_X")
+        controller.decide("SENSOR_STREAM_ACCEL_X")
+        registry = metrics.Registry()
+        controller.register_metrics(registry)
+        rendered = registry.render()
+        self.assertIn(
+            'sn2d_overload_decisions_total{type="SENSOR_STREAM_ACCEL_X",'
+            'outcome="decimated"} 1\n',
+            rendered,
+        )
+        self.assertIn("\nsn2d_overload_active 1\n", rendered)
+        self.assertIn("\nsn2d_overload_loop_lag_seconds 1.0\n", rendered)
+
+
+class TestLoopLagMonitor(unittest.TestCase):
+    def test_measures_blocked_loop(self):
+        loop = asyncio.new_event_loop()
+        try:
+            monitor = overload.LoopLagMonitor(0.01, loop=loop)
+            monitor.start()
+            loop.call_soon(time.sleep, 0.1)
+            loop.run_until_complete(asyncio.sleep(0.15))
+            monitor.stop()
+        finally:
+            loop.close()
+        self.assertGreater(monitor.max_lag, 0.05)
+        self.assertGreaterEqual(monitor.lag_histogram.count, 2)
+
+    def test_logs_stack_of_blocking_callback(self):
+        def blocking_callback():
+            time.sleep(0.2)
+
+        logger = unittest.mock.Mock()
+        loop = asyncio.new_event_loop()
+        try:
+            monitor = overload.LoopLagMonitor(0.01, loop=loop,
+                                              slow_threshold=0.05,
+                                              logger=logger)
+            monitor.start()
+            loop.call_later(0.02, blocking_callback)
+            loop.run_until_complete(asyncio.sleep(0.3))
+            monitor.stop()
+        finally:
+            loop.close()
+
+        self.assertEqual(monitor.slow_callbacks, 1)
+        (_, (fmt, stalled, stack), _), = logger.warning.mock_calls
+        self.assertGreaterEqual(stalled, 0.05)
+        self.assertIn("blocking_callback", stack)
+
+    def test_register_metrics(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        monitor = overload.LoopLagMonitor(loop=loop)
+        monitor.lag_histogram.observe(0.003)
+        monitor.max_lag = 0.003
+        registry = metrics.Registry()
+        monitor.register_metrics(registry)
+        rendered = registry.render()
+        self.assertIn('\nsn2d_loop_lag_seconds_bucket{le="0.005"} 1\n',
+                      rendered)
+        self.assertIn("\nsn2d_loop_max_lag_seconds 0.003\n", rendered)
+        self.assertIn("\nsn2d_loop_slow_callbacks_total 0\n", rendered)
+
+
+class TestSBXClientShedding(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        self.loop.close()
+
+    def _frame(self, rtc, buf):
+        return sbx_protocol.data_frame_header_fmt.pack(
+            rtc,
+            sbx_protocol.DataFrameType.SBX.value,
+        ) + buf
+
+    def test_defers_and_replays_in_order(self):
+        monitor = FakeMonitor(lag=1.0)
+        spool = overload.FrameSpool(pathlib.Path(self.tmpdir.name) / "spool")
+        self.addCleanup(spool.close)
+        logger = logging.getLogger("test_overload")
+        logger.disabled = True
+        controller = overload.OverloadController(
+            monitor=monitor,
+            lag_threshold=0.25,
+            policy={"SENSOR_LIGHT": overload.Action.DEFER,
+                    "SENSOR_NOISE": overload.Action.DROP},
+            spool=spool,
+            logger=logger,
+        )
+        received = []
+
+        async def test():
+            client = sbx_protocol.SBXClient(
+                unittest.mock.Mock(),
+                overload=controller,
+            )
+            client.REPLAY_RETRY = 0.001
+            client.on_message.connect(
+                lambda rtc, obj: received.append((rtc, obj.type_))
+            )
+            try:
+                client._on_datagram(self._frame(1, sbx_messages.pack_light()))
+                client._on_datagram(self._frame(2, sbx_messages.pack_noise()))
+                client._on_datagram(self._frame(3, sbx_messages.pack_light()))
+                client._on_datagram(
+                    self._frame(4, sbx_messages.pack_bme280())
+                )
+                await asyncio.sleep(0.01)
+                self.assertEqual(len(received), 1)
+                monitor.lag = 0.0
+                while len(received) < 3:
+                    await asyncio.sleep(0.001)
+            finally:
+                client._resync_task.cancel()
+
+        self.loop.run_until_complete(asyncio.wait_for(test(), 5))
+        self.assertEqual(received, [
+            (datetime.utcfromtimestamp(4),
+             sbx_protocol.MsgType.SENSOR_BME280),
+            (datetime.utcfromtimestamp(1),
+             sbx_protocol.MsgType.SENSOR_LIGHT),
+            (datetime.utcfromtimestamp(3),
+             sbx_protocol.MsgType.SENSOR_LIGHT),
+        ])
+        self.assertEqual(controller.decisions, {
+            ("SENSOR_LIGHT", "deferred"): 2,
+            ("SENSOR_NOISE", "dropped"): 1,
+            ("SENSOR_BME280", "keep"): 1,
+        })
+
+    def test_replays_spool_from_previous_run(self):
+        path = pathlib.Path(self.tmpdir.name) / "spool"
+        spool = overload.FrameSpool(path)
+        spool.append(self._frame(1, sbx_messages.pack_light()))
+        spool.append(self._frame(2, sbx_messages.pack_light()))
+        spool.close()
+
+        spool = overload.FrameSpool(path)
+        self.addCleanup(spool.close)
+        logger = logging.getLogger("test_overload")
+        logger.disabled = True
+        controller = overload.OverloadController(
+            monitor=FakeMonitor(),
+            lag_threshold=0.25,
+            policy={"SENSOR_LIGHT": overload.Action.DEFER},
+            spool=spool,
+            logger=logger,
+        )
+        received = []
+
+        async def test():
+            client = sbx_protocol.SBXClient(
+                unittest.mock.Mock(),
+                overload=controller,
+            )
+            client.on_message.connect(
+                lambda rtc, obj: received.append((rtc, obj.type_))
+            )
+            try:
+                while len(received) < 2:
+                    await asyncio.sleep(0.001)
+            finally:
+                client._resync_task.cancel()
+
+        self.loop.run_until_complete(asyncio.wait_for(test(), 5))
+        self.assertEqual(received, [
+            (datetime.utcfromtimestamp(1),
+             sbx_protocol.MsgType.SENSOR_LIGHT),
+            (datetime.utcfromtimestamp(2),
+             sbx_protocol.MsgType.SENSOR_LIGHT),
+        ])
+        self.assertFalse(controller.has_deferred)
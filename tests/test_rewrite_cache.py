@@ -0,0 +1,155 @@
+import unittest
+
+import sn2daemon.metrics as metrics
+import sn2daemon.rewrite_cache as rewrite_cache
+
+from hintlib import sample
+
+
+class RecordingRewriter:
+    def __init__(self, func):
+        self.func = func
+        self.calls = []
+
+    def rewrite(self, item):
+        self.calls.append(item)
+        return self.func(item)
+
+
+def rewrite_sample(s):
+    if s.sensor.instance == "renamed":
+        return s.replace(sensor=s.sensor.replace(instance="new"))
+    if s.sensor.instance == "scaled":
+        return s.replace(value=s.value * 10)
+    if s.sensor.instance == "dropped":
+        return None
+    return s
+
+
+def rewrite_batch(batch):
+    if batch.bare_path.instance == "renamed":
+        return sample.SampleBatch(
+            timestamp=batch.timestamp,
+            bare_path=batch.bare_path.replace(instance="new"),
+            samples=batch.samples,
+        )
+    if batch.bare_path.instance == "scaled":
+        return sample.SampleBatch(
+            timestamp=batch.timestamp,
+            bare_path=batch.bare_path,
+            samples={k: v * 10 for k, v in batch.samples.items()},
+        )
+    return batch
+
+
+def path(instance, subpart="temp"):
+    return sample.SensorPath("bme280", instance, subpart)
+
+
+class TestSampleRewriteCache(unittest.TestCase):
+    def setUp(self):
+        self.rewriter = RecordingRewriter(rewrite_sample)
+        self.cache = rewrite_cache.SampleRewriteCache(self.rewriter)
+
+    def _rewrite_twice(self, instance):
+        results = [
+            self.cache.rewrite(sample.Sample(ts, path(instance), ts * 1.5))
+            for ts in [1, 2]
+        ]
+        expected = [
+            rewrite_sample(sample.Sample(ts, path(instance), ts * 1.5))
+            for ts in [1, 2]
+        ]
+        self.assertEqual(results, expected)
+        return results
+
+    def test_pass_through_is_cached(self):
+        s = sample.Sample(2, path(0), 3.0)
+        self._rewrite_twice(0)
+        self.assertIs(self.cache.rewrite(s), s)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    def test_rename_is_cached(self):
+        self._rewrite_twice("renamed")
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_drop_is_cached(self):
+        for ts in [1, 2]:
+            self.assertIsNone(self.cache.rewrite(
+                sample.Sample(ts, path("dropped"), 1.0)
+            ))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_value_transform_is_not_cached(self):
+        self._rewrite_twice("scaled")
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+    def test_value_transform_with_fixed_point_first(self):
+        results = [
+            self.cache.rewrite(sample.Sample(ts, path("scaled"), value))
+            for ts, value in [(1, 0.0), (2, 5.0)]
+        ]
+        self.assertEqual([s.value for s in results], [0.0, 50.0])
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.max_size = 2
+        for instance in [0, 1, 0, 2]:
+            self.cache.rewrite(sample.Sample(1, path(instance), 1.0))
+        self.assertEqual(list(self.cache._outcomes), [path(0), path(2)])
+
+    def test_disabled(self):
+        self.cache.max_size = 0
+        self._rewrite_twice("renamed")
+        self.assertEqual(self.cache.misses, 2)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_reset(self):
+        self._rewrite_twice("renamed")
+        other = RecordingRewriter(lambda s: s)
+        self.cache.reset(other)
+        self.assertEqual(len(self.cache), 0)
+        s = sample.Sample(1, path("renamed"), 1.0)
+        self.assertIs(self.cache.rewrite(s), s)
+        self.assertEqual(other.calls[0], s)
+
+    def test_register_metrics(self):
+        self._rewrite_twice("renamed")
+        registry = metrics.Registry()
+        self.cache.register_metrics(registry)
+        rendered = registry.render()
+        self.assertIn("\nsn2d_rewrite_cache_sample_hits_total 1\n", rendered)
+        self.assertIn("\nsn2d_rewrite_cache_sample_paths 1\n", rendered)
+
+
+class TestBatchRewriteCache(unittest.TestCase):
+    def setUp(self):
+        self.rewriter = RecordingRewriter(rewrite_batch)
+        self.cache = rewrite_cache.BatchRewriteCache(self.rewriter)
+
+    def _batch(self, ts, instance):
+        return sample.SampleBatch(
+            timestamp=ts,
+            bare_path=path(instance, None),
+            samples={"temp": ts * 1.5, "pressure": ts * 2.5},
+        )
+
+    def test_caches_by_bare_path(self):
+        for instance, misses in [(0, 1), ("renamed", 1), ("scaled", 2)]:
+            self.cache.misses = 0
+            for ts in [1, 2]:
+                self.assertEqual(
+                    self.cache.rewrite(self._batch(ts, instance)),
+                    rewrite_batch(self._batch(ts, instance)),
+                )
+            self.assertEqual(self.cache.misses, misses, instance)
+
+    def test_value_transform_with_fixed_point_first(self):
+        first = sample.SampleBatch(
+            timestamp=1,
+            bare_path=path("scaled", None),
+            samples={"temp": 0.0},
+        )
+        self.cache.rewrite(first)
+        result = self.cache.rewrite(self._batch(2, "scaled"))
+        self.assertEqual(result.samples, {"temp": 30.0, "pressure": 50.0})
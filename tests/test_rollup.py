@@ -0,0 +1,110 @@
+import math
+import unittest
+import unittest.mock
+
+from datetime import datetime, timedelta
+
+import sn2daemon.metrics as metrics
+import sn2daemon.rollup as rollup
+
+from hintlib import sample
+
+
+ACCEL_X = sample.SensorPath(
+    sample.Part.LSM303D,
+    0,
+    sample.LSM303DSubpart("accel-x"),
+)
+
+
+class Testaggregate(unittest.TestCase):
+    def _check(self):
+        # 4 Hz, starting 0.5 s before a second boundary
+        start = 1577836800 - 0.5
+        windows = rollup.aggregate(start, 0.25, 1, [3, -4] + list(range(4)))
+        self.assertEqual(
+            [window[:3] for window in windows],
+            [(1577836799, 2, -4), (1577836800, 4, 0)],
+        )
+        self.assertEqual(windows[0].max, 3)
+        self.assertEqual(windows[0].sum, -1)
+        self.assertEqual(windows[0].sum_squares, 25)
+        self.assertEqual(windows[1].max, 3)
+        self.assertEqual(windows[1].sum, 6)
+
+    def test_numpy(self):
+        self._check()
+
+    def test_without_numpy(self):
+        with unittest.mock.patch.object(rollup, "numpy", None):
+            self._check()
+
+    def test_implementations_agree(self):
+        data = [(i * 7919) % 2001 - 1000 for i in range(5000)]
+        with unittest.mock.patch.object(rollup, "numpy", None):
+            expected = rollup.aggregate(1e9 + 0.3, 0.0125, 2, data)
+        self.assertEqual(rollup.aggregate(1e9 + 0.3, 0.0125, 2, data),
+                         expected)
+
+
+class TestRollup(unittest.TestCase):
+    def test_aggregates_windows_across_blocks(self):
+        r = rollup.Rollup([1, 60])
+        t0 = datetime(2020, 1, 1, 0, 0, 58)
+        period = timedelta(milliseconds=250)
+
+        # 1.5 s: one complete second, half of the next
+        batches = r.submit(ACCEL_X, t0, period, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(len(batches), 1)
+        batch, = batches
+        self.assertEqual(batch.timestamp, t0)
+        self.assertEqual(batch.bare_path,
+                         sample.SensorPath(rollup.ROLLUP_PART,
+                                           "lsm303d-0-1s", None))
+        self.assertEqual(batch.samples, {
+            "accel-x-min": 1,
+            "accel-x-max": 4,
+            "accel-x-mean": 2.5,
+            "accel-x-rms": math.sqrt(30 / 4),
+        })
+
+        # the rest of the minute, which completes both windows
+        batches = r.submit(ACCEL_X, t0 + 6 * period, period, [-7, 8])
+        self.assertEqual(
+            [(b.bare_path.instance, b.timestamp, b.samples["accel-x-max"])
+             for b in batches],
+            [("lsm303d-0-1s", datetime(2020, 1, 1, 0, 0, 59), 8),
+             ("lsm303d-0-60s", datetime(2020, 1, 1), 8)],
+        )
+        self.assertEqual(batches[0].samples["accel-x-min"], -7)
+        self.assertEqual(batches[1].samples["accel-x-mean"], 22 / 8)
+        self.assertEqual((r.windows, r.samples), (3, 8))
+
+    def test_emits_older_blocks_directly(self):
+        r = rollup.Rollup([10])
+        period = timedelta(seconds=1)
+        r.submit(ACCEL_X, datetime(2020, 1, 1, 0, 1), period, [1])
+        batches = r.submit(ACCEL_X, datetime(2020, 1, 1), period, [2, 3])
+        self.assertEqual([b.timestamp for b in batches],
+                         [datetime(2020, 1, 1)])
+        batches = r.submit(ACCEL_X, datetime(2020, 1, 1, 0, 1, 20),
+                           period, [4])
+        self.assertEqual([(b.timestamp, b.samples["accel-x-mean"])
+                          for b in batches],
+                         [(datetime(2020, 1, 1, 0, 1), 1)])
+
+    def test_rejects_invalid_resolutions(self):
+        with self.assertRaises(ValueError):
+            rollup.Rollup([])
+        with self.assertRaises(ValueError):
+            rollup.Rollup([0, 1])
+
+    def test_register_metrics(self):
+        r = rollup.Rollup([1])
+        r.submit(ACCEL_X, datetime(2020, 1, 1), timedelta(seconds=0.5),
+                 [1, 2])
+        registry = metrics.Registry()
+        r.register_metrics(registry)
+        rendered = registry.render()
+        self.assertIn("\nsn2d_rollup_windows_total 1\n", rendered)
+        self.assertIn("\nsn2d_rollup_samples_total 2\n", rendered)
@@ -1,5 +1,8 @@
+import asyncio
+import concurrent.futures
 import contextlib
 import os
+import struct
 import unittest
 import unittest.mock
 
@@ -7,10 +10,14 @@ from datetime import datetime, timedelta
 
 import hintlib.sample as sample
 
+import sn2daemon.datagram_stream as datagram_stream
+import sn2daemon.decode_pool as decode_pool
 import sn2daemon.sbx_protocol as sbx_protocol
 
 import _sn2d_comm
 
+from . import sbx_messages
+
 
 class TestStatusMessage(unittest.TestCase):
     def test_from_buf_v1(self):
@@ -495,6 +502,126 @@ class TestStatusMessage(unittest.TestCase):
         )
 
 
+    def _decode_by_sections(self, status_version, buf):
+        StatusMessage = sbx_protocol.StatusMessage
+        result = {}
+        if status_version >= 1:
+            buf, result["accel"] = \
+                StatusMessage.IMUStreamState.unpack_and_splice(
+                    status_version, buf)
+            buf, result["compass"] = \
+                StatusMessage.IMUStreamState.unpack_and_splice(
+                    status_version, buf)
+        if status_version >= 2:
+            result["i2c"] = []
+            for i in range(2):
+                buf, metrics = StatusMessage.I2CMetrics.unpack_and_splice(
+                    status_version, buf)
+                result["i2c"].append(metrics.transaction_overruns)
+            result["bme280"] = []
+            for i in range(2 if status_version >= 4 else 1):
+                buf, metrics = StatusMessage.BME280Metrics.unpack_and_splice(
+                    status_version, buf)
+                result["bme280"].append(
+                    (metrics.configure_status, metrics.timeouts)
+                )
+            if status_version < 4:
+                result["bme280"].append((0xff, 0))
+        if status_version >= 5:
+            buf, result["tx"] = StatusMessage.TXMetrics.unpack_and_splice(
+                status_version, buf)
+        if status_version == 5:
+            buf, result["tasks"] = \
+                StatusMessage.TasksMetrics.unpack_and_splice(
+                    status_version, buf)
+        if status_version >= 6:
+            buf, result["cpu"] = StatusMessage.CPUMetrics.unpack_and_splice(
+                status_version, buf)
+        return result
+
+    def test_compiled_decoders_match_section_decoders(self):
+        header = sbx_protocol.StatusMessage._base_header
+        for status_version in range(7):
+            payload = bytearray(
+                (i * 37 + status_version) & 0xff
+                for i in range(128)
+            )
+            if status_version == 5:
+                # task count
+                payload[30] = 3
+            buf = header.pack(1, 1234, 1, status_version) + bytes(payload)
+
+            result = sbx_protocol.StatusMessage.from_buf(
+                sbx_protocol.MsgType.STATUS,
+                buf,
+            )
+            expected = self._decode_by_sections(status_version,
+                                                bytes(payload))
+
+            self.assertEqual(result.uptime, 1234)
+            self.assertEqual(result.v1_accel_stream_state,
+                             expected.get("accel"))
+            self.assertEqual(result.v1_compass_stream_state,
+                             expected.get("compass"))
+            if status_version >= 2:
+                self.assertEqual(
+                    [m.transaction_overruns for m in result.v2_i2c_metrics],
+                    expected["i2c"],
+                )
+                self.assertEqual(
+                    [(m.configure_status, m.timeouts)
+                     for m in result.v4_bme280_metrics],
+                    expected["bme280"],
+                )
+                self.assertIs(result.v2_bme280_metrics,
+                              result.v4_bme280_metrics[0])
+            else:
+                self.assertIsNone(result.v2_i2c_metrics)
+            self.assertEqual(result.v5_tx_metrics, expected.get("tx"))
+            self.assertEqual(result.v5_task_metrics, expected.get("tasks"))
+            self.assertEqual(result.v6_cpu_metrics, expected.get("cpu"))
+
+    def test_diagnostic_sections_are_decoded_on_first_access(self):
+        header = sbx_protocol.StatusMessage._base_header
+        payload = bytearray(128)
+        payload[12] = 7
+        buf = header.pack(1, 1234, 1, 6) + bytes(payload)
+
+        result = sbx_protocol.StatusMessage.from_buf(
+            sbx_protocol.MsgType.STATUS,
+            buf,
+        )
+        self.assertEqual(result.v1_accel_stream_state, (0, 0, timedelta()))
+        self.assertIsNotNone(result._pending_sections)
+        self.assertNotIn("v2_i2c_metrics", result.__dict__)
+
+        self.assertEqual(result.v2_i2c_metrics[0].transaction_overruns, 7)
+        self.assertIsNone(result._pending_sections)
+        self.assertIsNotNone(result.v6_cpu_metrics)
+        self.assertIsNone(result.v5_task_metrics)
+
+    def test_diagnostic_sections_can_be_assigned(self):
+        header = sbx_protocol.StatusMessage._base_header
+        result = sbx_protocol.StatusMessage.from_buf(
+            sbx_protocol.MsgType.STATUS,
+            header.pack(1, 1234, 1, 5) + bytes(64),
+        )
+        result.v5_tx_metrics = unittest.mock.sentinel.tx_metrics
+        self.assertEqual(result.v5_tx_metrics,
+                         unittest.mock.sentinel.tx_metrics)
+        self.assertEqual(result.v5_task_metrics.tasks, ())
+
+    def test_from_buf_rejects_truncated_task_list(self):
+        header = sbx_protocol.StatusMessage._base_header
+        payload = bytearray(32)
+        payload[30] = 10
+        with self.assertRaises(struct.error):
+            sbx_protocol.StatusMessage.from_buf(
+                sbx_protocol.MsgType.STATUS,
+                header.pack(1, 1234, 1, 5) + bytes(payload),
+            )
+
+
 class TestDS18B20Message(unittest.TestCase):
     def setUp(self):
         self.msg = sbx_protocol.DS18B20Message(
@@ -635,6 +762,46 @@ class TestDS18B20Message(unittest.TestCase):
             ]
         )
 
+    def test_from_buf_with_and_without_numpy(self):
+        buf = (sbx_protocol.DS18B20Message._header.pack(12345) +
+               sbx_protocol.DS18B20Message._sample.pack(b"01234567", 1234) +
+               sbx_protocol.DS18B20Message._sample.pack(b"abc\0\0\0\0\0",
+                                                        -100) +
+               b"\x00")
+
+        with unittest.mock.patch.object(sbx_protocol, "numpy", None):
+            expected = sbx_protocol.DS18B20Message.from_buf(
+                sbx_protocol.MsgType.SENSOR_DS18B20, buf,
+            )
+        result = sbx_protocol.DS18B20Message.from_buf(
+            sbx_protocol.MsgType.SENSOR_DS18B20, buf,
+        )
+
+        self.assertEqual(result.timestamp, 12345)
+        self.assertEqual(result.samples, expected.samples)
+        self.assertSequenceEqual(list(result.get_samples()),
+                                 list(expected.get_samples()))
+
+    @unittest.skipIf(sbx_protocol.numpy is None, "requires NumPy")
+    def test_columns(self):
+        buf = (sbx_protocol.DS18B20Message._header.pack(12345) +
+               sbx_protocol.DS18B20Message._sample.pack(b"01234567", 1234) +
+               sbx_protocol.DS18B20Message._sample.pack(b"abcdefgh", -100))
+        result = sbx_protocol.DS18B20Message.from_buf(
+            sbx_protocol.MsgType.SENSOR_DS18B20, buf,
+        )
+
+        for msg in [result, self.msg]:
+            columns = msg.columns()
+            self.assertSequenceEqual(
+                columns["id"].tolist(),
+                [s.sensor.instance for s in msg.get_samples()],
+            )
+            self.assertSequenceEqual(
+                columns["value"].tolist(),
+                [s.value for s in msg.get_samples()],
+            )
+
 
 class TestNoiseMessage(unittest.TestCase):
     def setUp(self):
@@ -745,6 +912,35 @@ class TestNoiseMessage(unittest.TestCase):
             ]
         )
 
+    def test_from_buf_with_and_without_numpy(self):
+        buf = (sbx_protocol.NoiseMessage._header.pack(3) +
+               sbx_protocol.NoiseMessage._sample.pack(10, 2**24-1, -5, 7) +
+               sbx_protocol.NoiseMessage._sample.pack(20, 12345, 0, 32767))
+
+        with unittest.mock.patch.object(sbx_protocol, "numpy", None):
+            expected = sbx_protocol.NoiseMessage.from_buf(
+                sbx_protocol.MsgType.SENSOR_NOISE, buf,
+            )
+        result = sbx_protocol.NoiseMessage.from_buf(
+            sbx_protocol.MsgType.SENSOR_NOISE, buf,
+        )
+
+        self.assertEqual(result.samples, expected.samples)
+        self.assertSequenceEqual(list(result.get_samples()),
+                                 list(expected.get_samples()))
+
+    @unittest.skipIf(sbx_protocol.numpy is None, "requires NumPy")
+    def test_columns(self):
+        msg = sbx_protocol.NoiseMessage([
+            (10, 0.25, -32767, 0),
+            (20, 1.0, 0, 32767),
+        ])
+        columns = msg.columns()
+        self.assertSequenceEqual(columns["timestamp"].tolist(), [10, 20])
+        self.assertSequenceEqual(columns["rms"].tolist(), [0.5, 1.0])
+        self.assertSequenceEqual(columns["min"].tolist(), [-1.0, 0.0])
+        self.assertSequenceEqual(columns["max"].tolist(), [0.0, 1.0])
+
 
 class TestLightMessage(unittest.TestCase):
     def setUp(self):
@@ -900,6 +1096,35 @@ class TestLightMessage(unittest.TestCase):
             ]
         )
 
+    def test_from_buf_with_and_without_numpy(self):
+        buf = (sbx_protocol.LightMessage._sample.pack(10, 1, 2, 3, 4) +
+               sbx_protocol.LightMessage._sample.pack(20, 5, 6, 7, 65535))
+
+        with unittest.mock.patch.object(sbx_protocol, "numpy", None):
+            expected = sbx_protocol.LightMessage.from_buf(
+                sbx_protocol.MsgType.SENSOR_LIGHT, buf,
+            )
+        result = sbx_protocol.LightMessage.from_buf(
+            sbx_protocol.MsgType.SENSOR_LIGHT, buf,
+        )
+
+        self.assertEqual(result.samples, expected.samples)
+        self.assertSequenceEqual(list(result.get_samples()),
+                                 list(expected.get_samples()))
+
+    @unittest.skipIf(sbx_protocol.numpy is None, "requires NumPy")
+    def test_columns(self):
+        buf = (sbx_protocol.LightMessage._sample.pack(10, 1, 2, 3, 4) +
+               sbx_protocol.LightMessage._sample.pack(20, 5, 6, 7, 8))
+        result = sbx_protocol.LightMessage.from_buf(
+            sbx_protocol.MsgType.SENSOR_LIGHT, buf,
+        )
+        for msg in [result, sbx_protocol.LightMessage(result.samples)]:
+            columns = msg.columns()
+            self.assertSequenceEqual(columns["timestamp"].tolist(), [10, 20])
+            self.assertSequenceEqual(columns["channels"].tolist(),
+                                     [[1, 2, 3, 4], [5, 6, 7, 8]])
+
 
 class TestBME280Message(unittest.TestCase):
     def setUp(self):
@@ -1086,6 +1311,15 @@ class TestBME280Message(unittest.TestCase):
             ]
         )
 
+    def test_get_samples_reuses_paths(self):
+        other = sbx_protocol.BME280Message(1235, 23.5, 1234.6, 44.6)
+        self.assertSequenceEqual(
+            [s.sensor for s in self.msg.get_samples()],
+            [s.sensor for s in other.get_samples()],
+        )
+        for s1, s2 in zip(self.msg.get_samples(), other.get_samples()):
+            self.assertIs(s1.sensor, s2.sensor)
+
 
 class TestSensorStreamMessage(unittest.TestCase):
     def test_from_buf(self):
@@ -1381,3 +1615,270 @@ class Testdecode_message(unittest.TestCase):
         )
 
         self.assertEqual(from_buf(), result)
+
+
+class Testsensor_path(unittest.TestCase):
+    def test_returns_equal_path(self):
+        self.assertEqual(
+            sbx_protocol.sensor_path(
+                sample.Part.BME280,
+                1,
+                sample.BME280Subpart.TEMPERATURE,
+            ),
+            sample.SensorPath(
+                sample.Part.BME280,
+                1,
+                sample.BME280Subpart.TEMPERATURE,
+            ),
+        )
+
+    def test_interns_paths(self):
+        self.assertIs(
+            sbx_protocol.sensor_path(sample.Part.DS18B20, "abcd"),
+            sbx_protocol.sensor_path(sample.Part.DS18B20, "abcd"),
+        )
+
+
+class TestESPStatusMessage(unittest.TestCase):
+    def test_get_samples(self):
+        msg = sbx_protocol.ESPStatusMessage(
+            unittest.mock.sentinel.rtc,
+            1, 2, 3, 4, 5, 6, 7, 8,
+        )
+        msg.tx_error = None
+
+        self.assertSequenceEqual(
+            list(msg.get_samples()),
+            [
+                sample.Sample(
+                    unittest.mock.sentinel.rtc,
+                    sample.SensorPath(
+                        sample.Part.ESP8266_TX,
+                        None,
+                        sample.ESP8266TXSubpart(subpart),
+                    ),
+                    value,
+                )
+                for subpart, value in [
+                    ("acklocks-needed", 8),
+                    ("broadcasts", 6),
+                    ("dropped", 2),
+                    ("oom-dropped", 3),
+                    ("queue-overrun", 7),
+                    ("retransmitted", 5),
+                    ("sent", 1),
+                ]
+            ]
+        )
+
+
+class TestMessageBuilders(unittest.TestCase):
+    def test_status(self):
+        for status_version in range(7):
+            result = sbx_protocol.decode_sbx_message(
+                sbx_messages.pack_status(status_version)
+            )
+            self.assertEqual(result.uptime, 12345)
+            if status_version >= 1:
+                self.assertEqual(result.v1_compass_stream_state,
+                                 (13, 124, timedelta(milliseconds=64)))
+            if status_version >= 2:
+                self.assertEqual(
+                    [m.transaction_overruns for m in result.v2_i2c_metrics],
+                    [2, 3],
+                )
+            if status_version == 5:
+                self.assertEqual(len(result.v5_task_metrics.tasks), 3)
+            if status_version >= 6:
+                self.assertEqual(result.v6_cpu_metrics.sched, 97)
+
+    def test_sensor_stream(self):
+        values = [1000, 1000, 1255, 1256, 999, -20000, 1001, 1002, 1003]
+        result = sbx_protocol.decode_sbx_message(
+            bytes([sbx_protocol.MsgType.SENSOR_STREAM_ACCEL_Z.value]) +
+            sbx_protocol.SensorStreamMessage._header.pack(7, 1000) +
+            sbx_messages.compress_stream(1000, values[1:])
+        )
+        self.assertEqual(result.seq, 7)
+        self.assertEqual(result.data, values)
+
+    def test_sensor_messages(self):
+        cases = [
+            (sbx_messages.pack_ds18b20(), sbx_protocol.DS18B20Message, 4),
+            (sbx_messages.pack_light(), sbx_protocol.LightMessage, 32),
+            (sbx_messages.pack_noise(), sbx_protocol.NoiseMessage, 24),
+            (sbx_messages.pack_bme280(), sbx_protocol.BME280Message, 3),
+        ]
+        for buf, cls, nsamples in cases:
+            result = sbx_protocol.decode_sbx_message(buf)
+            self.assertIsInstance(result, cls)
+            self.assertEqual(len(list(result.get_samples())), nsamples)
+
+    def test_bme280(self):
+        result = sbx_protocol.decode_sbx_message(
+            sbx_messages.pack_bme280(instance=1)
+        )
+        self.assertEqual(result.instance, 1)
+        self.assertAlmostEqual(result.temperature, 25.08, places=2)
+        self.assertAlmostEqual(result.pressure, 100653.27, places=1)
+
+    def test_esp_status(self):
+        result = sbx_protocol.ESPStatusMessage.from_buf(
+            unittest.mock.sentinel.rtc,
+            sbx_messages.pack_esp_status(),
+        )
+        self.assertEqual(result.tx_sent, 10000)
+        self.assertEqual(len(list(result.get_samples())), 8)
+
+
+class TestSBXClient(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.frames = [
+            sbx_protocol.data_frame_header_fmt.pack(
+                1000 + i,
+                sbx_protocol.DataFrameType.SBX.value,
+            ) + buf
+            for i, buf in enumerate([
+                sbx_messages.pack_status(4),
+                sbx_messages.pack_bme280(),
+                b"\xfe",
+                sbx_messages.pack_light(),
+            ])
+        ]
+        self.frames.append(
+            sbx_protocol.data_frame_header_fmt.pack(
+                2000,
+                sbx_protocol.DataFrameType.ESP_STATUS.value,
+            ) + sbx_messages.pack_esp_status()
+        )
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _receive(self, make_pool=None):
+        received = []
+
+        async def test():
+            client = sbx_protocol.SBXClient(
+                unittest.mock.Mock(),
+                decode_pool=make_pool() if make_pool else None,
+            )
+            client.on_message.connect(
+                lambda rtc, obj: received.append((rtc, type(obj)))
+            )
+            try:
+                for frame in self.frames:
+                    client._on_datagram(frame)
+                while len(received) < len(self.frames) - 1:
+                    await asyncio.sleep(0.001)
+            finally:
+                client._resync_task.cancel()
+            return client
+
+        client = self.loop.run_until_complete(asyncio.wait_for(test(), 5))
+        return client, received
+
+    def test_decodes_in_callback(self):
+        client, received = self._receive()
+        self.assertEqual(
+            [type_ for _, type_ in received],
+            [sbx_protocol.StatusMessage,
+             sbx_protocol.BME280Message,
+             sbx_protocol.LightMessage,
+             sbx_protocol.ESPStatusMessage],
+        )
+        self.assertEqual(received[0][0], datetime.utcfromtimestamp(1000))
+        self.assertEqual(client.rx_decode_errors["SBX"], 1)
+        self.assertEqual(client.rx_messages["ESP_STATUS"], 1)
+
+    def test_emits_frames_which_decode_again(self):
+        frames = []
+
+        async def test():
+            client = sbx_protocol.SBXClient(unittest.mock.Mock())
+            client.on_message_frame.connect(
+                lambda frame, rtc, obj: frames.append((frame, rtc, obj))
+            )
+            try:
+                for frame in self.frames:
+                    client._on_datagram(frame)
+            finally:
+                client._resync_task.cancel()
+            return client
+
+        client = self.loop.run_until_complete(test())
+        self.assertEqual(len(frames), len(self.frames) - 1)
+        for frame, rtc, obj in frames:
+            self.assertIn(bytes(frame), self.frames)
+            decoded_rtc, decoded = client.decode_frame(bytes(frame))
+            self.assertEqual(decoded_rtc, rtc)
+            self.assertIsInstance(decoded, type(obj))
+
+    def test_decodes_in_pool(self):
+        _, expected = self._receive()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            client, received = self._receive(
+                lambda: decode_pool.DecodePool(
+                    sbx_protocol.decode_data_frame,
+                    executor,
+                    batch_size=2,
+                )
+            )
+        self.assertEqual(received, expected)
+        self.assertEqual(client.rx_decode_errors["SBX"], 1)
+
+    def test_clients_share_pool(self):
+        received = []
+
+        async def test():
+            pool = decode_pool.DecodePool(
+                sbx_protocol.decode_data_frame,
+                executor,
+                batch_size=3,
+            )
+            clients = [
+                sbx_protocol.SBXClient(unittest.mock.Mock(), decode_pool=pool)
+                for i in range(2)
+            ]
+            for i, client in enumerate(clients):
+                client.on_message.connect(
+                    lambda rtc, obj, i=i: received.append((i, type(obj)))
+                )
+            try:
+                clients[0]._on_datagram(self.frames[1])
+                clients[1]._on_datagram(self.frames[4])
+                clients[0]._on_datagram(self.frames[3])
+                while len(received) < 3:
+                    await asyncio.sleep(0.001)
+            finally:
+                for client in clients:
+                    client._resync_task.cancel()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            self.loop.run_until_complete(asyncio.wait_for(test(), 5))
+        self.assertEqual(received, [
+            (0, sbx_protocol.BME280Message),
+            (1, sbx_protocol.ESPStatusMessage),
+            (0, sbx_protocol.LightMessage),
+        ])
+
+    def test_close_stops_processing(self):
+        received = []
+
+        async def test():
+            protocol = datagram_stream.DatagramStreamProtocol(
+                sbx_protocol.SENDER_PORT,
+            )
+            client = sbx_protocol.SBXClient(protocol)
+            client.on_message.connect(
+                lambda rtc, obj: received.append(type(obj))
+            )
+            protocol.on_data_received(self.frames[1])
+            client.close()
+            protocol.on_data_received(self.frames[3])
+            await asyncio.sleep(0)
+            self.assertTrue(client._resync_task.cancelled())
+
+        self.loop.run_until_complete(test())
+        self.assertEqual(received, [sbx_protocol.BME280Message])
@@ -0,0 +1,160 @@
+import os
+import unittest
+
+from datetime import timedelta
+
+import sn2daemon.sbx_protocol as sbx_protocol
+import sn2daemon.sbx_views as sbx_views
+
+import _sn2d_comm
+
+from .sbx_messages import make_message
+
+
+class TestDecodeSBXMessage(unittest.TestCase):
+    def test_status(self):
+        buf, struct = make_message(
+            _sn2d_comm.lib.STATUS,
+            "struct sbx_msg_status_t",
+        )
+        struct.payload.status.rtc = 12345678
+        struct.payload.status.uptime = 12345
+        struct.payload.status.protocol_version = 1
+        struct.payload.status.status_version = 4
+        struct.payload.status.imu.stream_state[0].sequence_number = 12
+        struct.payload.status.imu.stream_state[0].timestamp = 123
+        struct.payload.status.imu.stream_state[0].period = 5
+        struct.payload.status.imu.stream_state[1].sequence_number = 13
+        struct.payload.status.imu.stream_state[1].timestamp = 124
+        struct.payload.status.imu.stream_state[1].period = 64
+        struct.payload.status.i2c_metrics[0].transaction_overruns = 2
+        struct.payload.status.i2c_metrics[1].transaction_overruns = 3
+        struct.payload.status.bme280_metrics[0].configure_status = 0x12
+        struct.payload.status.bme280_metrics[0].timeouts = 20
+        struct.payload.status.bme280_metrics[1].configure_status = 0x34
+        struct.payload.status.bme280_metrics[1].timeouts = 1204
+        buf = bytes(buf)
+
+        view = sbx_views.decode_sbx_message(buf)
+        expected = sbx_protocol.decode_sbx_message(buf)
+
+        self.assertIsInstance(view, sbx_views.StatusView)
+        self.assertIsInstance(view, sbx_protocol.StatusMessage)
+        self.assertEqual(view.type_, sbx_protocol.MsgType.STATUS)
+        self.assertEqual(view.uptime, 12345)
+        self.assertEqual(view.v1_accel_stream_state,
+                         (12, 123, timedelta(milliseconds=5)))
+        self.assertEqual(view.v1_compass_stream_state,
+                         expected.v1_compass_stream_state)
+        self.assertNotIn("v2_i2c_metrics", view.__dict__)
+
+        self.assertEqual(
+            [m.transaction_overruns for m in view.v2_i2c_metrics],
+            [2, 3],
+        )
+        self.assertEqual(
+            [(m.configure_status, m.timeouts)
+             for m in view.v4_bme280_metrics],
+            [(0x12, 20), (0x34, 1204)],
+        )
+        self.assertIsNone(view.v5_tx_metrics)
+
+    def test_status_rejects_unsupported_versions(self):
+        buf, struct = make_message(
+            _sn2d_comm.lib.STATUS,
+            "struct sbx_msg_status_t",
+        )
+        struct.payload.status.protocol_version = 2
+        with self.assertRaisesRegex(ValueError, "unsupported protocol"):
+            sbx_views.decode_sbx_message(bytes(buf))
+
+        struct.payload.status.protocol_version = 1
+        struct.payload.status.status_version = 7
+        with self.assertRaisesRegex(ValueError, "unsupported status"):
+            sbx_views.decode_sbx_message(bytes(buf))
+
+    def test_status_rejects_short_buffer(self):
+        buf = bytes([_sn2d_comm.lib.STATUS]) + \
+            sbx_protocol.StatusMessage._base_header.pack(0, 0, 1, 1)
+        with self.assertRaisesRegex(ValueError, "too short"):
+            sbx_views.decode_sbx_message(buf)
+
+    def test_ds18b20(self):
+        buf, struct = make_message(
+            _sn2d_comm.lib.SENSOR_DS18B20,
+            "uint16_t",
+            _sn2d_comm.ffi.sizeof("struct sbx_msg_ds18b20_sample_t")*2
+        )
+        struct.payload.ds18b20.timestamp = 12345
+        struct.payload.ds18b20.samples[0].id = b"01234567"
+        struct.payload.ds18b20.samples[0].raw_value = 1234
+        struct.payload.ds18b20.samples[1].id = b"abcdefgh"
+        struct.payload.ds18b20.samples[1].raw_value = -100
+        buf = bytes(buf)
+
+        view = sbx_views.decode_sbx_message(buf)
+        expected = sbx_protocol.decode_sbx_message(buf)
+
+        self.assertIsInstance(view, sbx_protocol.DS18B20Message)
+        self.assertEqual(view.timestamp, 12345)
+        self.assertEqual(view.samples, expected.samples)
+        self.assertSequenceEqual(
+            list(view.get_samples()),
+            list(expected.get_samples()),
+        )
+
+    def test_light(self):
+        buf, struct = make_message(
+            _sn2d_comm.lib.SENSOR_LIGHT,
+            "struct sbx_msg_light_sample_t",
+            _sn2d_comm.ffi.sizeof("struct sbx_msg_light_sample_t")*3
+        )
+        for i in range(4):
+            struct.payload.light.samples[i].timestamp = i*1000
+            for c in range(4):
+                struct.payload.light.samples[i].ch[c] = i*100+c*4
+        buf = bytes(buf)
+
+        view = sbx_views.decode_sbx_message(buf)
+        expected = sbx_protocol.decode_sbx_message(buf)
+
+        self.assertIsInstance(view, sbx_protocol.LightMessage)
+        self.assertEqual(len(view.samples), 4)
+        self.assertEqual(view.samples, expected.samples)
+        self.assertSequenceEqual(
+            list(view.get_samples()),
+            list(expected.get_samples()),
+        )
+
+    def test_sensor_stream(self):
+        buf, struct = make_message(
+            _sn2d_comm.lib.SENSOR_STREAM_ACCEL_Y,
+            "struct sbx_msg_sensor_stream_t",
+            9,
+        )
+        struct.payload.sensor_stream.seq = 123
+        struct.payload.sensor_stream.average = -18
+        # one bitmap byte announcing eight single-byte differences
+        buf[-9:] = b"\xff" + os.urandom(8)
+        buf = bytes(buf)
+
+        view = sbx_views.decode_sbx_message(buf)
+        expected = sbx_protocol.decode_sbx_message(buf)
+
+        self.assertIsInstance(view, sbx_protocol.SensorStreamMessage)
+        self.assertEqual(view.type_,
+                         sbx_protocol.MsgType.SENSOR_STREAM_ACCEL_Y)
+        self.assertEqual(view.seq, 123)
+        self.assertEqual(view.data, expected.data)
+        self.assertEqual(view.path, expected.path)
+
+    def test_falls_back_to_struct_decoders(self):
+        buf = bytes([_sn2d_comm.lib.SENSOR_NOISE, 1]) + bytes(10)
+        self.assertIsInstance(
+            sbx_views.decode_sbx_message(buf),
+            sbx_protocol.NoiseMessage,
+        )
+
+    def test_rejects_unknown_type(self):
+        with self.assertRaisesRegex(ValueError, "unknown message type"):
+            sbx_views.decode_sbx_message(b"\xfe\x00")
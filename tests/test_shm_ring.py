@@ -0,0 +1,87 @@
+import multiprocessing
+import unittest
+
+import sn2daemon.shm_ring as shm_ring
+
+
+def _consume(name, n, queue):
+    ring = shm_ring.RingBuffer.attach(name)
+    try:
+        records = []
+        while len(records) < n:
+            record = ring.get()
+            if record is not None:
+                records.append(record)
+        queue.put(records)
+    finally:
+        ring.close()
+
+
+class TestRingBuffer(unittest.TestCase):
+    def setUp(self):
+        self.ring = shm_ring.RingBuffer.create(16 + 64)
+        self.addCleanup(self.ring.close)
+
+    def test_empty(self):
+        self.assertIsNone(self.ring.get())
+        self.assertEqual(len(self.ring), 0)
+        self.assertEqual(self.ring.capacity, 64)
+
+    def test_fifo(self):
+        for record in [b"foo", b"", b"bar" * 5]:
+            self.assertTrue(self.ring.put(record))
+        self.assertEqual(len(self.ring), 4 * 3 + 3 + 15)
+        self.assertEqual(self.ring.get(), b"foo")
+        self.assertEqual(self.ring.get(), b"")
+        self.assertEqual(self.ring.get(), b"bar" * 5)
+        self.assertIsNone(self.ring.get())
+
+    def test_full(self):
+        self.assertTrue(self.ring.put(b"x" * 40))
+        self.assertFalse(self.ring.put(b"y" * 20))
+        self.assertEqual(self.ring.get(), b"x" * 40)
+        self.assertTrue(self.ring.put(b"y" * 20))
+
+    def test_fits(self):
+        self.assertTrue(self.ring.fits(28))
+        self.assertFalse(self.ring.fits(29))
+        self.assertFalse(self.ring.put(b"z" * 61))
+
+    def test_wraps_around(self):
+        # record sizes which leave tails with and without room for a marker
+        for size in [10, 23, 1, 28, 7, 17, 0, 25, 5] * 20:
+            record = bytes([size]) * size
+            self.assertTrue(self.ring.put(record), size)
+            self.assertEqual(self.ring.get(), record)
+            self.assertEqual(len(self.ring), 0)
+
+    def test_interleaved_wrap(self):
+        expected = []
+        received = []
+        for i in range(200):
+            record = bytes([i % 256]) * (i % 13)
+            while not self.ring.put(record):
+                received.append(self.ring.get())
+            expected.append(record)
+        while True:
+            record = self.ring.get()
+            if record is None:
+                break
+            received.append(record)
+        self.assertEqual(received, expected)
+
+    def test_across_processes(self):
+        context = multiprocessing.get_context("spawn")
+        queue = context.Queue()
+        process = context.Process(
+            target=_consume,
+            args=(self.ring.name, 50, queue),
+        )
+        process.start()
+        records = [str(i).encode() * 3 for i in range(50)]
+        for record in records:
+            while not self.ring.put(record):
+                pass
+        self.assertEqual(queue.get(timeout=30), records)
+        process.join(30)
+        self.assertEqual(process.exitcode, 0)
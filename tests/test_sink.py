@@ -0,0 +1,66 @@
+import asyncio
+import unittest
+import unittest.mock
+
+import sn2daemon.metrics as metrics
+import sn2daemon.sink as sink
+
+
+class TestBatchingSink(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.sinks = [unittest.mock.Mock(), unittest.mock.Mock()]
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _sink(self, **kwargs):
+        return sink.BatchingSink(self.sinks, loop=self.loop, **kwargs)
+
+    def test_passes_batches_on_after_window(self):
+        batcher = self._sink(window=0.02)
+
+        async def test():
+            batcher.submit_batches([1, 2])
+            batcher.submit_batches([])
+            batcher.submit_batch(3)
+            self.assertEqual(batcher.queue_depth, 3)
+            for sink_ in self.sinks:
+                sink_.submit_batches.assert_not_called()
+            await asyncio.sleep(0.05)
+
+        self.loop.run_until_complete(test())
+        for sink_ in self.sinks:
+            sink_.submit_batches.assert_called_once_with([1, 2, 3])
+        self.assertEqual((batcher.submits, batcher.batches, batcher.flushes),
+                         (2, 3, 1))
+        self.assertEqual(batcher.latency.count, 2)
+        self.assertGreaterEqual(batcher.latency.sum, 0.02)
+
+    def test_passes_batches_on_at_max_batches(self):
+        batcher = self._sink(window=10, max_batches=3)
+        batcher.submit_batches([1, 2])
+        batcher.submit_batches([3, 4])
+        batcher.submit_batches([5])
+        self.sinks[0].submit_batches.assert_called_once_with([1, 2, 3, 4])
+        self.assertEqual(batcher.queue_depth, 1)
+
+        batcher.close()
+        self.assertEqual(self.sinks[0].submit_batches.mock_calls, [
+            unittest.mock.call([1, 2, 3, 4]),
+            unittest.mock.call([5]),
+        ])
+        self.assertEqual(batcher.queue_depth, 0)
+
+    def test_register_metrics(self):
+        batcher = self._sink()
+        batcher.submit_batches([1])
+        batcher.submit_batches([2])
+        batcher.flush()
+        registry = metrics.Registry()
+        batcher.register_metrics(registry)
+        rendered = registry.render()
+        self.assertIn("\nsn2d_sink_batching_submits_total 2\n", rendered)
+        self.assertIn("\nsn2d_sink_batching_flushes_total 1\n", rendered)
+        self.assertIn("\nsn2d_sink_batching_latency_seconds_count 2\n",
+                      rendered)
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import pathlib
+import tempfile
+import unittest
+import unittest.mock
+
+from datetime import datetime, timedelta
+
+import sn2daemon.metrics as metrics
+import sn2daemon.sensor_stream as sensor_stream
+import sn2daemon.shm_ring as shm_ring
+import sn2daemon.uplink as uplink
+
+from hintlib import sample
+
+
+def make_batch(i):
+    return sample.SampleBatch(
+        timestamp=datetime(2020, 1, 1) + timedelta(seconds=i),
+        bare_path=sample.SensorPath("bme280", 0, None),
+        samples={"temp": 20.0 + i},
+    )
+
+
+class TestRingSender(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.ring = shm_ring.RingBuffer.create(4096)
+        self.logger = logging.getLogger("test_uplink")
+        self.logger.disabled = True
+        self.sinks = [unittest.mock.Mock(), unittest.mock.Mock()]
+        self.stream_service = unittest.mock.Mock()
+        self.uplink = uplink.Uplink(
+            self.ring, {}, self.sinks, self.stream_service,
+            logger=self.logger,
+        )
+
+    def tearDown(self):
+        self.ring.close()
+        self.loop.close()
+
+    def _sender(self, **kwargs):
+        return uplink.RingSender(self.ring, logger=self.logger, **kwargs)
+
+    def test_forwards_batches_to_all_sinks(self):
+        sender = self._sender()
+        sender.submit_batches([make_batch(0), make_batch(1)])
+        sender.submit_batch(make_batch(2))
+        sender.submit_batches([])
+        self.assertEqual(sender.sent, 2)
+
+        self.assertEqual(self.uplink.process(10), 2)
+        for sink in self.sinks:
+            self.assertEqual(sink.submit_batches.mock_calls, [
+                unittest.mock.call([make_batch(0), make_batch(1)]),
+                unittest.mock.call([make_batch(2)]),
+            ])
+
+    def test_forwards_stream_blocks_with_handle(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "block"
+            path.write_bytes(b"data")
+            sender = self._sender()
+            sender.submit_block((
+                "path", datetime(2020, 1, 1), 12, timedelta(milliseconds=5),
+                [1, 2, 3], 2, sensor_stream.Buffer._Handle(path),
+            ))
+            self.uplink.process(10)
+
+            (_, (item,), _), = self.stream_service.submit_block.mock_calls
+            *fields, handle = item
+            self.assertEqual(fields, [
+                "path", datetime(2020, 1, 1), 12, timedelta(milliseconds=5),
+                [1, 2, 3], 2,
+            ])
+            self.assertTrue(path.exists())
+            handle.close()
+            self.assertFalse(path.exists())
+
+    def test_holds_back_while_ring_is_full(self):
+        async def test():
+            sender = self._sender(max_pending=3, retry_interval=0.001)
+            for i in range(40):
+                sender.submit_batch(make_batch(i))
+            self.assertEqual(sender.queue_depth, 3)
+            dropped = sender.dropped
+            self.assertGreater(dropped, 0)
+
+            received = []
+            for sink in self.sinks[:1]:
+                sink.submit_batches.side_effect = received.extend
+            while len(received) < 40 - dropped:
+                self.uplink.process(100)
+                await asyncio.sleep(0.001)
+            self.assertEqual(sender.queue_depth, 0)
+            # the oldest held back records were dropped
+            self.assertEqual(received[-3:],
+                             [make_batch(i) for i in range(37, 40)])
+            sender.close()
+
+        self.loop.run_until_complete(asyncio.wait_for(test(), 5))
+
+    def test_close_drops_held_back_records(self):
+        async def test():
+            sender = self._sender()
+            for i in range(40):
+                sender.submit_batch(make_batch(i))
+            pending = sender.queue_depth
+            self.assertGreater(pending, 0)
+            dropped = sender.dropped
+            self.assertFalse(await sender.drain(0.01))
+            sender.close()
+            self.assertEqual(sender.queue_depth, 0)
+            self.assertEqual(sender.dropped, dropped + pending)
+
+        self.loop.run_until_complete(asyncio.wait_for(test(), 5))
+
+    def test_shutdown_passes_records_on_before_terminating(self):
+        received = []
+        self.sinks[0].submit_batches.side_effect = received.extend
+        process = uplink.UplinkProcess({}, self.ring, logger=self.logger)
+        child = unittest.mock.Mock()
+        child.is_alive.return_value = True
+        child.terminate.side_effect = \
+            lambda: self.assertEqual((len(self.ring), len(received)),
+                                     (0, 40))
+        process._process = child
+
+        async def consume():
+            while True:
+                self.uplink.process(4)
+                await asyncio.sleep(0.001)
+
+        async def test():
+            sender = self._sender(max_pending=64, retry_interval=0.001)
+            for i in range(40):
+                sender.submit_batch(make_batch(i))
+            self.assertGreater(sender.queue_depth, 0)
+            consumer = asyncio.ensure_future(consume())
+            try:
+                await uplink.shutdown(sender, process, timeout=5)
+            finally:
+                consumer.cancel()
+            self.assertEqual(sender.dropped, 0)
+
+        self.loop.run_until_complete(asyncio.wait_for(test(), 10))
+        child.terminate.assert_called_once_with()
+        self.assertEqual(received, [make_batch(i) for i in range(40)])
+
+    def test_drops_records_larger_than_ring(self):
+        sender = self._sender()
+        sender.submit_batch(sample.SampleBatch(
+            timestamp=datetime(2020, 1, 1),
+            bare_path=sample.SensorPath("bme280", 0, None),
+            samples={str(i): i for i in range(1000)},
+        ))
+        self.assertEqual((sender.sent, sender.dropped), (0, 1))
+
+    def test_skips_broken_records(self):
+        self.ring.put(b"garbage")
+        self._sender().submit_batch(make_batch(0))
+        self.assertEqual(self.uplink.process(10), 2)
+        self.sinks[0].submit_batches.assert_called_once_with([make_batch(0)])
+
+    def test_register_metrics(self):
+        sender = self._sender()
+        sender.submit_batch(make_batch(0))
+        registry = metrics.Registry()
+        sender.register_metrics(registry)
+        rendered = registry.render()
+        self.assertIn("\nsn2d_uplink_records_sent_total 1\n", rendered)
+        self.assertIn("\nsn2d_uplink_records_pending 0\n", rendered)